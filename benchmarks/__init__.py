@@ -0,0 +1,9 @@
+# encoding:utf-8
+# file: __init__.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 核心热点路径的基准测试
+# ##########################
@@ -0,0 +1,310 @@
+# encoding:utf-8
+# file: bench.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 基准测试 python -m benchmarks.bench run|compare|repaint
+# ##########################
+
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from tetris import tetris as frontend
+from tetris.ai import Planner
+from tetris.engine import TetrisEngine
+from tetris.render import SCROLL_MODES
+
+from .fixtures import FIXTURES, make_board, restore_board
+
+
+# 仓库中保存的基线结果
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class NullSink(object):
+    """内存中的输出流 只统计写入字节数 代替终端"""
+
+    def __init__(self):
+        self.bytes, self.writes = 0, 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+def _engine(fixture):
+    """生成一个地图为样本状态 当前方块为T的引擎"""
+    engine = TetrisEngine(seed=0)
+    restore_board(engine.board, fixture)
+    engine.piece.reset('T', engine.spawn_x, engine.spawn_y)
+    return engine
+
+
+def bench_collide_down(fixture):
+    engine = _engine(fixture)
+    piece = engine.piece
+    return None, lambda: engine.fits(piece.rot, piece.x, piece.y + 1)
+
+
+def bench_collide_side(fixture):
+    engine = _engine(fixture)
+    piece = engine.piece
+    return None, lambda: engine.fits(piece.rot, piece.x - 1, piece.y)
+
+
+def bench_collide_rotate(fixture):
+    engine = _engine(fixture)
+    piece = engine.piece
+    return None, lambda: engine.fits((piece.rot + 1) & 3, piece.x, piece.y)
+
+
+def bench_drop_distance(fixture):
+    engine = _engine(fixture)
+    return None, engine.drop_distance
+
+
+def bench_rotate(fixture):
+    engine = _engine(fixture)
+    return None, lambda: engine.step('to_u')
+
+
+def bench_eliminate(fixture):
+    # 检查底部4行 即方块固定在最底部时所占的行
+    engine = _engine(fixture)
+    ys = range(engine.height - 4, engine.height)
+    return (lambda: restore_board(engine.board, fixture)), lambda: engine._eliminate(ys)
+
+
+def bench_snapshot(fixture):
+    # 每次快照之前改动底部一行 即固定一个方块之后的快照
+    engine = _engine(fixture)
+    board, y = engine.board, engine.height - 1
+    return (lambda: board.fill(0, y, 1)), engine.snapshot
+
+
+def bench_restore(fixture):
+    # 恢复到固定方块之前
+    engine = _engine(fixture)
+    board, y, snap = engine.board, engine.height - 1, engine.snapshot()
+    return (lambda: board.fill(0, y, 1)), lambda: engine.restore(snap)
+
+
+def bench_print_map_area(fixture):
+    # 每次都强制全部重绘 即消行后的全地图刷新
+    restore_board(frontend.ENGINE.board, fixture)
+    frontend.SCREEN.out = NullSink()
+
+    def op():
+        frontend.print_map_area(frontend.GAME_AREA_X, frontend.GAME_AREA_Y)
+        frontend.SCREEN.flush()
+    return frontend.SCREEN.invalidate, op
+
+
+def bench_tick(fixture):
+    # 主循环的一个tick 打印信息 方块下落一格 输出一帧
+    engine = frontend.ENGINE
+    frontend.SCREEN.out = NullSink()
+
+    def setup():
+        restore_board(engine.board, fixture)
+        engine.game_over = False
+        engine.piece.reset('T', engine.spawn_x, engine.spawn_y)
+
+    def op():
+        frontend.print_info()
+        frontend.move_block('to_d')
+        frontend.SCREEN.flush()
+    return setup, op
+
+
+# 基准名 => 生成(准备函数, 被测函数)的函数 准备函数不计时
+BENCHMARKS = {
+    'collide_down': bench_collide_down,
+    'collide_side': bench_collide_side,
+    'collide_rotate': bench_collide_rotate,
+    'drop_distance': bench_drop_distance,
+    'rotate': bench_rotate,
+    'eliminate': bench_eliminate,
+    'snapshot': bench_snapshot,
+    'restore': bench_restore,
+    'print_map_area': bench_print_map_area,
+    'tick': bench_tick,
+}
+
+
+def _percentile(samples, q):
+    """已排序样本的q分位数"""
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def measure(setup, op, duration=0.5, max_samples=200000):
+    """
+    逐次计时 每次调用前执行不计时的准备函数
+    :param setup: 准备函数 可以为None
+    :param op: 被测函数
+    :param duration: 测量时长 秒
+    :param max_samples: 样本数上限
+    :return: 结果字典 时间单位为纳秒
+    """
+    clock = time.perf_counter_ns
+    # 计时器本身的开销 从每个样本中扣除
+    overhead = min(-(clock() - clock()) for _ in range(1000))
+    samples = []
+    end = time.perf_counter() + duration
+    while len(samples) < max_samples and time.perf_counter() < end:
+        for _ in range(100):
+            if setup is not None:
+                setup()
+            t = clock()
+            op()
+            samples.append(max(clock() - t - overhead, 1))
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    return {
+        'n': len(samples),
+        'ops_per_sec': 1e9 / mean,
+        'mean_ns': mean,
+        'p50_ns': _percentile(samples, 0.50),
+        'p90_ns': _percentile(samples, 0.90),
+        'p99_ns': _percentile(samples, 0.99),
+    }
+
+
+def run(names=None, duration=0.5, out=sys.stderr):
+    """
+    运行基准测试 每个基准在每个地图样本上各测一次
+    :param names: 基准名列表 None为全部
+    :param duration: 每项测量时长
+    :param out: 进度输出流
+    :return: 结果字典
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        for kind in FIXTURES:
+            setup, op = BENCHMARKS[name](make_board(kind))
+            key = '{}/{}'.format(name, kind)
+            results[key] = r = measure(setup, op, duration)
+            out.write('{:<28} {:>12,.0f} ops/s  p50 {:>8,} ns  p99 {:>8,} ns\n'.format(
+                key, r['ops_per_sec'], r['p50_ns'], r['p99_ns']))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.25):
+    """
+    与基线比较 吞吐量下降超过threshold的项为退化
+    :param current: 本次结果
+    :param baseline: 基线结果
+    :param threshold: 允许的下降比例
+    :return: [(基准名, 基线ops/s, 本次ops/s, 变化比例)] 只含退化项
+    """
+    regressions = []
+    for key, base in sorted(baseline['results'].items()):
+        cur = current['results'].get(key)
+        if cur is None:
+            continue
+        change = cur['ops_per_sec'] / base['ops_per_sec'] - 1
+        if change < -threshold:
+            regressions.append((key, base['ops_per_sec'], cur['ops_per_sec'], change))
+    return regressions
+
+
+def repaint(pieces=300, seed=0):
+    """
+    终端版自动玩一局 每个按键输出一帧 对每种滚动方式统计消行帧与全部帧的输出字节数
+    各方式的方块序列与按键完全相同 只有输出不同
+    :param pieces: 方块数
+    :param seed: 随机数种子
+    :return: {滚动方式: (消行帧数, 消行帧总字节数, 帧数, 总字节数)}
+    """
+    engine, screen = frontend.ENGINE, frontend.SCREEN
+    planner = Planner(engine.width, engine.height, lookahead=False)
+    results = {}
+    for mode in SCROLL_MODES:
+        screen.out, screen.scroll = NullSink(), mode
+        engine.reset(seed)
+        screen.invalidate()
+        frontend.draw_edge()
+        frontend.draw_background()
+        frontend.print_preview()
+        frontend.print_piece()
+        screen.flush()
+        clear_frames = clear_bytes = frames = total = 0
+        while engine.count < pieces and not engine.game_over:
+            move = planner.best(engine)
+            if move is None:
+                break
+            for key in planner.keys(engine, *move) + ['x']:
+                score = engine.score
+                frontend.KEY = key
+                frontend.game_tick()
+                n = screen.flush()
+                frames, total = frames + 1, total + n
+                if engine.score != score:
+                    clear_frames, clear_bytes = clear_frames + 1, clear_bytes + n
+        results[mode] = (clear_frames, clear_bytes, frames, total)
+    screen.scroll = None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench', description='核心热点路径基准测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help='运行基准测试 结果写为JSON')
+    p_run.add_argument('-o', '--output', default='-', help='结果文件 -为标准输出')
+    p_run.add_argument('-b', '--bench', action='append', choices=sorted(BENCHMARKS), help='只运行指定基准')
+    p_run.add_argument('-t', '--duration', type=float, default=0.5, help='每项测量时长 秒')
+    p_cmp = sub.add_parser('compare', help='与基线比较 有退化时退出码为1')
+    p_cmp.add_argument('current', help='本次结果文件')
+    p_cmp.add_argument('--baseline', default=BASELINE, help='基线结果文件')
+    p_cmp.add_argument('--threshold', type=float, default=0.25, help='允许的吞吐量下降比例')
+    p_rep = sub.add_parser('repaint', help='比较消行时各滚动方式的输出字节数')
+    p_rep.add_argument('-n', '--pieces', type=int, default=300, help='方块数')
+    p_rep.add_argument('-s', '--seed', type=int, default=0, help='随机数种子')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        data = json.dumps(run(args.bench, args.duration), indent=2, sort_keys=True) + '\n'
+        if args.output == '-':
+            sys.stdout.write(data)
+        else:
+            with open(args.output, 'w') as f:
+                f.write(data)
+        return 0
+    if args.command == 'repaint':
+        for mode, (clear_frames, clear_bytes, frames, total) in repaint(args.pieces, args.seed).items():
+            print('{:<6} {:>5} clear frames {:>8,.0f} bytes/clear  {:>7} frames {:>6,.0f} bytes/frame'.format(
+                mode or 'off', clear_frames, clear_bytes / clear_frames if clear_frames else 0.0,
+                frames, total / frames if frames else 0.0))
+        return 0
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.threshold)
+    for key, base, cur, change in regressions:
+        print('REGRESSION {:<28} {:>12,.0f} -> {:>12,.0f} ops/s ({:+.0%})'.format(key, base, cur, change))
+    if not regressions:
+        print('no regressions against {}'.format(args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# encoding:utf-8
+# file: fixtures.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 基准测试用的地图样本
+# ##########################
+
+
+import random
+
+from tetris.board import Board
+
+
+# 样本名 空地图 半满 锯齿 接近满且有多个可消除行
+FIXTURES = ('empty', 'half', 'jagged', 'nearfull')
+
+
+def make_board(kind, width=16, height=26, seed=0):
+    """
+    生成地图样本 同样的参数总是生成同样的地图
+    :param kind: 样本名 见FIXTURES
+    :param width: 地图长
+    :param height: 地图高
+    :param seed: 随机数种子
+    :return: Board
+    """
+    rng = random.Random(seed)
+    board = Board(width, height)
+
+    def fill_row(y, holes):
+        for x in range(width):
+            if x not in holes:
+                board.fill(x, y, rng.randint(1, 7))
+
+    if kind == 'empty':
+        pass
+    elif kind == 'half':
+        # 下半部分每行留一个洞 没有满行
+        for y in range(height // 2, height):
+            fill_row(y, {rng.randrange(width)})
+    elif kind == 'jagged':
+        # 每列高度随机 列与列之间落差大
+        for x in range(width):
+            for y in range(height - rng.randint(0, height * 2 // 3), height):
+                board.fill(x, y, rng.randint(1, 7))
+    elif kind == 'nearfull':
+        # 只剩顶部几行 底部4行已满可消除 其余行各留一个洞
+        for y in range(6, height):
+            fill_row(y, set() if y >= height - 4 else {rng.randrange(width)})
+    else:
+        raise ValueError('unknown fixture: {}'.format(kind))
+    return board
+
+
+def restore_board(board, fixture):
+    """
+    把地图恢复为样本状态 不重新分配内存
+    :param board: 被修改过的地图
+    :param fixture: 样本地图
+    :return: None
+    """
+    board.load(fixture.rows, fixture.colors)
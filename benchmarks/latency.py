@@ -0,0 +1,341 @@
+# encoding:utf-8
+# file: latency.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 端到端延迟测试 在伪终端中运行终端版 按计划时间注入按键 解析输出流
+# python -m benchmarks.latency
+# ##########################
+
+
+import argparse
+import codecs
+import fcntl
+import json
+import os
+import pty
+import random
+import re
+import select
+import signal
+import struct
+import sys
+import termios
+import time
+import unicodedata
+
+from tetris import tetris as frontend
+
+
+# 终端版脚本路径 以脚本方式运行 与玩家的用法相同
+FRONTEND = os.path.abspath(frontend.__file__)
+# 有可见效果的按键 计算延迟 其余按键(空格暂停)只注入不计时
+TIMED_KEYS = 'adswx'
+# 两次读到输出的间隔超过此值 秒 算作新的一帧 前端每帧一次写入 大帧可能被伪终端分成几次读
+FRAME_GAP = 0.001
+_CSI = re.compile(r'\x1b\[([?\d;$]*)([@-~])')
+_CSI_PREFIX = re.compile(r'\x1b(\[[?\d;$]*)?\Z')
+
+
+class Terminal(object):
+    """
+    最小的终端模拟 只实现终端版用到的控制序列
+    光标定位 SGR 清屏 清行 上下与左右边距(DECSTBM DECSLRM)与插入删除行
+    每个单元记录(字符, SGR参数) 输出可以在任意位置被分块 不完整的转义序列与UTF-8字符留到下次
+    """
+
+    def __init__(self, cols=100, rows=40):
+        self.cols, self.rows = cols, rows
+        self.grid = [[(' ', '')] * cols for _ in range(rows)]
+        self.x = self.y = 0
+        self.sgr = ''
+        self.top, self.bottom, self.left, self.right = 0, rows - 1, 0, cols - 1
+        self.lrmm = False
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._pending = ''
+
+    def feed(self, data):
+        """
+        解析一段输出
+        :param data: bytes
+        :return: None
+        """
+        text = self._pending + self._decoder.decode(data)
+        self._pending = ''
+        i, n = 0, len(text)
+        while i < n:
+            j = text.find('\x1b', i)
+            if j < 0:
+                j = n
+            if j > i:
+                self._text(text[i:j])
+                i = j
+                continue
+            m = _CSI.match(text, i)
+            if m is None:
+                if _CSI_PREFIX.match(text, i):
+                    self._pending = text[i:]
+                    return
+                i += 1
+                continue
+            self._csi(m.group(1), m.group(2))
+            i = m.end()
+
+    def _text(self, text):
+        grid = self.grid
+        for ch in text:
+            if ch == '\n':
+                self.y = min(self.y + 1, self.rows - 1)
+                self.x = 0
+            elif ch == '\r':
+                self.x = 0
+            elif ch >= ' ':
+                wide = unicodedata.east_asian_width(ch) in 'WF'
+                if self.x < self.cols and self.y < self.rows:
+                    grid[self.y][self.x] = (ch, self.sgr)
+                    if wide and self.x + 1 < self.cols:
+                        grid[self.y][self.x + 1] = ('', self.sgr)
+                self.x += 2 if wide else 1
+
+    def _csi(self, params, final):
+        args = [int(a) if a else 0 for a in params.lstrip('?').split(';')] if params else []
+        private = params.startswith('?')
+        if final == 'H':
+            self.y = (args[0] if args and args[0] else 1) - 1
+            self.x = (args[1] if len(args) > 1 and args[1] else 1) - 1
+        elif final == 'm':
+            self.sgr = '' if params in ('', '0') else params
+        elif final == 'J' and args == [2]:
+            self.grid = [[(' ', self.sgr)] * self.cols for _ in range(self.rows)]
+        elif final == 'K' and self.y < self.rows:
+            row = self.grid[self.y]
+            row[self.x:] = [(' ', self.sgr)] * (self.cols - self.x)
+        elif final == 'r':
+            self.top = (args[0] if args and args[0] else 1) - 1
+            self.bottom = (args[1] if len(args) > 1 and args[1] else self.rows) - 1
+            self.x = self.y = 0
+        elif final == 's' and not private and self.lrmm:
+            self.left = (args[0] if args and args[0] else 1) - 1
+            self.right = (args[1] if len(args) > 1 and args[1] else self.cols) - 1
+            self.x = self.y = 0
+        elif final in 'hl' and params == '?69':
+            self.lrmm = final == 'h'
+            if not self.lrmm:
+                self.left, self.right = 0, self.cols - 1
+        elif final in 'LM' and self.top <= self.y <= self.bottom:
+            # 插入或删除行 只移动滚动区域内 左右边距之间的列
+            n = min(args[0] if args and args[0] else 1, self.bottom - self.y + 1)
+            lo, hi = self.left, self.right + 1
+            blank = [(' ', self.sgr)] * (hi - lo)
+            band = [row[lo:hi] for row in self.grid[self.y:self.bottom + 1]]
+            band = [blank] * n + band[:-n] if final == 'L' else band[n:] + [blank] * n
+            for k, seg in enumerate(band):
+                self.grid[self.y + k][lo:hi] = seg
+
+    def region(self, x, y, cols, rows):
+        """
+        矩形区域的内容 用于比较画面是否变化
+        :param x: 起始列 从0开始
+        :param y: 起始行 从0开始
+        :param cols: 列数
+        :param rows: 行数
+        :return: 元组
+        """
+        return tuple(tuple(row[x:x + cols]) for row in self.grid[y:y + rows])
+
+    def dump(self):
+        """画面文本 不含颜色"""
+        return '\n'.join(''.join(ch for ch, _ in row).rstrip() for row in self.grid)
+
+
+def make_script(n, seed=0, keys='adsw', pause_every=50):
+    """
+    生成按键脚本 每pause_every个按键插入一次暂停与恢复
+    :param n: 按键数
+    :param seed: 随机数种子
+    :param keys: 随机选取的按键
+    :param pause_every: 暂停间隔按键数 0为不暂停
+    :return: 按键字符串
+    """
+    rng = random.Random(seed)
+    script = []
+    for i in range(n):
+        if pause_every and i % pause_every == pause_every - 1:
+            script.append(frontend.KEY_PAUSE * 2)
+        else:
+            script.append(rng.choice(keys))
+    return ''.join(script)[:n]
+
+
+def _percentile(samples, q):
+    """已排序样本的q分位数"""
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+def _spawn(args, cols, rows):
+    """在伪终端中启动终端版 返回(进程号, 伪终端主端)"""
+    pid, fd = pty.fork()
+    if pid == 0:
+        fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+        os.environ['TERM'] = 'xterm'
+        os.execv(sys.executable, [sys.executable, FRONTEND] + args)
+    return pid, fd
+
+
+def _read(fd):
+    """读伪终端 子进程已退出时返回b''"""
+    try:
+        return os.read(fd, 65536)
+    except OSError:
+        return b''
+
+
+def run(script, gap=0.05, interval=1.0, seed=0, ai=False, scroll='off', warmup=0.5, tail=0.5,
+        cols=100, rows=40):
+    """
+    运行一次测试 按键从warmup秒起每gap秒注入一个 按下前先读完已有的输出
+    按下之后第一次看到游戏区域变化的时刻即该按键的延迟 在下个按键之前都没有变化的(如撞墙)不计入
+    按键之后紧接着到来的重力下落帧也会被当作响应 下落间隔远大于延迟时可以忽略
+    :param script: 按键脚本
+    :param gap: 按键间隔 秒
+    :param interval: 终端版的下落间隔 秒
+    :param seed: 终端版的种子
+    :param ai: 自动模式 只统计帧率与字节数 脚本应为空
+    :param scroll: 终端版的--scroll
+    :param warmup: 启动后等待初始画面的时间 秒
+    :param tail: 最后一个按键之后继续接收输出的时间 秒
+    :param cols: 伪终端列数
+    :param rows: 伪终端行数
+    :return: 结果字典 时间单位为毫秒
+    """
+    args = ['--seed', str(seed), '--interval', str(interval), '--scroll', scroll] + (['--ai'] if ai else [])
+    pid, fd = _spawn(args, cols, rows)
+    term = Terminal(cols, rows)
+    # 游戏区域在终端上的位置 1个小方块2列
+    area = ((frontend.GAME_AREA_X - 1) * 2, frontend.GAME_AREA_Y - 1, frontend.GAME_AREA_L * 2, frontend.GAME_AREA_H)
+    start = time.perf_counter()
+    t0 = start + warmup
+    end = t0 + len(script) * gap + tail
+    latencies, no_change, untimed, sent = [], 0, 0, 0
+    frames, total, last_read = 0, 0, 0.0
+    pending, exited = None, False
+
+    def receive(data, now):
+        nonlocal frames, total, last_read, pending
+        term.feed(data)
+        if now >= t0:
+            total += len(data)
+            if now - last_read > FRAME_GAP:
+                frames += 1
+        last_read = now
+        if pending is not None and term.region(*area) != pending[1]:
+            latencies.append((now - pending[0]) * 1000)
+            pending = None
+
+    try:
+        while not exited:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            due = t0 + sent * gap if sent < len(script) else end
+            if now >= due:
+                # 先读完已经到达的输出 画面为按下之前的最新状态
+                while select.select([fd], [], [], 0)[0]:
+                    data = _read(fd)
+                    if not data:
+                        exited = True
+                        break
+                    receive(data, time.perf_counter())
+                if pending is not None:
+                    no_change += 1
+                    pending = None
+                key = script[sent]
+                os.write(fd, key.encode())
+                t = time.perf_counter()
+                sent += 1
+                if key in TIMED_KEYS:
+                    pending = (t, term.region(*area))
+                else:
+                    untimed += 1
+                continue
+            if select.select([fd], [], [], due - now)[0]:
+                data = _read(fd)
+                if not data:
+                    exited = True
+                    break
+                receive(data, time.perf_counter())
+    finally:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(pid, 0)
+        os.close(fd)
+    if pending is not None:
+        no_change += 1
+    seconds = max(min(time.perf_counter(), end) - t0, 1e-9)
+    latencies.sort()
+    return {
+        'keys': sent,
+        'timed': len(latencies),
+        'no_change': no_change,
+        'untimed': untimed,
+        'exited': exited,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': _percentile(latencies, 0.50),
+            'p90': _percentile(latencies, 0.90),
+            'p99': _percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0.0,
+        },
+        'seconds': seconds,
+        'frames': frames,
+        'fps': frames / seconds,
+        'bytes': total,
+        'bytes_per_sec': total / seconds,
+        'screen': term.dump(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.latency',
+                                     description='在伪终端中运行终端版 统计按键到画面的延迟 帧率与输出字节数')
+    parser.add_argument('-n', '--keys', type=int, default=200, help='按键数')
+    parser.add_argument('-g', '--gap', type=float, default=0.05, help='按键间隔 秒')
+    parser.add_argument('--interval', type=float, default=1.0, help='终端版的下落间隔 秒 远大于延迟时重力下落很少被误当作响应')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='方块序列与按键脚本的种子')
+    parser.add_argument('--script', help='按键脚本 代替随机生成的脚本 空格为暂停')
+    parser.add_argument('--ai', metavar='SECONDS', type=float,
+                        help='改为运行自动模式SECONDS秒 只统计帧率与字节数')
+    parser.add_argument('--scroll', choices=('off', 'lr'), default='off', help='终端版的--scroll')
+    parser.add_argument('-o', '--output', help='结果写为JSON')
+    parser.add_argument('--max-p99', type=float, metavar='MS', help='p99延迟超过MS毫秒时退出码为1')
+    parser.add_argument('--show', action='store_true', help='输出最后的画面')
+    args = parser.parse_args(argv)
+    if args.ai is not None:
+        r = run('', args.gap, seed=args.seed, ai=True, scroll=args.scroll, tail=args.ai)
+    else:
+        script = args.script if args.script is not None else make_script(args.keys, args.seed)
+        r = run(script, args.gap, args.interval, args.seed, scroll=args.scroll)
+    screen = r.pop('screen')
+    if args.show:
+        print(screen)
+    lat = r['latency_ms']
+    sys.stderr.write('{keys} keys: {timed} timed {no_change} without visible change {untimed} untimed{note}\n'
+                     'latency ms  mean {mean:.2f}  p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max:.2f}\n'
+                     '{frames} frames in {seconds:.2f}s: {fps:.1f} fps  {bytes_per_sec:,.0f} bytes/s\n'.format(
+                         note=' (frontend exited)' if r['exited'] else '', **dict(r, **lat)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(r, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.max_p99 is not None and lat['p99'] > args.max_p99:
+        sys.stderr.write('p99 latency {:.2f}ms exceeds {:.2f}ms\n'.format(lat['p99'], args.max_p99))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
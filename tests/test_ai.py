@@ -0,0 +1,125 @@
+# encoding:utf-8
+# file: test_ai.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 落点搜索测试 搜索给出的落点都能用Planner.keys的按键从方块当前位置到达
+# ##########################
+
+
+import random
+
+import pytest
+
+from tetris.ai import Planner, TranspositionCache
+from tetris.engine import KEY_ACTIONS, TetrisEngine
+
+
+def reach(engine, rot, x):
+    """
+    执行Planner.keys给出的按键 每一步都应真的移动了方块
+    :return: 按键全部成功时为True
+    """
+    piece = engine.piece
+    for key in Planner.keys(engine, rot, x):
+        before = piece.rot, piece.x, piece.y
+        engine.step(KEY_ACTIONS[key])
+        if (piece.rot, piece.x, piece.y) == before:
+            return False
+    return (piece.rot, piece.x) == (rot, x)
+
+
+def falling(seed, pieces=30):
+    """
+    随机落下一些方块之后 把当前方块随机旋转平移下落到半空中
+    :return: 引擎 游戏已结束时为None
+    """
+    rng = random.Random(seed)
+    engine = TetrisEngine(seed, width=10, height=20)
+    planner = Planner(10, 20, lookahead=False)
+    for _ in range(pieces):
+        move = planner.best(engine)
+        if move is None or engine.game_over:
+            return None
+        engine.place(*move)
+    for _ in range(rng.randrange(12)):
+        engine.step(KEY_ACTIONS[rng.choice('wwadss')])
+    return None if engine.game_over else engine
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_placements_reachable_mid_fall(seed):
+    engine = falling(seed)
+    if engine is None:
+        pytest.skip('game over')
+    piece = engine.piece
+    planner = Planner(engine.width, engine.height)
+    snap = engine.snapshot()
+    found = list(planner.placements(engine.board.rows, piece.type, piece.x, piece.y, piece.rot))
+    assert found
+    for rot, x, y, shape in found:
+        assert reach(engine, rot, x), (rot, x)
+        assert piece.y + engine.drop_distance() == y
+        engine.restore(snap)
+    assert reach(engine, *planner.best(engine))
+
+
+def test_search_from_current_rotation():
+    # 竖着的I在一口竖井里 横过来转不动 只能原样落到井底
+    engine = TetrisEngine(1, width=10, height=20)
+    for y in range(5, 20):
+        engine.board.fill(2, y, 1)
+        engine.board.fill(4, y, 1)
+    piece = engine.piece
+    piece.type, piece.rot, piece.x, piece.y = 'I', 1, 3, 5
+    planner = Planner(10, 20)
+    found = [(rot, x, y) for rot, x, y, shape in planner.placements(engine.board.rows, 'I', 3, 5, 1)]
+    assert found == [(1, 3, 16)]
+    assert planner.best(engine) == (1, 3)
+
+
+def test_spawn_search_unchanged():
+    engine = TetrisEngine(7, width=10, height=20)
+    planner = Planner(10, 20)
+    piece = engine.piece
+    assert piece.rot == 0
+    assert planner.best(engine) == planner.best(engine)
+    rows = engine.board.rows
+    assert list(planner.placements(rows, piece.type, piece.x, piece.y)) == \
+        list(planner.placements(rows, piece.type, piece.x, piece.y, piece.rot))
+
+
+def play(planner, seed, pieces):
+    """用planner玩pieces个方块 返回每一步的落点"""
+    engine = TetrisEngine(seed, width=10, height=20)
+    moves = []
+    while not engine.game_over and len(moves) < pieces:
+        move = planner.best(engine)
+        if move is None:
+            break
+        engine.place(*move)
+        moves.append(move)
+    return moves
+
+
+def test_cache_reused_by_next_piece():
+    # 下一步的局面与方块就是上一步第二层搜索过的其中一个 当前方块的落点直接查表
+    planner = Planner(10, 20)
+    moves = play(planner, 5, 40)
+    cache = planner.cache
+    assert cache.hits >= len(moves) - 1
+    assert cache.hit_rate > 0
+    assert moves == play(Planner(10, 20, cache_bytes=0), 5, 40)
+
+
+def test_cache_evicts_by_size():
+    cache = TranspositionCache(1000)
+    for i in range(5):
+        cache.put(i, i, 300)
+    assert len(cache) == 3 and cache.used == 900 and cache.evictions == 2
+    assert cache.get(0) is None and cache.get(4) == 4
+    # 超出上限的一项也保留 直到下一项放入
+    cache.put('big', 0, 5000)
+    assert len(cache) == 1 and cache.get('big') == 0
@@ -0,0 +1,46 @@
+# encoding:utf-8
+# file: test_netplay.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 网络对战测试 预测错误回滚之后 本方看到的对方状态与对方实际状态一致
+# ##########################
+
+
+import random
+
+import pytest
+
+from tetris.engine import KEY_ACTIONS, TetrisEngine
+from tetris.netplay import RemoteGame, loopback
+
+
+def test_rollback_matches_actual_game():
+    # 每个按键之前都先预测一段重力下落 按键到达时预测错误 回滚后重新模拟
+    rng = random.Random(3)
+    actual = TetrisEngine(11)
+    remote = RemoteGame(11, actual.width, actual.height, 50)
+    ts = 0
+    for _ in range(300):
+        ts += rng.randrange(10, 120)
+        remote.predict(ts + rng.randrange(200))
+        key = rng.choice('aadws_')
+        actual.step(KEY_ACTIONS.get(key))
+        remote.confirm(ts, key)
+        if actual.game_over:
+            break
+    remote.close()
+    assert remote.rollbacks
+    assert remote.engine.snapshot() == actual.snapshot()
+
+
+@pytest.mark.parametrize('rtt', [0, 120])
+def test_loopback_sessions_agree(rtt):
+    # 两个NetSession在本机回环上对战 注入往返延迟 结束时双方看到的对方状态都与对方一致
+    host, join = loopback(seconds=1.0, rtt=rtt, seed=4, interval=0.03, key_rate=20.0)
+    assert host['remote_ok'] and join['remote_ok']
+    assert host['confirmed'] and join['confirmed']
+    if rtt:
+        assert host['rollbacks'] + join['rollbacks']
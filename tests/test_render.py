@@ -0,0 +1,65 @@
+# encoding:utf-8
+# file: test_render.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 帧缓冲测试 文本按原样输出 不在中英文之间插入空格
+# ##########################
+
+
+import io
+
+import pytest
+
+from tetris.render import SGR_RESET, Screen, goto_seq, split_cells
+
+
+@pytest.mark.parametrize('text, cells', [
+    ('暂停/开始', ['暂', '停', '/开始 ', '', '']),
+    ('按 空格', ['按', ' 空格 ', '', '']),
+    ('方块数：12', ['方', '块', '数', '：', '12']),
+    ('abc', ['ab', 'c ']),
+    ('', []),
+])
+def test_split_cells(text, cells):
+    assert split_cells(text) == cells
+
+
+def frame(screen):
+    out = screen.out
+    out.seek(0)
+    out.truncate()
+    screen.flush()
+    return out.getvalue().decode('utf-8')
+
+
+@pytest.mark.parametrize('text, shown', [
+    ('暂停/开始', '暂停/开始 '),
+    ('按 空格', '按 空格 '),
+    ('得分：12', '得分：12'),
+])
+def test_text_output_matches_print(text, shown):
+    # 与直接print相同 只在末尾补齐单元
+    screen = Screen(8, 2, io.BytesIO())
+    screen.text(2, 1, text)
+    assert frame(screen) == goto_seq(2, 1) + shown
+
+
+def test_continuation_change_rewrites_run():
+    screen = Screen(8, 1, io.BytesIO())
+    screen.text(1, 1, '按 空格')
+    frame(screen)
+    screen.put(3, 1, SGR_RESET, '  ')
+    frame(screen)
+    screen.text(1, 1, '按 空格')
+    assert frame(screen) == goto_seq(2, 1) + ' 空格 '
+
+
+def test_shorter_text_clears_stale_continuation():
+    screen = Screen(8, 1, io.BytesIO())
+    screen.text(1, 1, '按 空格')
+    frame(screen)
+    screen.text(1, 1, '按键')
+    assert frame(screen) == goto_seq(2, 1) + '键    '
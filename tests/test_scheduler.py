@@ -0,0 +1,118 @@
+# encoding:utf-8
+# file: test_scheduler.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 按键调度测试 用假时钟驱动Scheduler.wait 按时间线送入终端字符 检查得到的按键时间
+# ##########################
+
+
+import os
+
+import pytest
+
+from tetris import scheduler
+from tetris.scheduler import REPEAT_RELEASE, Scheduler
+
+
+class FakeClock(object):
+    """假时钟与select 按时间线把字符写入管道 select的等待直接推进时钟"""
+
+    def __init__(self, events):
+        """
+        :param events: [(时间, 字符)] 按时间排序
+        """
+        self.now = 0.0
+        self.events = sorted(events)
+        self.rfd, self.wfd = os.pipe()
+
+    def monotonic(self):
+        return self.now
+
+    def select(self, rlist, wlist, xlist, timeout=None):
+        if self.events and (timeout is None or self.events[0][0] <= self.now + timeout):
+            t, text = self.events.pop(0)
+            self.now = max(self.now, t)
+            os.write(self.wfd, text.encode('latin-1'))
+            return rlist, [], []
+        self.now += timeout
+        return [], [], []
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """按时间线运行调度器直到end 返回[(时间, 按键)]"""
+    clocks = []
+
+    def run(events, end, das=0.15, arr=0.05, delay=0.6):
+        clock = FakeClock(events)
+        clocks.append(clock)
+        monkeypatch.setattr(scheduler.time, 'monotonic', clock.monotonic)
+        monkeypatch.setattr(scheduler.select, 'select', clock.select)
+        s = Scheduler(end + 1, fd=clock.rfd, das=das, arr=arr, delay=delay)
+        s.deadline = end
+        out = []
+        while True:
+            keys = s.wait()
+            if keys == [None]:
+                return out
+            out.extend((round(clock.now, 3), key) for key in keys)
+
+    yield run
+    for clock in clocks:
+        clock.close()
+
+
+def os_repeat(key, press, release, delay=0.5, rate=0.03):
+    """系统按键重复的时间线 按下时一个字符 delay之后每rate一个 直到松开"""
+    events = [(press, key)]
+    t = press + delay
+    while t < release:
+        events.append((round(t, 3), key))
+        t += rate
+    return events
+
+
+def test_hold_survives_os_initial_delay(run):
+    # 系统在按下0.5秒后才开始重复 之前没有任何字符 不能在das之后被当作松开
+    out = run(os_repeat('a', 0.0, 1.0), end=1.5)
+    times = [t for t, key in out]
+    assert all(key == 'a' for t, key in out)
+    # 0.15开始每0.05自动重复一次 0.5处的系统重复不算新的按下 松开后不再重复
+    assert times == [0.0] + [round(0.15 + 0.05 * i, 3) for i in range(len(times) - 1)]
+    assert 0.95 <= times[-1] <= 1.0 + REPEAT_RELEASE
+
+
+def test_release_after_os_repeat_started(run):
+    # 系统已开始重复 松开后REPEAT_RELEASE之内停止
+    out = run(os_repeat('d', 0.0, 0.8), end=1.5)
+    assert out[-1][0] <= 0.8 + REPEAT_RELEASE
+    assert out[0] == (0.0, 'd')
+
+
+def test_tap_repeats_until_delay(run):
+    # 点按没有系统重复 只能等delay过去才知道已松开
+    out = run([(0.0, 'a')], end=1.5, delay=0.4)
+    times = [t for t, key in out]
+    assert times[0] == 0.0 and times[1] == 0.15
+    assert times[-1] <= 0.4
+
+
+def test_other_key_cancels_hold(run):
+    out = run(os_repeat('a', 0.0, 1.0) + [(0.32, 'w')], end=1.5)
+    assert [key for t, key in out if t <= 0.32] == ['a'] * 5 + ['w']
+    # 按下其他键之后a的系统重复重新算作按下 从那时起重新计das
+    after = [t for t, key in out if t > 0.32]
+    assert after[:3] == [0.5, 0.65, 0.7]
+
+
+def test_no_das_passes_os_repeats(run):
+    events = os_repeat('a', 0.0, 0.6)
+    out = run(events, end=1.0, das=None)
+    assert out == [(t, key) for t, key in events]
@@ -0,0 +1,14 @@
+# encoding:utf-8
+# file: __init__.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 终端俄罗斯方块Tetris
+# ##########################
+
+
+from .engine import TetrisEngine
+
+__all__ = ['TetrisEngine']
@@ -0,0 +1,363 @@
+# encoding:utf-8
+# file: ai.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 自动玩家 穷举落点搜索
+# ##########################
+
+
+import argparse
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from functools import reduce
+from operator import xor
+
+from .board import zobrist_table
+from .engine import TetrisEngine
+from .shapes import compile_shapes
+
+
+# 启发式权重 依次为 各列高度之和 消除行数 空洞数 相邻列高度差之和
+Weights = namedtuple('Weights', 'height lines holes bumpiness')
+DEFAULT_WEIGHTS = Weights(-0.510066, 0.760666, -0.35663, -0.184483)
+# 置换表默认内存上限 字节
+CACHE_BYTES = 16 << 20
+# 置换表每项的估计内存 字节 含键元组 值与OrderedDict的哈希表项和链表节点 不含落点列表
+ENTRY_BYTES = 256
+# 落点列表中每个落点的估计内存 字节 含五元组与其中的浮点数
+MOVE_BYTES = 120
+
+
+class TranspositionCache(object):
+    """
+    置换表 局面 => 评估结果 有界LRU 估计内存超出上限时淘汰最久没用到的项
+    每项的内存由调用者估计 键中含地图的64位Zobrist哈希 随机数表见board.Zobrist
+    不同局面哈希相同的概率约为2**-64 与地图尺寸无关
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        """
+        :param max_bytes: 内存上限 字节
+        """
+        self.max_bytes = max_bytes
+        # 局面键 => (评估结果, 估计内存)
+        self._data = OrderedDict()
+        self.used = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        """命中率 没有查询过时为0"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        """
+        查询 命中的项移到最近使用的一端
+        :param key: 局面键
+        :return: 评估结果 没有时为None
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value, size=ENTRY_BYTES):
+        """
+        保存评估结果 超出内存上限时淘汰最久没用到的项 最新的一项总是保留
+        :param key: 局面键
+        :param value: 评估结果 不能为None
+        :param size: 此项的估计内存 字节
+        :return: None
+        """
+        data = self._data
+        old = data.pop(key, None)
+        if old is not None:
+            self.used -= old[1]
+        data[key] = (value, size)
+        self.used += size
+        while self.used > self.max_bytes and len(data) > 1:
+            self.used -= data.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def clear(self):
+        """清空 统计保留"""
+        self._data.clear()
+        self.used = 0
+
+    def stats(self):
+        """统计 可JSON序列化的字典"""
+        return {
+            'entries': len(self._data),
+            'bytes': self.used,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
+
+
+class Planner(object):
+    """
+    落点搜索 直接在行位掩码上放置方块与计算特征 不修改引擎
+    落点为(旋转状态, 列) 从方块当前位置先原地旋转 再水平平移 最后竖直落下 路径上每一步都不能有重叠
+    lookahead为True时对每个落点再穷举下个方块的落点 取两步之后的最好局面
+    lookahead时下个方块从出生点出发的全部落点与局面分数存入置换表 键为(地图哈希, 方块类型)
+    分数不含第一步消除的行数 评分对消除行数是线性的 查表后再加上 所以第一步消行不同的落点得到相同局面时也能共用
+    下一步真正落下的就是其中一个局面 这时当前方块的落点直接取自表中 只需搜索再下一个方块
+    方块不在出生点时 例如移动中途重新搜索 当前方块的落点不查表
+    """
+
+    def __init__(self, width, height, weights=DEFAULT_WEIGHTS, lookahead=True, cache_bytes=CACHE_BYTES):
+        """
+        :param width: 地图长
+        :param height: 地图高
+        :param weights: 启发式权重
+        :param lookahead: 是否同时搜索下个方块
+        :param cache_bytes: 置换表内存上限 字节 0为不使用置换表
+        """
+        self.width, self.height = width, height
+        self.shapes = compile_shapes(width)
+        self.full = (1 << width) - 1
+        # 与同尺寸地图共用Zobrist随机数表 搜索中的局面哈希与引擎地图的哈希一致
+        self.zobrist = zobrist_table(width, height)
+        self.weights = weights
+        self.lookahead = lookahead
+        self.cache = TranspositionCache(cache_bytes) if cache_bytes else None
+        # 已评估的局面数与搜索耗时 用于统计每秒评估的落点数
+        self.evaluated, self.search_time = 0, 0.0
+        # 每种方块每个旋转状态每列的整块掩码 第i行在第i*width位
+        self._blocks = {
+            b_type: tuple(tuple(sum(m << i * width for i, m in enumerate(masks)) for masks in shape.masks)
+                          for shape in rotations)
+            for b_type, rotations in self.shapes.items()
+        }
+
+    @property
+    def rate(self):
+        """每秒评估的落点数"""
+        return self.evaluated / self.search_time if self.search_time else 0.0
+
+    def placements(self, rows, b_type, x0, y0, rot0=0):
+        """
+        穷举方块从x0,y0出发能到达的全部最终落点 形状相同的旋转状态只取一个
+        :param rows: 地图行位掩码
+        :param b_type: 方块类型
+        :param x0: 出发点列索引
+        :param y0: 出发点行索引
+        :param rot0: 出发时的旋转状态 按旋转键的方向依次转到其余三个
+        :return: 生成器 (旋转状态, 列索引, 落下后的行索引, 形状表项)
+        """
+        # 整个地图拼成一个大整数 第y行在第y*width位 碰撞检测是一次移位与按位与
+        width = self.width
+        board = 0
+        for row in reversed(rows):
+            board = board << width | row
+        seen = set()
+        rotations = self.shapes[b_type]
+        for i in range(len(rotations)):
+            rot = (rot0 + i) & 3
+            shape = rotations[rot]
+            limit = self.height - shape.height
+            if y0 > limit:
+                return
+            blocks = self._blocks[b_type][rot]
+            above = board >> y0 * width
+            # 旋转在出发点依次进行 被挡住之后的旋转状态也到不了
+            if not 0 <= x0 < len(blocks) or above & blocks[x0]:
+                return
+            if shape.cells in seen:
+                continue
+            seen.add(shape.cells)
+            for step in (-1, 1):
+                x = x0 if step < 0 else x0 + 1
+                while 0 <= x < len(blocks) and not above & blocks[x]:
+                    block = blocks[x]
+                    y, below = y0, above >> width
+                    while y < limit and not below & block:
+                        y += 1
+                        below >>= width
+                    yield rot, x, y, shape
+                    x += step
+
+    def _place(self, rows, shape, x, y):
+        """
+        放置方块并消行
+        :return: (新的行位掩码列表, 消除行数)
+        """
+        rows = rows[:]
+        full = self.full
+        lines = 0
+        for i, m in enumerate(shape.masks[x]):
+            rows[y + i] |= m
+            if rows[y + i] == full:
+                lines += 1
+        if lines:
+            rows = [0] * lines + [r for r in rows if r != full]
+        return rows, lines
+
+    def _place_key(self, rows, key, shape, x, y):
+        """
+        放置方块并消行 同时增量计算新地图的Zobrist哈希
+        :param key: rows的哈希
+        :return: (新的行位掩码列表, 消除行数, 新地图的哈希)
+        """
+        rows = rows[:]
+        full, zobrist = self.full, self.zobrist
+        lines = 0
+        for i, m in enumerate(shape.masks[x]):
+            row = rows[y + i]
+            rows[y + i] = row | m
+            key ^= zobrist.key(y + i, row) ^ zobrist.key(y + i, row | m)
+            if row | m == full:
+                lines += 1
+        if lines:
+            # 最低满行及以上的行都移动了
+            low = y + shape.height
+            key ^= reduce(xor, zobrist.keys(rows[:low]), 0)
+            rows = [0] * lines + [r for r in rows if r != full]
+            key ^= reduce(xor, zobrist.keys(rows[:low]), 0)
+        return rows, lines, key
+
+    def _scan(self, rows, b_type, x0, y0, rot0=0):
+        """
+        方块的全部落点与放置后的局面分数
+        :return: (最好分数, ((旋转状态, 列索引, 行索引, 消除行数, 分数), ...)) 没有落点时最好分数为负无穷
+        """
+        best, moves = float('-inf'), []
+        for rot, x, y, shape in self.placements(rows, b_type, x0, y0, rot0):
+            after, lines = self._place(rows, shape, x, y)
+            score = self.evaluate(after, lines)
+            moves.append((rot, x, y, lines, score))
+            if score > best:
+                best = score
+        return best, tuple(moves)
+
+    def _moves(self, rows, key, b_type, x0, y0):
+        """
+        方块从出生点出发的全部落点与局面分数 先查置换表
+        :param key: rows的哈希
+        :return: 同_scan
+        """
+        cache, pos = self.cache, (key, b_type)
+        if cache is None:
+            return self._scan(rows, b_type, x0, y0)
+        found = cache.get(pos)
+        if found is None:
+            found = self._scan(rows, b_type, x0, y0)
+            cache.put(pos, found, ENTRY_BYTES + MOVE_BYTES * len(found[1]))
+        return found
+
+    def evaluate(self, rows, lines):
+        """
+        局面评分 越大越好
+        :param rows: 地图行位掩码
+        :param lines: 得到此局面时消除的行数
+        :return: 分数
+        """
+        self.evaluated += 1
+        height, width = self.height, self.width
+        heights = [0] * width
+        seen = holes = 0
+        for y, row in enumerate(rows):
+            if seen:
+                # 上方有小方块而本格为空即空洞
+                holes += bin(seen & ~row).count('1')
+            elif not row:
+                continue
+            new = row & ~seen
+            while new:
+                low = new & -new
+                heights[low.bit_length() - 1] = height - y
+                new ^= low
+            seen |= row
+        bump = 0
+        for a, b in zip(heights, heights[1:]):
+            bump += a - b if a > b else b - a
+        w = self.weights
+        return w.height * sum(heights) + w.lines * lines + w.holes * holes + w.bumpiness * bump
+
+    def best(self, engine):
+        """
+        为引擎的当前方块选择落点
+        :param engine: 游戏引擎 当前方块可在出生点或下落途中 从它当前的旋转状态与位置出发搜索
+        :return: (旋转状态, 列索引) 没有可到达的落点时为None
+        """
+        t = time.perf_counter()
+        piece, board = engine.piece, engine.board
+        rows, key = board.rows, board.key
+        x0, y0 = engine.spawn_x, engine.spawn_y
+        if self.lookahead and (piece.rot, piece.x, piece.y) == (0, x0, y0):
+            # 上一步搜索下个方块时多半已在这个局面上搜索过
+            moves = self._moves(rows, key, piece.type, x0, y0)[1]
+        else:
+            moves = self._scan(rows, piece.type, piece.x, piece.y, piece.rot)[1]
+        shapes, w_lines = self.shapes[piece.type], self.weights.lines
+        best, best_score = None, None
+        for rot, x, y, lines, score in moves:
+            if self.lookahead:
+                after, lines, after_key = self._place_key(rows, key, shapes[rot], x, y)
+                # 下个方块出不来时为负无穷 只在别无选择时才选
+                score = self._moves(after, after_key, engine.next_type, x0, y0)[0] + w_lines * lines
+            if best_score is None or score > best_score:
+                best, best_score = (rot, x), score
+        self.search_time += time.perf_counter() - t
+        return best
+
+    @staticmethod
+    def keys(engine, rot, x):
+        """
+        到达落点的按键序列 先旋转再平移 之后由下落完成
+        :param engine: 游戏引擎
+        :param rot: 目标旋转状态
+        :param x: 目标列索引
+        :return: 按键列表
+        """
+        piece = engine.piece
+        dx = x - piece.x
+        return ['w'] * ((rot - piece.rot) & 3) + ['d' if dx > 0 else 'a'] * abs(dx)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.ai', description='无界面自动玩一局 统计搜索速度')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('-m', '--max-pieces', type=int, default=500, help='方块数上限')
+    parser.add_argument('--no-lookahead', action='store_true', help='不搜索下个方块')
+    parser.add_argument('--cache-mb', type=float, default=CACHE_BYTES / 2 ** 20, help='置换表内存上限 MB 0为不使用')
+    args = parser.parse_args(argv)
+    if args.cache_mb < 0:
+        parser.error('cache size must not be negative')
+    engine = TetrisEngine(args.seed)
+    planner = Planner(engine.width, engine.height, lookahead=not args.no_lookahead,
+                      cache_bytes=int(args.cache_mb * 2 ** 20))
+    pieces = 0
+    t = time.perf_counter()
+    while not engine.game_over and pieces < args.max_pieces:
+        move = planner.best(engine)
+        if move is None:
+            break
+        engine.place(*move)
+        pieces += 1
+    wall = time.perf_counter() - t
+    sys.stderr.write('{} pieces {} lines in {:.2f}s: {:.0f} pieces/s {:.0f} placements/s\n'.format(
+        pieces, engine.score, wall, pieces / wall if wall else 0.0, planner.rate))
+    if planner.cache is not None:
+        cache = planner.cache
+        sys.stderr.write('cache {:,} entries {:.1f} of {:.1f}MB, {:,} hits {:,} misses ({:.1%}), {:,} evictions\n'.format(
+            len(cache), cache.used / 2 ** 20, cache.max_bytes / 2 ** 20, cache.hits, cache.misses, cache.hit_rate,
+            cache.evictions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# encoding:utf-8
+# file: batch.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# NumPy批量游戏引擎 N局同步推进
+# ##########################
+
+
+import numpy as np
+
+from .engine import BOARD_WIDTH, BOARD_HEIGHT, GOLDEN
+from .selfplay import game_seed
+from .shapes import BLOCK_TYPES, compile_shapes
+
+
+# 批量动作编码 与engine.ACTIONS顺序一致 0为不动
+NONE, LEFT, RIGHT, DOWN, ROTATE = range(5)
+# pieces数组的列 方块类型(BLOCK_TYPES中的索引) 旋转状态 左上角列索引 左上角行索引
+P_TYPE, P_ROT, P_X, P_Y = range(4)
+
+# splitmix64常数 用于由(对局种子, 方块序号)直接算出方块类型 与engine.piece_type相同
+_GOLDEN = np.uint64(GOLDEN)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _splitmix64(z):
+    """
+    向量化的splitmix64 z为uint64数组 溢出按2**64回绕
+    :param z: uint64数组
+    :return: uint64数组
+    """
+    z = z.copy()
+    z ^= z >> np.uint64(30)
+    z *= _MIX1
+    z ^= z >> np.uint64(27)
+    z *= _MIX2
+    z ^= z >> np.uint64(31)
+    return z
+
+
+def _shape_arrays(width):
+    """
+    把预编译形状表转为数组 下标均为[方块类型, 旋转状态]
+    :param width: 地图长
+    :return: (小方块偏移(7,4,4,2), 长与高(7,4,2), 每列最低小方块的dy(7,4,4) 没有小方块为-1)
+    """
+    shapes = compile_shapes(width)
+    cells = np.zeros((7, 4, 4, 2), np.int32)
+    size = np.zeros((7, 4, 2), np.int32)
+    bottom = np.full((7, 4, 4), -1, np.int32)
+    for t, b_type in enumerate(BLOCK_TYPES):
+        for r, shape in enumerate(shapes[b_type]):
+            cells[t, r] = shape.cells
+            size[t, r] = shape.width, shape.height
+            for dx, dy in shape.bottom:
+                bottom[t, r, dx] = dy
+    return cells, size, bottom
+
+
+class BatchEngine(object):
+    """
+    批量游戏引擎 N局游戏的地图存放在(N, H, W)的uint8数组中 0为空 否则为调色板索引
+    方块放置 碰撞检测 满行检测与行压缩对整批游戏各是一次向量化运算
+    规则与TetrisEngine相同 第i局与TetrisEngine(self.seeds[i])的方块序列相同
+    """
+
+    def __init__(self, n, seed=0, width=BOARD_WIDTH, height=BOARD_HEIGHT):
+        """
+        :param n: 游戏局数
+        :param seed: 主种子 第i局的种子为selfplay.game_seed(seed, i)
+        :param width: 地图长 默认与终端版GAME_AREA_L相同
+        :param height: 地图高 默认与终端版GAME_AREA_H相同
+        """
+        self.n, self.width, self.height = n, width, height
+        self.cells, self.size, self.bottom = _shape_arrays(width)
+        self.spawn_x, self.spawn_y = width // 2 - 2, 0
+        self.seeds = np.array([game_seed(seed, i) for i in range(n)], np.uint64)
+        self.boards = np.zeros((n, height, width), np.uint8)
+        self.pieces = np.zeros((n, 4), np.int32)
+        self.next_type = np.zeros(n, np.int32)
+        # 生成方块计数 得分即消除的总行数
+        self.count = np.zeros(n, np.int64)
+        self.score = np.zeros(n, np.int64)
+        self.game_over = np.zeros(n, bool)
+        self._rows = np.arange(height)
+        self.reset()
+
+    def reset(self, idx=None):
+        """
+        重新开始部分或全部对局 对局种子不变
+        :param idx: 对局索引数组 None为全部
+        :return: None
+        """
+        idx = np.arange(self.n) if idx is None else np.asarray(idx)
+        self.boards[idx] = 0
+        self.count[idx] = 0
+        self.score[idx] = 0
+        self.game_over[idx] = False
+        self._pick(idx)
+        self._spawn(idx)
+
+    def _pick(self, idx):
+        """挑选下个方块 第k个方块的类型只由对局种子与k决定"""
+        z = self.seeds[idx] + self.count[idx].astype(np.uint64) * _GOLDEN
+        self.next_type[idx] = (_splitmix64(z) % np.uint64(len(BLOCK_TYPES))).astype(np.int32)
+        self.count[idx] += 1
+
+    def _spawn(self, idx):
+        """下个方块成为当前方块 出生点已被占用的对局结束"""
+        p = self.pieces
+        p[idx, P_TYPE] = self.next_type[idx]
+        p[idx, P_ROT] = 0
+        p[idx, P_X] = self.spawn_x
+        p[idx, P_Y] = self.spawn_y
+        self._pick(idx)
+        ok = self._fits(idx, p[idx, P_ROT], p[idx, P_X], p[idx, P_Y])
+        self.game_over[idx[~ok]] = True
+
+    def _fits(self, idx, rots, xs, ys):
+        """
+        idx中各局的当前方块以rots放在xs,ys处 是否在地图内且与地图没有重叠
+        :return: 布尔数组
+        """
+        t = self.pieces[idx, P_TYPE]
+        w, h = self.size[t, rots, 0], self.size[t, rots, 1]
+        inside = (xs >= 0) & (ys >= 0) & (xs + w <= self.width) & (ys + h <= self.height)
+        off = self.cells[t, rots]
+        cx = np.clip(xs[:, None] + off[..., 0], 0, self.width - 1)
+        cy = np.clip(ys[:, None] + off[..., 1], 0, self.height - 1)
+        hit = self.boards[idx[:, None], cy, cx] != 0
+        return inside & ~hit.any(axis=1)
+
+    def step(self, actions):
+        """
+        所有未结束的对局各推进一步
+        :param actions: (N,)动作数组 NONE LEFT RIGHT DOWN ROTATE
+        :return: (地图数组, 方块数组, 本步各局消除行数, 各局是否结束) 数组为实例自身 不是拷贝
+        """
+        actions = np.asarray(actions)
+        lines = np.zeros(self.n, np.int64)
+        idx = np.nonzero(~self.game_over & (actions != NONE))[0]
+        if idx.size:
+            a = actions[idx]
+            p = self.pieces[idx]
+            rots = np.where(a == ROTATE, (p[:, P_ROT] + 1) & 3, p[:, P_ROT])
+            xs = p[:, P_X] - (a == LEFT) + (a == RIGHT)
+            ys = p[:, P_Y] + (a == DOWN)
+            ok = self._fits(idx, rots, xs, ys)
+            moved = idx[ok]
+            self.pieces[moved, P_ROT] = rots[ok]
+            self.pieces[moved, P_X] = xs[ok]
+            self.pieces[moved, P_Y] = ys[ok]
+            lock = idx[~ok & (a == DOWN)]
+            if lock.size:
+                lines[lock] = self._lock(lock)
+        return self.boards, self.pieces, lines, self.game_over
+
+    def place(self, rots, xs):
+        """
+        所有未结束的对局把当前方块旋转到rots并平移到xs列 然后直接落到底固定
+        :param rots: (N,)旋转状态数组
+        :param xs: (N,)左上角列索引数组
+        :return: 同step
+        """
+        rots, xs = np.asarray(rots), np.asarray(xs)
+        lines = np.zeros(self.n, np.int64)
+        idx = np.nonzero(~self.game_over)[0]
+        if not idx.size:
+            return self.boards, self.pieces, lines, self.game_over
+        rots, xs = rots[idx], xs[idx]
+        t = self.pieces[idx, P_TYPE]
+        if ((xs < 0) | (xs + self.size[t, rots, 0] > self.width)).any():
+            raise ValueError('placement column out of range')
+        ys = self.pieces[idx, P_Y]
+        ok = self._fits(idx, rots, xs, ys)
+        # 当前行都放不下 即方块堆到顶了
+        self.game_over[idx[~ok]] = True
+        idx, rots, xs, ys, t = idx[ok], rots[ok], xs[ok], ys[ok], t[ok]
+        if idx.size:
+            # 方块每列最低小方块以下 第一个被占用的行
+            bot = self.bottom[t, rots]
+            cols = np.clip(xs[:, None] + np.arange(4), 0, self.width - 1)
+            occ = self.boards[idx[:, None, None], self._rows[None, :, None], cols[:, None, :]] != 0
+            start = ys[:, None] + bot
+            hit = occ & (self._rows[None, :, None] > start[:, None, :])
+            first = np.where(hit.any(axis=1), hit.argmax(axis=1), self.height)
+            drop = np.where(bot >= 0, first - 1 - start, self.height).min(axis=1)
+            self.pieces[idx, P_ROT] = rots
+            self.pieces[idx, P_X] = xs
+            self.pieces[idx, P_Y] = ys + drop
+            lines[idx] = self._lock(idx)
+        return self.boards, self.pieces, lines, self.game_over
+
+    def _lock(self, idx):
+        """
+        固定idx中各局的当前方块 消行 生成新方块 在出生行就固定的对局结束
+        :return: 各局消除的行数
+        """
+        p = self.pieces[idx]
+        t = p[:, P_TYPE]
+        off = self.cells[t, p[:, P_ROT]]
+        cx = p[:, P_X, None] + off[..., 0]
+        cy = p[:, P_Y, None] + off[..., 1]
+        self.boards[idx[:, None], cy, cx] = (t + 1)[:, None]
+        # 满行检测 满行排到最上面再清零 其余行保持原有顺序沉到底部
+        sub = self.boards[idx]
+        full = (sub != 0).all(axis=2)
+        n_full = full.sum(axis=1)
+        has = n_full > 0
+        if has.any():
+            order = np.argsort(~full[has], axis=1, kind='stable')
+            packed = np.take_along_axis(sub[has], order[:, :, None], axis=1)
+            packed[self._rows[None, :] < n_full[has][:, None]] = 0
+            self.boards[idx[has]] = packed
+        self.score[idx] += n_full
+        over = p[:, P_Y] == self.spawn_y
+        self.game_over[idx[over]] = True
+        self._spawn(idx[~over])
+        return n_full
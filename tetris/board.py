@@ -0,0 +1,453 @@
+# encoding:utf-8
+# file: board.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 位板 游戏地图的紧凑表示
+# ##########################
+
+
+import random
+from bisect import bisect_right
+from functools import lru_cache, reduce
+from operator import xor
+
+
+# 快照按块保存 每块这么多行 两次快照之间没有修改的块直接共用
+SNAP_ROWS = 8
+# Zobrist随机数表的种子 固定不变 不同进程中相同局面的哈希相同
+ZOBRIST_SEED = 0x5EED7E7A
+# 随机数表总项数不超过此值时建表时一次生成全部行 否则按行在第一次用到时生成
+ZOBRIST_EAGER = 1 << 16
+
+
+class Zobrist(object):
+    """
+    Zobrist随机数表 每行每8列为一组 每组的256种占用各有一个64位随机数 全空为0
+    一行的键为各组随机数的异或 地图的键为各行的键的异或 等价于每个(行, 列)一个随机数 但每行只查(width + 7) // 8次表
+    每行的表由行索引生成 与生成顺序无关 小地图建表时全部生成 很高的地图只为有过小方块的行生成
+    """
+
+    __slots__ = ('chunks', 'tables', 'complete')
+
+    def __init__(self, width, height):
+        """
+        :param width: 地图长
+        :param height: 地图高
+        """
+        self.chunks = (width + 7) // 8
+        self.tables = [None] * height
+        # 是否已生成全部行的表
+        self.complete = height * self.chunks * 256 <= ZOBRIST_EAGER
+        if self.complete:
+            for y in range(height):
+                self.table(y)
+
+    def table(self, y):
+        """第y行的随机数表 第j组的第b项为该组占用为b时的随机数"""
+        t = self.tables[y]
+        if t is None:
+            rng = random.Random(ZOBRIST_SEED ^ y << 32)
+            t = []
+            for _ in range(self.chunks):
+                t.append(0)
+                t.extend(rng.getrandbits(64) for _ in range(255))
+            self.tables[y] = t
+        return t
+
+    def key(self, y, row):
+        """
+        一行的键
+        :param y: 行索引
+        :param row: 行位掩码
+        :return: 64位无符号整数 空行为0
+        """
+        if not row:
+            return 0
+        t = self.tables[y] or self.table(y)
+        k, i = 0, 0
+        while row:
+            k ^= t[i + (row & 255)]
+            row >>= 8
+            i += 256
+        return k
+
+    def keys(self, rows, start=0):
+        """
+        连续若干行的键
+        :param rows: 行位掩码列表
+        :param start: rows[0]的行索引
+        :return: 键列表
+        """
+        tables = self.tables[start:start + len(rows)]
+        if not self.complete and None in tables:
+            for y, row in enumerate(rows, start):
+                if row and self.tables[y] is None:
+                    self.table(y)
+            tables = self.tables[start:start + len(rows)]
+        # 常见的窄地图展开查表
+        if self.chunks == 1:
+            return [t[row] if row else 0 for t, row in zip(tables, rows)]
+        if self.chunks == 2:
+            return [t[row & 255] ^ t[256 + (row >> 8)] if row else 0 for t, row in zip(tables, rows)]
+        return [self.key(y, row) for y, row in enumerate(rows, start)]
+
+
+@lru_cache(maxsize=None)
+def zobrist_table(width, height):
+    """同一地图尺寸的地图与落点搜索共用一张随机数表"""
+    return Zobrist(width, height)
+
+
+def board_key(rows, zobrist):
+    """
+    从头计算地图的Zobrist哈希
+    :param rows: 行位掩码列表
+    :param zobrist: 随机数表
+    :return: 64位无符号整数
+    """
+    return reduce(xor, zobrist.keys(rows), 0)
+
+
+class Board(object):
+    """
+    位板 每行一个整数位掩码表示占用 第x位为1表示该行第x列有小方块
+    颜色单独存放在bytearray颜色平面中 存的是调色板索引 0为背景色
+    满行/空行判断是一次整数比较 消行是一次切片移动
+    另外增量维护轮廓索引 tops[x]为第x列最高小方块的行索引 空列为height counts[y]为第y行的小方块数
+    top为全地图最高小方块的行索引 消行只移动top与最低满行之间的行 与地图高度无关
+    方块固定与消行时更新 下落距离由此直接算出 不需要扫描地图
+    快照为不可变的块元组 每次修改记下改动的行范围 下次快照只重新拷贝这些行所在的块 其余块与上次快照共用
+    key为占用的Zobrist哈希 见Zobrist keys[y]为第y行的键 修改时异或掉变化的行的旧键 再异或上新键
+    方块固定时为方块所占的行 消行时为最高小方块到最低满行之间移动过的行
+    """
+
+    __slots__ = ('width', 'height', 'full', 'rows', 'colors', 'tops', 'counts', 'top', 'zobrist', 'keys', 'key',
+                 '_snap', '_lo', '_hi')
+
+    def __init__(self, width, height):
+        """
+        :param width: 地图长 即列数
+        :param height: 地图高 即行数
+        """
+        self.width, self.height = width, height
+        # 满行掩码
+        self.full = (1 << width) - 1
+        self.rows = [0] * height
+        # 颜色平面 索引为 y * width + x
+        self.colors = bytearray(width * height)
+        self.tops = [height] * width
+        self.counts = [0] * height
+        self.top = height
+        # Zobrist随机数表 各行的键 整个地图的键
+        self.zobrist = zobrist_table(width, height)
+        self.keys = [0] * height
+        self.key = 0
+        # 上次快照 及其之后修改过的行范围 _lo > _hi为没有修改
+        self._snap, self._lo, self._hi = None, height, -1
+
+    def clear(self):
+        """清空整个地图"""
+        self.rows[:] = [0] * self.height
+        self.colors[:] = bytes(len(self.colors))
+        self.tops[:] = [self.height] * self.width
+        self.counts[:] = [0] * self.height
+        self.top = self.height
+        self.keys[:] = [0] * self.height
+        self.key = 0
+        self._lo, self._hi = 0, self.height - 1
+
+    def load(self, rows, colors):
+        """
+        整体替换地图内容 用于恢复保存的状态 不重新分配内存
+        :param rows: 行位掩码列表
+        :param colors: 颜色平面
+        :return: None
+        """
+        self.rows[:] = rows
+        self.colors[:] = colors
+        self._lo, self._hi = 0, self.height - 1
+        self.reindex()
+
+    def reindex(self):
+        """由行位掩码重新计算轮廓索引与哈希"""
+        tops, seen = self.tops, 0
+        tops[:] = [self.height] * self.width
+        for y, row in enumerate(self.rows):
+            new = row & ~seen
+            while new:
+                low = new & -new
+                tops[low.bit_length() - 1] = y
+                new ^= low
+            seen |= row
+        self.counts[:] = [bin(row).count('1') for row in self.rows]
+        self.top = min(tops)
+        self.keys[:] = self.zobrist.keys(self.rows)
+        self.key = reduce(xor, self.keys, 0)
+
+    def _scan_top(self, x, y):
+        """从第y行往下找第x列最高的小方块 只在该列最高的小方块被消除时调用"""
+        bit, rows = 1 << x, self.rows
+        for _y in range(y, self.height):
+            if rows[_y] & bit:
+                return _y
+        return self.height
+
+    def get(self, x, y):
+        """
+        地图点是否被占用
+        :param x: 列索引
+        :param y: 行索引
+        :return: 布尔型
+        """
+        return self.rows[y] >> x & 1 == 1
+
+    def color(self, x, y):
+        """
+        地图点的调色板索引
+        :param x: 列索引
+        :param y: 行索引
+        :return: 调色板索引
+        """
+        return self.colors[y * self.width + x]
+
+    def fill(self, x, y, color):
+        """
+        填充地图点
+        :param x: 列索引
+        :param y: 行索引
+        :param color: 调色板索引
+        :return: None
+        """
+        self._touch(y, y)
+        if not self.get(x, y):
+            self.rows[y] |= 1 << x
+            self._rekey(y)
+            self.counts[y] += 1
+            if y < self.tops[x]:
+                self.tops[x] = y
+            if y < self.top:
+                self.top = y
+        self.colors[y * self.width + x] = color
+
+    def erase(self, x, y):
+        """
+        清除地图点 颜色恢复为背景色
+        :param x: 列索引
+        :param y: 行索引
+        :return: None
+        """
+        self._touch(y, y)
+        if self.get(x, y):
+            self.rows[y] &= ~(1 << x)
+            self._rekey(y)
+            self.counts[y] -= 1
+            if self.tops[x] == y:
+                self.tops[x] = self._scan_top(x, y + 1)
+                if self.top == y:
+                    self.top = min(self.tops)
+        self.colors[y * self.width + x] = 0
+
+    def is_full(self, y):
+        """某行是否已满"""
+        return self.rows[y] == self.full
+
+    def is_empty(self, y):
+        """某行是否为空行"""
+        return self.rows[y] == 0
+
+    def stamp(self, x, y, shape):
+        """
+        固定方块 填充位掩码与颜色 更新轮廓索引
+        :param x: 方块左上角列索引
+        :param y: 方块左上角行索引
+        :param shape: 形状表项 与地图没有重叠
+        :return: None
+        """
+        rows, colors, tops, counts, w = self.rows, self.colors, self.tops, self.counts, self.width
+        for i, m in enumerate(shape.masks[x]):
+            rows[y + i] |= m
+            self._rekey(y + i)
+        for dx, dy in shape.cells:
+            _x, _y = x + dx, y + dy
+            colors[_y * w + _x] = shape.color
+            counts[_y] += 1
+            if _y < tops[_x]:
+                tops[_x] = _y
+        if y < self.top:
+            self.top = y
+        if y < self._lo:
+            self._lo = y
+        if y + shape.height - 1 > self._hi:
+            self._hi = y + shape.height - 1
+
+    def drop_distance(self, x, y, shape):
+        """
+        方块能竖直下落的距离 方块每列最低的小方块到该列最高小方块之间的空行数取最小值
+        方块在某列最高小方块之下时(悬空的小方块下面) 轮廓不适用 退回逐行检测
+        :param x: 方块左上角列索引
+        :param y: 方块左上角行索引
+        :param shape: 形状表项
+        :return: 下落行数
+        """
+        tops = self.tops
+        d = self.height
+        for dx, dy in shape.bottom:
+            gap = tops[x + dx] - 1 - y - dy
+            if gap < 0:
+                return self._scan_drop(y, shape.masks[x], shape.height)
+            if gap < d:
+                d = gap
+        return d
+
+    def _scan_drop(self, y, masks, h):
+        """逐行检测的下落距离"""
+        rows = self.rows
+        d, limit = 0, self.height - h - y
+        while d < limit:
+            _y = y + d + 1
+            for i, m in enumerate(masks):
+                if rows[_y + i] & m:
+                    return d
+            d += 1
+        return d
+
+    def collide(self, y, masks):
+        """
+        方块与地图碰撞检测
+        :param y: 方块第一行所在的行索引
+        :param masks: 方块每行已按列偏移好的掩码
+        :return: 布尔型 True为有重叠
+        """
+        rows = self.rows
+        for i, m in enumerate(masks):
+            if rows[y + i] & m:
+                return True
+        return False
+
+    def remove_row(self, y):
+        """
+        消除某行 上方所有行整体下移一行 顶部补一个空行
+        :param y: 行索引
+        :return: None
+        """
+        w = self.width
+        self._touch(0, y)
+        rows = self.rows
+        # 最高小方块到第y行都下移了一行 这些行的旧键移出 移动后重新计算
+        top = min(self.top, y)
+        keys = self.keys
+        old = reduce(xor, keys[top:y + 1], 0)
+        del rows[y]
+        rows.insert(0, 0)
+        keys[top:y + 1] = self.zobrist.keys(rows[top:y + 1], top)
+        self.key ^= old ^ reduce(xor, keys[top:y + 1], 0)
+        colors = self.colors
+        colors[w:(y + 1) * w] = colors[:y * w]
+        colors[:w] = bytes(w)
+        counts = self.counts
+        del counts[y]
+        counts.insert(0, 0)
+        # 上方的列整体下移一行 最高小方块正好在被消除行的列往下重新找
+        tops = self.tops
+        for x, top in enumerate(tops):
+            if top < y:
+                tops[x] = top + 1
+            elif top == y:
+                tops[x] = self._scan_top(x, y + 1)
+        self.top = min(tops)
+
+    def clear_lines(self, ys):
+        """
+        只检查给定的行 一次压缩消除其中全部满行 只移动最高小方块与最低满行之间的行
+        满行之间的每段行整体下移其下方的满行数 顶部补空行
+        :param ys: 要检查的行索引 从上到下 通常为刚固定的方块所占的行
+        :return: 被消除的行索引列表 从上到下
+        """
+        counts, w = self.counts, self.width
+        full = [y for y in ys if counts[y] == w]
+        if not full:
+            return full
+        rows, colors, tops = self.rows, self.colors, self.tops
+        top, n = self.top, len(full)
+        self._touch(top, full[-1])
+        last, keys = full[-1], self.keys
+        old = reduce(xor, keys[top:last + 1], 0)
+        for i in range(n - 1, -1, -1):
+            lo, hi, shift = full[i - 1] + 1 if i else top, full[i], n - i
+            if lo < hi:
+                rows[lo + shift:hi + shift] = rows[lo:hi]
+                counts[lo + shift:hi + shift] = counts[lo:hi]
+                colors[(lo + shift) * w:(hi + shift) * w] = colors[lo * w:hi * w]
+        rows[top:top + n] = [0] * n
+        counts[top:top + n] = [0] * n
+        colors[top * w:(top + n) * w] = bytes(n * w)
+        # 顶部补的空行键为0 其余移动过的行重新计算
+        keys[top:top + n] = [0] * n
+        keys[top + n:last + 1] = self.zobrist.keys(rows[top + n:last + 1], top + n)
+        self.key ^= old ^ reduce(xor, keys[top + n:last + 1], 0)
+        # 最高小方块没被消除的列 下移其下方的满行数 被消除的列从下移后的下一行往下重新找
+        first = full[0]
+        for x, t in enumerate(tops):
+            if t < first:
+                tops[x] = t + n
+            elif t < self.height:
+                below = n - bisect_right(full, t)
+                tops[x] = self._scan_top(x, t + 1 + below) if t in full else t + below
+        self.top = min(tops)
+        return full
+
+    def _rekey(self, y):
+        """第y行已修改 更新该行的键与地图的键"""
+        k = self.zobrist.key(y, self.rows[y])
+        self.key ^= self.keys[y] ^ k
+        self.keys[y] = k
+
+    def _touch(self, lo, hi):
+        """第lo到hi行已修改 下次快照重新拷贝这些行所在的块"""
+        if lo < self._lo:
+            self._lo = lo
+        if hi > self._hi:
+            self._hi = hi
+
+    def snapshot(self):
+        """
+        保存地图 只拷贝上次快照之后修改过的块 没有修改时直接返回上次的快照
+        :return: 不可变快照 (块元组, 各列最高行元组, 最高行, 哈希) 每块为(行掩码元组, 行计数元组, 颜色bytes, 行键元组)
+        """
+        snap, lo, hi = self._snap, self._lo, self._hi
+        if snap is not None and lo > hi:
+            return snap
+        if snap is None:
+            chunks, lo, hi = [None] * (-(-self.height // SNAP_ROWS)), 0, self.height - 1
+        else:
+            chunks = list(snap[0])
+        rows, counts, colors, keys, w = self.rows, self.counts, self.colors, self.keys, self.width
+        for c in range(lo // SNAP_ROWS, hi // SNAP_ROWS + 1):
+            a = c * SNAP_ROWS
+            b = min(a + SNAP_ROWS, self.height)
+            chunks[c] = (tuple(rows[a:b]), tuple(counts[a:b]), bytes(colors[a * w:b * w]), tuple(keys[a:b]))
+        self._snap = snap = (tuple(chunks), tuple(self.tops), self.top, self.key)
+        self._lo, self._hi = self.height, -1
+        return snap
+
+    def restore(self, snap):
+        """
+        恢复snapshot保存的地图 与当前状态共用的块不拷贝
+        :param snap: 同一尺寸地图的快照
+        :return: None
+        """
+        cur, lo, hi = self._snap, self._lo, self._hi
+        chunks, tops, self.top, self.key = snap
+        rows, counts, colors, keys, w = self.rows, self.counts, self.colors, self.keys, self.width
+        for c, chunk in enumerate(chunks):
+            a = c * SNAP_ROWS
+            # 当前内容就是上次快照中的同一块 且之后没有修改
+            if cur is not None and cur[0][c] is chunk and not (lo < a + SNAP_ROWS and hi >= a):
+                continue
+            b = a + len(chunk[0])
+            rows[a:b], counts[a:b], colors[a * w:b * w], keys[a:b] = chunk
+        self.tops[:] = tops
+        self._snap, self._lo, self._hi = snap, self.height, -1
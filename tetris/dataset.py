@@ -0,0 +1,226 @@
+# encoding:utf-8
+# file: dataset.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 训练数据导出 每次固定方块记录一条 定长记录文件 可零拷贝打开为NumPy memmap
+# python -m tetris.dataset PATH...
+# ##########################
+
+
+import argparse
+import json
+import os
+import struct
+
+from .shapes import BLOCK_TYPES
+
+
+# 文件头 魔数 版本号 3字节保留 头部总长度(uint32小端) 之后是JSON描述 用空格补齐到HEADER_ALIGN的倍数
+MAGIC, VERSION = b'TTDS', 1
+HEADER_ALIGN = 64
+_PREFIX = struct.Struct('<4sB3xI')
+# 分片文件后缀
+SHARD_SUFFIX = '.ttd'
+# 记录中地图之后的字段 当前方块 下个方块 旋转状态 列索引 奖励
+_TAIL = struct.Struct('<BBBHf')
+
+
+def record_dtype(width, height):
+    """
+    一条记录的NumPy dtype描述 紧凑排列 没有对齐填充
+    board为固定方块之前的地图占用 每行(width + 7) // 8字节 第x列为第x // 8字节的第x % 8位 与Board的行掩码相同
+    piece与next为BLOCK_TYPES中的索引 rot与x为当前方块最终固定的旋转状态与左上角列索引 reward为本次消除的行数
+    :param width: 地图长
+    :param height: 地图高
+    :return: 可JSON序列化的描述列表 np.dtype(descr_to_dtype(...))
+    """
+    return [['board', '|u1', [height, (width + 7) // 8]], ['piece', '|u1'], ['next', '|u1'],
+            ['rot', '|u1'], ['x', '<u2'], ['reward', '<f4']]
+
+
+def descr_to_dtype(descr):
+    """
+    文件头中的描述列表转为NumPy dtype JSON把形状元组存成了列表
+    :param descr: record_dtype的返回值或文件头中的dtype
+    :return: np.dtype
+    """
+    import numpy as np
+    return np.dtype([(f[0], f[1], tuple(f[2])) if len(f) > 2 else (f[0], f[1]) for f in descr])
+
+
+def _header_bytes(width, height):
+    """文件头 长度为HEADER_ALIGN的倍数 memmap的数据起点因此对齐"""
+    meta = json.dumps({
+        'width': width,
+        'height': height,
+        'dtype': record_dtype(width, height),
+        'record_size': height * ((width + 7) // 8) + _TAIL.size,
+        'piece_types': BLOCK_TYPES,
+        'bit_order': 'little',
+    }, sort_keys=True).encode()
+    size = -(-(_PREFIX.size + len(meta) + 1) // HEADER_ALIGN) * HEADER_ALIGN
+    return _PREFIX.pack(MAGIC, VERSION, size) + meta.ljust(size - _PREFIX.size - 1) + b'\n'
+
+
+def read_header(path):
+    """
+    读文件头
+    :param path: 分片文件路径
+    :return: (描述字典, 数据起点偏移, 完整记录数)
+    """
+    with open(path, 'rb') as f:
+        magic, version, size = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{}: not a version {} training data file'.format(path, VERSION))
+        meta = json.loads(f.read(size - _PREFIX.size).decode())
+        # 写入中途被杀时文件末尾可能有不完整的记录 不计入
+        count = (os.fstat(f.fileno()).st_size - size) // meta['record_size']
+    return meta, size, count
+
+
+def open_shard(path, mode='r'):
+    """
+    零拷贝打开一个分片 记录在访问时才从文件读入 不占用内存
+    :param path: 分片文件路径
+    :param mode: memmap模式 'r'只读 'r+'可改
+    :return: 结构化数组 字段见record_dtype
+    """
+    import numpy as np
+    meta, offset, count = read_header(path)
+    dtype = descr_to_dtype(meta['dtype'])
+    if not count:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(count,))
+
+
+def shard_paths(directory):
+    """目录下全部分片文件 按文件名排序"""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SHARD_SUFFIX))
+
+
+def open_dataset(directory):
+    """
+    打开目录下的全部分片
+    :param directory: 分片目录
+    :return: 结构化数组列表 每个分片一个 训练时逐个遍历 不需要拼接到内存中
+    """
+    return [open_shard(path) for path in shard_paths(directory)]
+
+
+def unpack_boards(boards, width):
+    """
+    地图占用展开为布尔数组
+    :param boards: board字段 形状(..., 高, 每行字节数)
+    :param width: 地图长
+    :return: 布尔数组 形状(..., 高, 长)
+    """
+    import numpy as np
+    return np.unpackbits(boards, axis=-1, bitorder='little')[..., :width].astype(bool)
+
+
+class Exporter(object):
+    """
+    训练数据导出器 只追加写 记录先编码到内存缓冲区 攒够flush_size字节才写一次文件
+    每次写入都是完整的记录 多个进程并行导出时各写各的分片 不需要加锁
+    文件已存在时校验地图尺寸后接着追加
+    """
+
+    def __init__(self, path, width, height, flush_size=1 << 22):
+        """
+        :param path: 分片文件路径
+        :param width: 地图长
+        :param height: 地图高
+        :param flush_size: 缓冲区写文件的阈值 字节
+        """
+        self.path = path
+        self.width, self.height = width, height
+        self.row_bytes = (width + 7) // 8
+        self.record_size = height * self.row_bytes + _TAIL.size
+        self.flush_size = max(flush_size, self.record_size)
+        if os.path.exists(path) and os.path.getsize(path):
+            meta, offset, self.count = read_header(path)
+            if (meta['width'], meta['height']) != (width, height):
+                raise ValueError('{}: board is {}x{}, not {}x{}'.format(
+                    path, meta['width'], meta['height'], width, height))
+            self.file = open(path, 'r+b')
+            # 丢掉上次中途被杀时留下的不完整记录
+            self.file.truncate(offset + self.count * self.record_size)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.count = 0
+            self.file = open(path, 'wb')
+            self.file.write(_header_bytes(width, height))
+        self.buf = bytearray()
+
+    def attach(self, engine):
+        """
+        挂到引擎上 此后引擎每次固定方块都记录一条
+        :param engine: 游戏引擎 地图尺寸应与导出器相同
+        :return: 导出器自身
+        """
+        if (engine.width, engine.height) != (self.width, self.height):
+            raise ValueError('engine board is {}x{}, exporter expects {}x{}'.format(
+                engine.width, engine.height, self.width, self.height))
+        engine.on_lock = self.record
+        return self
+
+    def record(self, engine):
+        """
+        记录一条 由引擎在固定方块之前调用 地图中还没有当前方块
+        :param engine: 游戏引擎
+        :return: None
+        """
+        board, piece, shape = engine.board, engine.piece, engine.shape
+        rows, full, nb = board.rows, board.full, self.row_bytes
+        buf = self.buf
+        buf += b''.join([row.to_bytes(nb, 'little') for row in rows])
+        lines = 0
+        for i, m in enumerate(shape.masks[piece.x]):
+            if rows[piece.y + i] | m == full:
+                lines += 1
+        buf += _TAIL.pack(BLOCK_TYPES.index(piece.type), BLOCK_TYPES.index(engine.next_type),
+                          piece.rot, piece.x, lines)
+        self.count += 1
+        if len(buf) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """缓冲区写入文件"""
+        if self.buf:
+            self.file.write(self.buf)
+            self.file.flush()
+            self.buf = bytearray()
+
+    def close(self):
+        """写完缓冲区并关闭文件"""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.dataset', description='训练数据分片信息')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='分片文件或分片目录')
+    args = parser.parse_args(argv)
+    total = 0
+    for arg in args.paths:
+        for path in shard_paths(arg) if os.path.isdir(arg) else [arg]:
+            meta, offset, count = read_header(path)
+            total += count
+            print('{}: {}x{} board, {} records of {} bytes, {} lines cleared'.format(
+                path, meta['width'], meta['height'], count, meta['record_size'],
+                int(open_shard(path)['reward'].sum()) if count else 0))
+    print('{} records'.format(total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# encoding:utf-8
+# file: engine.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 无终端输出的游戏引擎
+# ##########################
+
+
+import random
+
+from .board import Board
+from .shapes import BLOCK_TYPES, Piece, compile_shapes
+
+
+# 地图默认长与高
+BOARD_WIDTH, BOARD_HEIGHT = 16, 26
+# 64位掩码与splitmix64常数 方块序列由(对局种子, 方块序号)直接算出
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+# 动作 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转 'to_b'直接落到底 None为不动
+# batch.BatchEngine只实现前四个
+ACTIONS = ('to_l', 'to_r', 'to_d', 'to_u', 'to_b')
+# 按键 => 动作 '_'为没有按键时的重力下落 其余按键不动
+KEY_ACTIONS = {'a': 'to_l', 'd': 'to_r', 's': 'to_d', 'w': 'to_u', 'x': 'to_b', '_': 'to_d'}
+
+
+def piece_type(seed, k):
+    """
+    第k个方块的类型 splitmix64(seed + k * GOLDEN) 与batch.BatchEngine的向量化版本相同
+    随机数状态只有种子与计数 保存和恢复都不需要额外空间
+    :param seed: 对局种子
+    :param k: 方块序号 从0开始
+    :return: 方块类型
+    """
+    z = (seed + k * GOLDEN) & MASK64
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EB & MASK64
+    return BLOCK_TYPES[(z ^ (z >> 31)) % len(BLOCK_TYPES)]
+
+
+class TetrisEngine(object):
+    """
+    游戏引擎 地图 当前方块 下个方块 计分与随机数状态都属于实例 没有任何输入输出
+    地图中只有已固定的小方块 当前方块不填充到地图中
+    """
+
+    def __init__(self, seed=None, width=BOARD_WIDTH, height=BOARD_HEIGHT):
+        """
+        :param seed: 随机数种子 相同种子生成相同的方块序列 None为随机种子
+        :param width: 地图长
+        :param height: 地图高
+        """
+        self.width, self.height = width, height
+        self.shapes = compile_shapes(width)
+        self.board = Board(width, height)
+        self.piece = Piece()
+        # 方块出生点的左上角地图索引
+        self.spawn_x, self.spawn_y = width // 2 - 2, 0
+        # 固定方块之前的回调 参数为引擎自身 用于导出训练数据 见dataset.Exporter
+        self.on_lock = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """
+        重新开始一局
+        :param seed: 随机数种子 None为随机种子
+        :return: None
+        """
+        self.seed = random.getrandbits(64) if seed is None else seed & MASK64
+        self.board.clear()
+        # 生成方块计数 得分即消除的总行数 下个方块类型
+        self.count, self.score, self.next_type = 0, 0, '_'
+        self.game_over = False
+        # 最近一次固定方块时消除的行索引 从上到下 供画面只重绘移动过的行
+        self.cleared = []
+        self._pick()
+        self._spawn()
+
+    def snapshot(self):
+        """
+        保存引擎状态 地图快照与上次快照共用没有修改的块 随机数状态只有种子与计数
+        快照不可变 可以大量保存在环形缓冲区中 多个快照之间共用相同的块
+        :return: 状态元组 交给restore恢复 最后一项为游戏是否结束
+        """
+        p = self.piece
+        return (self.board.snapshot(), p.type, p.rot, p.x, p.y,
+                self.count, self.score, self.next_type, self.game_over)
+
+    def restore(self, snap):
+        """
+        恢复snapshot保存的状态 种子应与保存时相同
+        :param snap: 状态元组
+        :return: None
+        """
+        p = self.piece
+        board, p.type, p.rot, p.x, p.y, self.count, self.score, self.next_type, self.game_over = snap
+        self.board.restore(board)
+
+    @property
+    def shape(self):
+        """当前方块的形状表项"""
+        return self.shapes[self.piece.type][self.piece.rot]
+
+    def _pick(self):
+        """挑选下个方块"""
+        self.next_type = piece_type(self.seed, self.count)
+        self.count += 1
+
+    def _spawn(self):
+        """下个方块成为当前方块 出生点已被占用则游戏结束"""
+        piece = self.piece
+        piece.reset(self.next_type, self.spawn_x, self.spawn_y)
+        self._pick()
+        if self.board.collide(piece.y, self.shape.masks[piece.x]):
+            self.game_over = True
+
+    def fits(self, rot, x, y):
+        """
+        当前方块以旋转状态rot放在x,y处 是否在地图内且与地图没有重叠
+        :param rot: 旋转状态
+        :param x: 左上角列索引
+        :param y: 左上角行索引
+        :return: 布尔型
+        """
+        shape = self.shapes[self.piece.type][rot]
+        return 0 <= x <= self.width - shape.width and \
+            0 <= y <= self.height - shape.height and \
+            not self.board.collide(y, shape.masks[x])
+
+    def drop_distance(self, rot=None, x=None, y=None):
+        """
+        当前方块能竖直下落的距离 参数缺省时为当前方块的状态 由地图轮廓直接算出
+        :param rot: 旋转状态
+        :param x: 左上角列索引
+        :param y: 左上角行索引
+        :return: 下落行数
+        """
+        piece = self.piece
+        rot = piece.rot if rot is None else rot
+        x = piece.x if x is None else x
+        y = piece.y if y is None else y
+        return self.board.drop_distance(x, y, self.shapes[piece.type][rot])
+
+    def step(self, action=None):
+        """
+        推进一步 向下移动失败时方块固定 消行并生成新方块
+        :param action: 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转 'to_b'直接落到底 None为不动
+        :return: (地图, 当前方块, 本步消除行数, 游戏是否结束) 地图与方块为实例自身 不是拷贝
+        """
+        piece = self.piece
+        if self.game_over or action is None:
+            return self.board, piece, 0, self.game_over
+        x, y, rot = piece.x, piece.y, piece.rot
+        if action == 'to_l':
+            x -= 1
+        elif action == 'to_r':
+            x += 1
+        elif action == 'to_d':
+            y += 1
+        elif action == 'to_u':
+            # 逆时针旋转 左上角不变
+            rot = (rot + 1) & 3
+        elif action == 'to_b':
+            piece.y += self.drop_distance()
+            return self.board, piece, self._lock(), self.game_over
+        else:
+            raise ValueError('unknown action: {!r}'.format(action))
+        if self.fits(rot, x, y):
+            piece.x, piece.y, piece.rot = x, y, rot
+            return self.board, piece, 0, False
+        if action == 'to_d':
+            return self.board, piece, self._lock(), self.game_over
+        return self.board, piece, 0, False
+
+    def place(self, rot, x):
+        """
+        把当前方块旋转为rot并平移到第x列 然后直接落到底固定 供机器人快速模拟
+        :param rot: 旋转状态 0-3
+        :param x: 左上角列索引
+        :return: 同step
+        """
+        piece = self.piece
+        if self.game_over:
+            return self.board, piece, 0, True
+        shape = self.shapes[piece.type][rot]
+        if not 0 <= x <= self.width - shape.width:
+            raise ValueError('column {} out of range for rotation {}'.format(x, rot))
+        if self.board.collide(piece.y, shape.masks[x]):
+            # 出生行都放不下 即方块堆到顶了
+            self.game_over = True
+            return self.board, piece, 0, True
+        piece.rot, piece.x = rot, x
+        piece.y += self.drop_distance(rot, x, piece.y)
+        return self.board, piece, self._lock(), self.game_over
+
+    def _lock(self):
+        """
+        固定当前方块 消行 生成新方块 在出生行就固定则游戏结束
+        :return: 消除的行数
+        """
+        piece, shape = self.piece, self.shape
+        if self.on_lock is not None:
+            self.on_lock(self)
+        self.board.stamp(piece.x, piece.y, shape)
+        self.cleared = self._eliminate(range(piece.y, piece.y + shape.height))
+        lines = len(self.cleared)
+        self.score += lines
+        if piece.y == self.spawn_y:
+            self.game_over = True
+        else:
+            self._spawn()
+        return lines
+
+    def _eliminate(self, ys):
+        """
+        消除满行 只有刚固定的方块所在的行可能变满
+        :param ys: 要检查的行索引
+        :return: 被消除的行索引列表 从上到下
+        """
+        return self.board.clear_lines(ys)
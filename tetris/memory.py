@@ -0,0 +1,27 @@
+# encoding:utf-8
+# file: memory.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 进程内存统计 服务器与稳定性测试共用
+# ##########################
+
+
+import os
+import sys
+
+
+def rss_bytes():
+    """
+    本进程的常驻内存 Linux读/proc 其他系统退回最大常驻内存
+    :return: 字节数
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
@@ -0,0 +1,444 @@
+# encoding:utf-8
+# file: netplay.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 双人网络对战 只交换输入 预测对方输入 预测错误时回滚
+# python -m tetris.netplay 在本机回环上运行两个机器人对战 统计回滚与延迟
+# ##########################
+
+
+import argparse
+import random
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+from .engine import KEY_ACTIONS, TetrisEngine
+from .replay import MAGIC, VERSION, REC_EVENT, read_varint, write_varint
+
+# 数据流与录像文件格式相同 文件头后是按键事件 没有关键帧
+# 双方的文件头中 地图尺寸必须相同 种子以主机为准 下落间隔各自不同
+
+
+def encode_header(engine, interval):
+    """
+    本方的文件头
+    :param engine: 本方游戏引擎
+    :param interval: 本方下落间隔 秒
+    :return: bytearray
+    """
+    buf = bytearray(MAGIC)
+    buf.append(VERSION)
+    for n in (engine.width, engine.height, int(round(interval * 1000)), engine.seed, 0):
+        write_varint(buf, n)
+    return buf
+
+
+def _read_header(sock):
+    """
+    阻塞读取对方的文件头
+    :return: ((地图长, 地图高, 下落间隔毫秒, 种子), 文件头之后已收到的数据)
+    """
+    data = bytearray()
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('peer closed during handshake')
+        data += chunk
+        if len(data) <= len(MAGIC):
+            continue
+        if data[:len(MAGIC)] != MAGIC or data[len(MAGIC)] != VERSION:
+            raise ConnectionError('peer is not a tetris client or has a different version')
+        try:
+            pos, header = len(MAGIC) + 1, []
+            for _ in range(5):
+                n, pos = read_varint(data, pos)
+                header.append(n)
+        except IndexError:
+            continue
+        return tuple(header[:4]), data[pos:]
+
+
+class RemoteGame(object):
+    """
+    对方的游戏 只由对方的按键推进
+    还没收到的输入按只有重力下落预测 每个预测事件之前保存一次引擎状态
+    收到的按键与预测相同时直接确认 不同时恢复到第一个预测事件之前的状态 重新模拟
+    游戏状态只取决于按键序列 与时间戳无关 所以回滚后的结果与对方完全一致
+    """
+
+    def __init__(self, seed, width, height, interval_ms):
+        """
+        :param seed: 对局种子
+        :param width: 地图长
+        :param height: 地图高
+        :param interval_ms: 对方的下落间隔 毫秒
+        """
+        self.engine = TetrisEngine(seed, width, height)
+        self.interval_ms = interval_ms
+        # 最后确认的事件时间戳与最后确认的重力下落时间戳 预测从后者开始
+        self.confirmed_ts, self.gravity_ts = 0, 0
+        # 预测的事件 (时间戳, 按键, 执行前的引擎状态)
+        self.predicted = []
+        # 对方已确认结束的时间戳 连接关闭也算结束
+        self.over_ts = None
+        # 统计 确认事件数 预测命中数 回滚次数 重新模拟的事件数
+        # 最大回滚深度 即预测错误的实际事件到最新预测事件的毫秒数
+        self.confirmed, self.hits, self.rollbacks, self.resimulated, self.max_depth = 0, 0, 0, 0, 0
+
+    @property
+    def ended(self):
+        return self.over_ts is not None
+
+    def confirm(self, ts, key):
+        """
+        应用对方的一个实际按键
+        :param ts: 对方的毫秒时间戳
+        :param key: 按键字符
+        :return: None
+        """
+        if self.ended:
+            return
+        engine = self.engine
+        self.confirmed += 1
+        if self.predicted and self.predicted[0][1] == key:
+            self.predicted.pop(0)
+            self.hits += 1
+        else:
+            if self.predicted:
+                self._rollback(ts)
+            engine.step(KEY_ACTIONS.get(key))
+        self.confirmed_ts = ts
+        if key == '_':
+            self.gravity_ts = ts
+        # 确认后的状态 即下一个预测事件之前保存的状态 没有预测时为引擎当前状态
+        if self.predicted[0][2][-1] if self.predicted else engine.game_over:
+            self.over_ts = ts
+
+    def _rollback(self, ts):
+        """丢弃全部预测 恢复到最后确认的状态"""
+        self.rollbacks += 1
+        self.resimulated += len(self.predicted)
+        self.max_depth = max(self.max_depth, self.predicted[-1][0] - ts)
+        self.engine.restore(self.predicted[0][2])
+        self.predicted = []
+
+    def predict(self, now):
+        """
+        预测到对方时间now为止的重力下落
+        :param now: 毫秒时间戳
+        :return: None
+        """
+        engine = self.engine
+        if self.ended:
+            return
+        t = (self.predicted[-1][0] if self.predicted else self.gravity_ts) + self.interval_ms
+        while t <= now and not engine.game_over:
+            self.predicted.append((t, '_', engine.snapshot()))
+            engine.step('to_d')
+            t += self.interval_ms
+
+    def close(self):
+        """对方的数据流已结束 丢弃预测 以最后确认的状态为准"""
+        if self.predicted:
+            self._rollback(self.confirmed_ts)
+        if not self.ended:
+            self.over_ts = self.confirmed_ts
+
+
+class NetSession(object):
+    """
+    一局网络对战的本方连接 非阻塞TCP 本方每个tick发送一个按键 poll接收对方的按键
+    rtt不为0时 收到的数据延迟rtt/2毫秒才处理 双方都设置时即注入rtt毫秒的往返延迟
+    """
+
+    def __init__(self, sock, engine, peer_header, pending=b'', rtt=0):
+        """
+        :param sock: 已完成握手的套接字
+        :param engine: 本方游戏引擎 种子已与对方一致
+        :param peer_header: 对方的文件头 (地图长, 地图高, 下落间隔毫秒, 种子)
+        :param pending: 握手时已收到的文件头之后的数据
+        :param rtt: 注入的往返延迟 毫秒
+        """
+        width, height, interval_ms, _ = peer_header
+        if (width, height) != (engine.width, engine.height):
+            raise ConnectionError('peer board is {}x{}, local board is {}x{}'.format(
+                width, height, engine.width, engine.height))
+        self.sock = sock
+        sock.setblocking(False)
+        self.engine = engine
+        self.remote = RemoteGame(engine.seed, width, height, interval_ms)
+        self.delay = rtt / 2000
+        self._out, self._in, self._pos = bytearray(), bytearray(), 0
+        # 注入延迟时暂存的数据 (可以处理的时间, 数据)
+        self._held = deque()
+        self._eof = False
+        self.t0 = time.monotonic()
+        self.ts = 0
+        # 本方结束的时间戳
+        self.over_ts = None
+        if pending:
+            self._receive(bytes(pending))
+
+    @classmethod
+    def host(cls, port, engine, interval, rtt=0, bind=''):
+        """
+        等待对方连接 对局种子以本方为准
+        :param port: 监听端口
+        :param engine: 本方游戏引擎
+        :param interval: 本方下落间隔 秒
+        :param rtt: 注入的往返延迟 毫秒
+        :param bind: 监听地址 默认为全部地址
+        :return: NetSession
+        """
+        server = socket.create_server((bind, port))
+        try:
+            sock, _ = server.accept()
+        finally:
+            server.close()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(encode_header(engine, interval))
+        header, pending = _read_header(sock)
+        return cls(sock, engine, header, pending, rtt)
+
+    @classmethod
+    def join(cls, address, engine, interval, rtt=0):
+        """
+        连接主机 本方引擎用主机的种子重新开始
+        :param address: (主机, 端口)
+        :param engine: 本方游戏引擎
+        :param interval: 本方下落间隔 秒
+        :param rtt: 注入的往返延迟 毫秒
+        :return: NetSession
+        """
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        header, pending = _read_header(sock)
+        engine.reset(header[3])
+        sock.sendall(encode_header(engine, interval))
+        return cls(sock, engine, header, pending, rtt)
+
+    def now(self):
+        """本局开始以来的毫秒数"""
+        return int((time.monotonic() - self.t0) * 1000)
+
+    def send(self, key):
+        """
+        发送本方一个tick的按键 在引擎推进之前调用
+        :param key: 按键字符
+        :return: None
+        """
+        if self.over_ts is not None:
+            return
+        ts = self.now()
+        write_varint(self._out, (ts - self.ts) << 1 | REC_EVENT)
+        self._out.append(ord(key) & 0xff)
+        self.ts = ts
+        self._send()
+
+    def _send(self):
+        """尽量写出发送缓冲区 写不完的留到下次 不阻塞"""
+        try:
+            while self._out:
+                del self._out[:self.sock.send(self._out)]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            # 对方已断开 之后的按键丢弃
+            self._out.clear()
+
+    def _receive(self, data):
+        self._held.append((time.monotonic() + self.delay, data))
+
+    def poll(self):
+        """
+        收发数据 确认对方的按键 并把对方的游戏预测到现在 每个tick调用一次 不阻塞
+        :return: None
+        """
+        self._send()
+        while not self._eof:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b''
+            if not data:
+                self._eof = True
+                break
+            self._receive(data)
+        now = time.monotonic()
+        held = self._held
+        while held and held[0][0] <= now:
+            self._in += held.popleft()[1]
+        self._parse()
+        remote = self.remote
+        if self._eof and not held:
+            remote.close()
+        else:
+            remote.predict(self.now())
+
+    def _parse(self):
+        """解析完整的按键事件 不完整的留在缓冲区"""
+        buf, pos, remote = self._in, self._pos, self.remote
+        ts = remote.confirmed_ts
+        while pos < len(buf):
+            try:
+                head, p = read_varint(buf, pos)
+            except IndexError:
+                break
+            if p >= len(buf):
+                break
+            ts += head >> 1
+            remote.confirm(ts, chr(buf[p]))
+            pos = p + 1
+        del buf[:pos]
+        self._pos = 0
+
+    def finish(self):
+        """
+        本方游戏结束 发送剩余数据后关闭发送方向 对方据此知道本方已结束
+        :return: None
+        """
+        if self.over_ts is not None:
+            return
+        self.over_ts = self.ts
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(self._out)
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self._out.clear()
+        self.sock.setblocking(False)
+
+    def result(self):
+        """
+        对局结果 后结束的一方赢 对方确认的时间已超过本方结束时间即可判定 同时结束时比较得分
+        双方时间戳的起点相差约半个往返 只在这个精度内比较
+        :return: 1本方赢 -1对方赢 0平局 None还没有结果
+        """
+        remote = self.remote
+        if self.over_ts is None:
+            # 对方已结束 本方玩得更久即赢 不必等本方结束
+            return 1 if remote.ended and self.ts > remote.over_ts else None
+        if not remote.ended:
+            return -1 if remote.confirmed_ts > self.over_ts else None
+        mine, theirs = self.over_ts, remote.over_ts
+        if mine == theirs:
+            mine, theirs = self.engine.score, remote.engine.score
+        return (mine > theirs) - (mine < theirs)
+
+    def close(self):
+        self.sock.close()
+
+
+def _bot(session, seconds, key_rate, rng, stats):
+    """
+    本机回环测试的一方 按真实时间下落 按键间隔为指数分布 与终端版主循环一样每个tick发送一次
+    """
+    engine, interval = session.engine, stats['interval']
+    deadline = time.monotonic() + interval
+    next_key = time.monotonic() + rng.expovariate(key_rate)
+    end = time.monotonic() + seconds
+    ticks, worst = 0, 0.0
+    while not engine.game_over and time.monotonic() < end:
+        t = min(deadline, next_key)
+        delay = t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if t == deadline:
+            key = '_'
+            deadline += interval
+        else:
+            key = rng.choice('aadw')
+            next_key += rng.expovariate(key_rate)
+        # 本方的一个tick 发送 推进 收取 都不等待网络
+        start = time.perf_counter()
+        session.send(key)
+        engine.step(KEY_ACTIONS.get(key))
+        session.poll()
+        worst = max(worst, time.perf_counter() - start)
+        ticks += 1
+    session.finish()
+    wait_end = time.monotonic() + 5
+    while not session.remote.ended and time.monotonic() < wait_end:
+        time.sleep(0.005)
+        session.poll()
+    stats.update(ticks=ticks, worst_tick_ms=worst * 1000, result=session.result(),
+                 snapshot=engine.snapshot())
+
+
+def loopback(seconds=3.0, rtt=100, seed=0, interval=0.05, key_rate=8.0):
+    """
+    在本机回环上运行两个机器人对战
+    :param seconds: 对战时长 秒
+    :param rtt: 注入的往返延迟 毫秒
+    :param seed: 对局种子与机器人按键的种子
+    :param interval: 双方的下落间隔 秒
+    :param key_rate: 每秒平均按键数
+    :return: (主机统计, 加入方统计) 统计为字典 remote_ok表示本方看到的对方状态与对方实际状态一致
+    """
+    server = socket.create_server(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    server.close()
+    sessions = {}
+
+    def open_host():
+        sessions['host'] = NetSession.host(port, TetrisEngine(seed), interval, rtt, bind='127.0.0.1')
+
+    t = threading.Thread(target=open_host)
+    t.start()
+    for _ in range(100):
+        try:
+            sessions['join'] = NetSession.join(('127.0.0.1', port), TetrisEngine(), interval, rtt)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.01)
+    t.join()
+    stats = {name: {'interval': interval} for name in sessions}
+    threads = [threading.Thread(target=_bot, args=(sessions[name], seconds, key_rate,
+                                                   random.Random('{}:{}'.format(seed, name)), stats[name]))
+               for name in ('host', 'join')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    snapshots = {name: stats[name].pop('snapshot') for name in stats}
+    for name, other in (('host', 'join'), ('join', 'host')):
+        remote = sessions[name].remote
+        stats[name].update(
+            remote_ok=remote.engine.snapshot() == snapshots[other],
+            confirmed=remote.confirmed, hits=remote.hits, rollbacks=remote.rollbacks,
+            resimulated=remote.resimulated, max_depth_ms=remote.max_depth)
+        sessions[name].close()
+    return stats['host'], stats['join']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.netplay',
+                                     description='本机回环对战测试 检查回滚后双方状态一致')
+    parser.add_argument('--rtt', type=int, default=100, help='注入的往返延迟 毫秒')
+    parser.add_argument('-t', '--seconds', type=float, default=3.0, help='对战时长 秒')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='种子')
+    parser.add_argument('--interval', type=float, default=0.05, help='下落间隔 秒')
+    parser.add_argument('--key-rate', type=float, default=8.0, help='每秒平均按键数')
+    args = parser.parse_args(argv)
+    ok = True
+    for name, s in zip(('host', 'join'), loopback(args.seconds, args.rtt, args.seed, args.interval,
+                                                  args.key_rate)):
+        ok = ok and s['remote_ok']
+        sys.stderr.write('{name}: {ticks} ticks worst tick {worst_tick_ms:.2f}ms result {result} | '
+                         'remote {confirmed} events {hits} predicted {rollbacks} rollbacks '
+                         '{resimulated} resimulated max depth {max_depth_ms}ms {state}\n'.format(
+                             name=name, state='consistent' if s['remote_ok'] else 'DIVERGED', **s))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+# encoding:utf-8
+# file: render.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 帧缓冲渲染 前后台缓冲区差分输出
+# ##########################
+
+
+import os
+import select
+import sys
+import threading
+import time
+from unicodedata import east_asian_width
+
+
+# 默认属性 即复位转义序列
+SGR_RESET = '\033[0m'
+# 空白小方块 占2个英文字符宽度
+BLANK = '  '
+# 滚动方式 'lr'为用上下与左右边距(DECSTBM与DECSLRM)圈出滚动区域 只移动指定的列
+# None为不使用终端滚动 全部由差分重绘 只设上下边距时整行移动 会带动计分板与边框 实测比差分重绘输出更多
+SCROLL_MODES = ('lr', None)
+# 查询左右边距模式(DECRQM ?69)的转义序列 应答为ESC[?69;Ps$y Ps为1或2表示支持
+_DECRQM_LRMM = '\033[?69$p'
+
+
+def goto_seq(x, y):
+    """
+    方块坐标对应的光标定位转义序列 1个小方块占2个英文字符宽度
+    :param x: 方块坐标x
+    :param y: 方块坐标y
+    :return: 转义序列字符串
+    """
+    return '\033[{};{}H'.format(y, (x - 1) * 2 + 1)
+
+
+def probe_scroll(fd, out=None, timeout=0.2):
+    """
+    探测终端的滚动能力 终端应已处于关闭回显的cbreak模式 否则应答会显示出来
+    查询左右边距模式 支持则为'lr' 应答表示不支持 超时没有应答或哑终端为None
+    :param fd: 输入文件描述符
+    :param out: 文本输出流 默认为标准输出
+    :param timeout: 等待应答的时长 秒
+    :return: SCROLL_MODES之一
+    """
+    if os.environ.get('TERM', 'dumb') == 'dumb' or not os.isatty(fd):
+        return None
+    out = sys.stdout if out is None else out
+    out.write(_DECRQM_LRMM)
+    out.flush()
+    reply = b''
+    while not reply.endswith(b'y'):
+        if not select.select([fd], [], [], timeout)[0]:
+            break
+        data = os.read(fd, 64)
+        if not data:
+            break
+        reply += data
+    return 'lr' if b'?69;1$y' in reply or b'?69;2$y' in reply else None
+
+
+def split_cells(s):
+    """
+    把字符串切分为小方块单元 每个单元占2个英文字符宽度 字符之间不插入空格
+    一段文本在单元边界处结束时切开 中文等宽字符跨过单元边界时 文本放在起始单元 之后的单元为空字符串的后续单元
+    例如'暂停/开始'为['暂', '停', '/开始 ', '', ''] 只在末尾不足一个单元时补空格
+    :param s: 字符串
+    :return: 单元列表
+    """
+    cells, buf, cols = [], '', 0
+    for ch in s:
+        buf += ch
+        cols += 2 if east_asian_width(ch) in 'WF' else 1
+        if not cols & 1:
+            cells.append(buf)
+            cells.extend([''] * (cols // 2 - 1))
+            buf, cols = '', 0
+    if buf:
+        cells.append(buf + ' ')
+        cells.extend([''] * (cols // 2))
+    return cells
+
+
+class Screen(object):
+    """
+    终端帧缓冲 后台缓冲区为期望的画面 前台缓冲区为终端上已有的画面
+    绘制函数只修改后台缓冲区 flush时两者差分 一帧只写一次标准输出
+    相邻同色单元共用一个颜色转义序列 相邻单元之间不再定位光标
+    文本为空字符串的单元是左边单元文本的后续 它们与起始单元一起输出
+    """
+
+    def __init__(self, width, height, out=None):
+        """
+        :param width: 画面长 单位为小方块
+        :param height: 画面高
+        :param out: 二进制输出流 默认为标准输出
+        """
+        self.width, self.height = width, height
+        self.out = out
+        blank = (SGR_RESET, BLANK)
+        # 单元为(颜色转义序列, 文本)元组 按行展开为一维列表
+        self._back = [blank] * (width * height)
+        self._front = [blank] * (width * height)
+        # 后台缓冲区中被修改过的行
+        self._dirty = set()
+        # 终端滚动方式 见SCROLL_MODES 下一帧开头要输出的滚动转义序列
+        self.scroll = None
+        self._pre = []
+        # 输出统计 上一帧字节数 总字节数 帧数
+        self.frame_bytes, self.total_bytes, self.frames = 0, 0, 0
+
+    @property
+    def bytes_per_frame(self):
+        """平均每帧输出字节数"""
+        return self.total_bytes / self.frames if self.frames else 0.0
+
+    def put(self, x, y, sgr, text=BLANK):
+        """
+        修改后台缓冲区的一个单元
+        :param x: 方块坐标x 从1开始
+        :param y: 方块坐标y 从1开始
+        :param sgr: 颜色转义序列
+        :param text: 单元文本 占2个英文字符宽度
+        :return: None
+        """
+        self._back[(y - 1) * self.width + x - 1] = (sgr, text)
+        self._dirty.add(y - 1)
+
+    def text(self, x, y, s, sgr=SGR_RESET):
+        """
+        在后台缓冲区写一段文本
+        :param x: 起点坐标x
+        :param y: 起点坐标y
+        :param s: 文本
+        :param sgr: 颜色转义序列
+        :return: None
+        """
+        cells = split_cells(s)
+        for i, cell in enumerate(cells):
+            self.put(x + i, y, sgr, cell)
+        # 原来更长的文本留下的后续单元已没有起始单元
+        back, i = self._back, (y - 1) * self.width + x - 1 + len(cells)
+        end = y * self.width
+        while i < end and back[i][1] == '':
+            back[i] = (SGR_RESET, BLANK)
+            i += 1
+
+    def scroll_down(self, x, y, w, h, n=1):
+        """
+        区域内的画面整体下移n行 底部n行被移出 顶部n行需要重绘
+        由终端在滚动区域内插入空行完成 前台缓冲区同样移动 之后差分只输出真正变化的单元
+        :param x: 区域左上角坐标x
+        :param y: 区域左上角坐标y
+        :param w: 区域长
+        :param h: 区域高
+        :param n: 下移行数
+        :return: 布尔型 是否使用了终端滚动 为False时前台缓冲区不变
+        """
+        if self.scroll is None or not 0 < n < h:
+            return False
+        top, bottom = y, y + h - 1
+        left, right = (x - 1) * 2 + 1, (x + w - 1) * 2
+        # 左右边距只在模式69打开时有效 用完立即关闭 否则ESC[s不再是保存光标
+        self._pre.append('\033[?69h\033[{};{}s\033[{};{}r\033[{};{}H\033[{}L\033[r\033[?69l'.format(
+            left, right, top, bottom, top, left, n))
+        front, sw = self._front, self.width
+        for _y in range(bottom - 1, top - 1 + n - 1, -1):
+            base = _y * sw + x - 1
+            front[base:base + w] = front[base - n * sw:base - n * sw + w]
+        # 插入的空行颜色取决于终端 当作未知 下一帧一定重绘
+        for _y in range(top - 1, top - 1 + n):
+            base = _y * sw + x - 1
+            front[base:base + w] = [(None, None)] * w
+        self._dirty.update(range(top - 1, bottom))
+        return True
+
+    def invalidate(self):
+        """终端画面被破坏后调用 下一帧全部重绘"""
+        self._front = [(None, None)] * (self.width * self.height)
+        self._dirty.update(range(self.height))
+
+    def render(self):
+        """
+        差分前后台缓冲区 生成本帧的输出并更新前台缓冲区
+        :return: 本帧输出字节串
+        """
+        # 帧开头先输出滚动序列 它们不改变颜色属性
+        out = self._pre
+        self._pre = []
+        w = self.width
+        back, front = self._back, self._front
+        # 帧开始时终端处于默认属性 光标位置未知
+        cur_sgr, cx, cy = SGR_RESET, -1, -1
+        for y in sorted(self._dirty):
+            base = y * w
+            x = 0
+            while x < w:
+                cell = back[base + x]
+                if cell == front[base + x]:
+                    x += 1
+                    continue
+                # 后续单元变化时从起始单元开始重新输出整段文本
+                while x and not cell[1]:
+                    x -= 1
+                    cell = back[base + x]
+                # 起始单元与它的后续单元一起输出
+                end = x + 1
+                while end < w and back[base + end][1] == '':
+                    end += 1
+                front[base + x:base + end] = back[base + x:base + end]
+                # 光标正好在此单元时不需要定位
+                if x != cx or y != cy:
+                    out.append(goto_seq(x + 1, y + 1))
+                sgr, txt = cell
+                if sgr != cur_sgr:
+                    out.append(sgr)
+                    cur_sgr = sgr
+                out.append(txt)
+                x = cx = end
+                cy = y
+        self._dirty.clear()
+        if cur_sgr != SGR_RESET:
+            out.append(SGR_RESET)
+        return ''.join(out).encode('utf-8')
+
+    def flush(self):
+        """
+        输出一帧 没有变化时不写标准输出
+        :return: 本帧输出字节数
+        """
+        data = self.render()
+        self.frame_bytes = len(data)
+        if data:
+            if self.out is None:
+                # 先输出文本层中尚未刷新的内容
+                sys.stdout.flush()
+                out = sys.stdout.buffer
+            else:
+                out = self.out
+            out.write(data)
+            out.flush()
+            self.total_bytes += len(data)
+            self.frames += 1
+        return self.frame_bytes
+
+
+class RenderThread(object):
+    """
+    输出线程 游戏线程只修改帧缓冲的后台缓冲区 差分与写终端都在本线程 游戏计时不受终端速度影响
+    帧率不超过fps 标准输出设为非阻塞 终端跟不上时上一帧写完之前不生成新帧 中间的画面被跳过 不排队
+    帧缓冲由lock保护 游戏线程除了等待按键之外都持有锁 本线程只在差分时持锁
+    没有新的tick时本线程一直阻塞在事件上 不定时醒来
+    """
+
+    def __init__(self, screen, fps=60, fd=None, profiler=None):
+        """
+        :param screen: 帧缓冲
+        :param fps: 最高帧率
+        :param fd: 输出文件描述符 默认为标准输出
+        :param profiler: 性能统计 给出时每帧的差分与写终端耗时记入output阶段
+        """
+        self.screen = screen
+        self.interval = 1.0 / fps
+        self.fd = sys.stdout.fileno() if fd is None else fd
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        # 游戏线程提交的tick数 已输出到的tick数 被跳过的tick数 写终端时遇到终端满的次数
+        self.ticks, self.rendered, self.skipped, self.stalls = 0, 0, 0, 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._blocking = True
+
+    def start(self):
+        """游戏线程取得锁 启动输出线程 之前的文本层输出先写完"""
+        sys.stdout.flush()
+        self.lock.acquire()
+        self._blocking = os.get_blocking(self.fd)
+        os.set_blocking(self.fd, False)
+        self._thread = threading.Thread(target=self._run, name='render', daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """游戏线程画完一个tick后调用 持有锁"""
+        self.ticks += 1
+        self._wake.set()
+
+    def unlocked(self, func, *args):
+        """
+        释放锁执行func 用于等待按键 期间输出线程可以差分
+        :param func: 阻塞函数
+        :param args: 参数
+        :return: func的返回值
+        """
+        self.lock.release()
+        try:
+            return func(*args)
+        finally:
+            self.lock.acquire()
+
+    def stop(self):
+        """
+        停止输出线程 在游戏线程中调用 持有锁 最后一帧阻塞写完 恢复标准输出的阻塞模式
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        # 放开锁让本线程看到停止标志 之后只剩游戏线程
+        self.lock.release()
+        self._thread.join()
+        self._thread = None
+        os.set_blocking(self.fd, self._blocking)
+        self.screen.flush()
+
+    def _run(self):
+        screen, profiler = self.screen, self.profiler
+        next_frame = 0.0
+        while True:
+            self._wake.wait()
+            if self._stopping:
+                return
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                # 等待期间到来的tick合并到同一帧
+                time.sleep(delay)
+            with self.lock:
+                if self._stopping:
+                    return
+                t = time.perf_counter_ns()
+                self._wake.clear()
+                self.skipped += max(0, self.ticks - self.rendered - 1)
+                self.rendered = self.ticks
+                data = screen.render()
+            next_frame = time.monotonic() + self.interval
+            if data:
+                self._write(data)
+                screen.frame_bytes = len(data)
+                screen.total_bytes += len(data)
+                screen.frames += 1
+            if profiler is not None:
+                profiler.record('output', time.perf_counter_ns() - t)
+
+    def _write(self, data):
+        """非阻塞写完一帧 终端满时等到可写 不丢弃写了一半的帧 否则转义序列会被截断"""
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                self.stalls += 1
+                select.select([], [self.fd], [], 0.1)
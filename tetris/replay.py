@@ -0,0 +1,338 @@
+# encoding:utf-8
+# file: replay.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 对局录制与回放 python -m tetris.replay
+# ##########################
+
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+from .engine import KEY_ACTIONS, TetrisEngine, piece_type
+from .shapes import BLOCK_TYPES
+
+
+# 文件头 魔数与版本号 之后依次为varint编码的 地图长 地图高 下落间隔毫秒 种子 关键帧间隔方块数
+MAGIC, VERSION = b'TTRP', 1
+# 记录头 varint 最低位为0是按键事件 (时间差毫秒 << 1) 后跟1字节按键 为1是关键帧
+REC_EVENT, REC_KEYFRAME = 0, 1
+
+# 关键帧 event为此前的事件数 ts为毫秒时间戳 piece为(类型, 旋转状态, x, y)
+# rows为地图行位图 colors为地图颜色
+Keyframe = namedtuple('Keyframe', 'event ts count score game_over piece rows colors')
+
+
+def write_varint(buf, n):
+    """
+    无符号整数按LEB128编码追加到buf 每字节7位 最高位表示后面还有字节
+    :param buf: bytearray
+    :param n: 非负整数
+    :return: None
+    """
+    while n > 0x7f:
+        buf.append(n & 0x7f | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_varint(data, pos):
+    """
+    从data的pos处读一个varint
+    :param data: bytes
+    :param pos: 起始位置
+    :return: (整数, 下一个位置)
+    """
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _pack_colors(colors):
+    """颜色索引都小于16 两个点打包为一个字节"""
+    hi, lo = colors[0::2], colors[1::2]
+    if len(lo) < len(hi):
+        lo = lo + b'\0'
+    return bytes(a << 4 | b for a, b in zip(hi, lo))
+
+
+def _unpack_colors(data, size):
+    """_pack_colors的逆运算"""
+    colors = bytearray(len(data) * 2)
+    colors[0::2] = bytes(b >> 4 for b in data)
+    colors[1::2] = bytes(b & 0xf for b in data)
+    return colors[:size]
+
+
+class Recorder(object):
+    """
+    对局录制器 只追加写 事件编码在内存缓冲区中 攒够flush_size字节才写一次文件
+    每生成keyframe_every个方块插入一个关键帧 回放跳转时从最近的关键帧开始模拟
+    """
+
+    def __init__(self, path, engine, interval, keyframe_every=50, flush_size=1 << 16):
+        """
+        :param path: 录像文件路径
+        :param engine: 被录制的游戏引擎 应已用要录制的种子reset
+        :param interval: 下落间隔 秒 回放时恢复
+        :param keyframe_every: 关键帧间隔方块数
+        :param flush_size: 缓冲区写文件的阈值 字节
+        """
+        self.engine = engine
+        self.keyframe_every = keyframe_every
+        self.flush_size = flush_size
+        self.file = open(path, 'wb')
+        self.buf = bytearray(MAGIC)
+        self.buf.append(VERSION)
+        for n in (engine.width, engine.height, int(round(interval * 1000)), engine.seed, keyframe_every):
+            write_varint(self.buf, n)
+        self.events, self.ts = 0, 0
+        self.t0 = time.monotonic()
+        self._next_keyframe = keyframe_every
+        self._last_keyframe = None
+
+    def record(self, key, now=None):
+        """
+        记录一个tick的按键 在引擎推进之前调用
+        :param key: 按键字符 没有按键时为KEY_DEFAULT
+        :param now: time.monotonic时间 None为当前时间
+        :return: None
+        """
+        # 引擎此时已执行完前面的全部事件 关键帧在本事件之前写入
+        if self.engine.count >= self._next_keyframe:
+            self.keyframe()
+            self._next_keyframe = (self.engine.count // self.keyframe_every + 1) * self.keyframe_every
+        now = time.monotonic() if now is None else now
+        # 时间戳取整到毫秒后再求差 差值累加不会漂移
+        ts = int((now - self.t0) * 1000)
+        write_varint(self.buf, (ts - self.ts) << 1 | REC_EVENT)
+        self.buf.append(ord(key) & 0xff)
+        self.ts = ts
+        self.events += 1
+        if len(self.buf) >= self.flush_size:
+            self.flush()
+
+    def keyframe(self):
+        """
+        写入关键帧 即引擎当前状态 随机数状态只有种子与方块计数 不需要另外保存
+        :return: None
+        """
+        if self._last_keyframe == self.events:
+            return
+        self._last_keyframe = self.events
+        e, buf = self.engine, self.buf
+        piece = e.piece
+        write_varint(buf, REC_KEYFRAME)
+        for n in (self.events, self.ts, e.count, e.score, int(e.game_over),
+                  BLOCK_TYPES.index(piece.type), piece.rot, piece.x, piece.y):
+            write_varint(buf, n)
+        for row in e.board.rows:
+            write_varint(buf, row)
+        buf += _pack_colors(e.board.colors)
+
+    def flush(self):
+        """缓冲区写入文件"""
+        if self.buf:
+            self.file.write(self.buf)
+            self.file.flush()
+            self.buf = bytearray()
+
+    def close(self):
+        """写入最终关键帧 回放结束时用它校验结果 在最后一个事件执行之后调用"""
+        if self.file.closed:
+            return
+        self.keyframe()
+        self.flush()
+        self.file.close()
+
+
+class Replay(object):
+    """录像文件 解析为事件列表与关键帧列表"""
+
+    def __init__(self, data):
+        """
+        :param data: 录像文件内容
+        """
+        if data[:len(MAGIC)] != MAGIC or data[len(MAGIC)] != VERSION:
+            raise ValueError('not a replay file or unsupported version')
+        pos = len(MAGIC) + 1
+        header = []
+        for _ in range(5):
+            n, pos = read_varint(data, pos)
+            header.append(n)
+        self.width, self.height, interval_ms, self.seed, self.keyframe_every = header
+        self.interval = interval_ms / 1000
+        # 按键事件 (毫秒时间戳, 按键)
+        self.events = []
+        self.keyframes = []
+        ts, size = 0, self.width * self.height
+        while pos < len(data):
+            head, pos = read_varint(data, pos)
+            if head & 1 == REC_EVENT:
+                ts += head >> 1
+                self.events.append((ts, chr(data[pos])))
+                pos += 1
+                continue
+            fields = []
+            for _ in range(9):
+                n, pos = read_varint(data, pos)
+                fields.append(n)
+            rows = []
+            for _ in range(self.height):
+                n, pos = read_varint(data, pos)
+                rows.append(n)
+            packed = data[pos:pos + (size + 1) // 2]
+            pos += len(packed)
+            event, kf_ts, count, score, over, t, rot, x, y = fields
+            self.keyframes.append(Keyframe(event, kf_ts, count, score, bool(over),
+                                           (BLOCK_TYPES[t], rot, x, y), rows, _unpack_colors(packed, size)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def new_engine(self):
+        """与录制时种子与地图尺寸相同的新引擎"""
+        return TetrisEngine(self.seed, self.width, self.height)
+
+    @staticmethod
+    def restore(engine, keyframe):
+        """
+        把引擎恢复到关键帧的状态
+        :param engine: 种子与录制时相同的引擎
+        :param keyframe: 关键帧
+        :return: None
+        """
+        engine.board.load(keyframe.rows, keyframe.colors)
+        engine.count, engine.score, engine.game_over = keyframe.count, keyframe.score, keyframe.game_over
+        # 下个方块是第count-1个
+        engine.next_type = piece_type(engine.seed, engine.count - 1)
+        piece = engine.piece
+        piece.type, piece.rot, piece.x, piece.y = keyframe.piece
+
+    def seek(self, engine, pieces):
+        """
+        把引擎推进到第pieces个方块刚出现时 从不晚于它的最近关键帧开始模拟
+        :param engine: 种子与录制时相同的引擎
+        :param pieces: 方块计数 同engine.count
+        :return: 下一个要执行的事件索引
+        """
+        engine.reset(self.seed)
+        base = None
+        for kf in self.keyframes:
+            # 定期关键帧都在其方块刚出现时写入 最终关键帧则不一定
+            if kf.count > pieces or kf.count == pieces and kf is self.keyframes[-1]:
+                break
+            base = kf
+        i = 0
+        if base is not None:
+            self.restore(engine, base)
+            i = base.event
+        while i < len(self.events) and engine.count < pieces and not engine.game_over:
+            engine.step(KEY_ACTIONS.get(self.events[i][1]))
+            i += 1
+        return i
+
+    def simulate(self, engine, start=0):
+        """
+        不渲染 全速执行start之后的全部事件
+        :param engine: 游戏引擎
+        :param start: 起始事件索引
+        :return: 执行的事件数
+        """
+        step = engine.step
+        for _, key in self.events[start:]:
+            step(KEY_ACTIONS.get(key))
+        return len(self.events) - start
+
+    def verify(self, engine):
+        """
+        与最终关键帧比较
+        :return: 布尔型 没有关键帧或状态一致时为True
+        """
+        if not self.keyframes:
+            return True
+        kf, piece = self.keyframes[-1], engine.piece
+        return (kf.count, kf.score, kf.game_over, kf.piece, kf.rows, kf.colors) == \
+            (engine.count, engine.score, engine.game_over, (piece.type, piece.rot, piece.x, piece.y),
+             engine.board.rows, engine.board.colors)
+
+
+def play_realtime(replay, start=0, speed=1.0):
+    """
+    按录制时的节奏回放并渲染到终端 引擎与画面都使用终端版的全局对象
+    :param replay: 录像
+    :param start: 跳转的方块计数
+    :param speed: 回放速度倍数
+    :return: None
+    """
+    from . import tetris as frontend
+
+    if (frontend.ENGINE.width, frontend.ENGINE.height) != (replay.width, replay.height):
+        frontend.configure(replay.width, replay.height)
+    engine = frontend.ENGINE
+    i = replay.seek(engine, start)
+    frontend.follow_view()
+    frontend.tetris_init()
+    frontend.print_map_area(frontend.GAME_AREA_X, frontend.GAME_AREA_Y)
+    frontend.print_preview()
+    frontend.print_piece()
+    frontend.SCREEN.flush()
+    if i < len(replay.events):
+        t0 = time.monotonic() - replay.events[i][0] / 1000 / speed
+    for ts, key in replay.events[i:]:
+        delay = t0 + ts / 1000 / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        frontend.KEY = key
+        over = frontend.game_tick()
+        frontend.SCREEN.flush()
+        if over:
+            break
+    frontend.restore_cursor()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.replay', description='回放录像 默认不渲染全速模拟')
+    parser.add_argument('path', help='录像文件 由tetris.py --record生成')
+    parser.add_argument('-r', '--realtime', action='store_true', help='按录制时的节奏在终端中回放')
+    parser.add_argument('--speed', type=float, default=1.0, help='实时回放的速度倍数')
+    parser.add_argument('--seek', type=int, default=0, metavar='N', help='从第N个方块开始')
+    args = parser.parse_args(argv)
+
+    replay = Replay.load(args.path)
+    if args.realtime:
+        try:
+            play_realtime(replay, args.seek, args.speed)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    engine = replay.new_engine()
+    t = time.perf_counter()
+    i = replay.seek(engine, args.seek)
+    seek_time = time.perf_counter() - t
+    t = time.perf_counter()
+    n = replay.simulate(engine, i)
+    sim_time = time.perf_counter() - t
+    ok = replay.verify(engine)
+    sys.stderr.write('{} events {} keyframes seed {}: seek to piece {} at event {} in {:.2f}ms\n'.format(
+        len(replay.events), len(replay.keyframes), replay.seed, args.seek, i, seek_time * 1000))
+    sys.stderr.write('{} events in {:.3f}s: {:.0f} events/s pieces {} score {} {}\n'.format(
+        n, sim_time, n / sim_time if sim_time else 0.0, engine.count, engine.score,
+        'verified' if ok else 'MISMATCH'))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# encoding:utf-8
+# file: scheduler.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 按键与重力下落调度
+# ##########################
+
+
+import os
+import re
+import select
+import sys
+import termios
+import time
+
+
+# 方向键转义序列的最后一个字节 => 按键 上为旋转 下右左为移动 ESC[x与应用模式的ESCOx都识别
+ARROW_KEYS = {'A': 'w', 'B': 's', 'C': 'd', 'D': 'a'}
+# 一次最多读取的字节数 积压的按键一次读完
+READ_SIZE = 1024
+# 自动重复的按键 左右移动与软降
+REPEAT_KEYS = 'ads'
+# 按住判定 系统开始重复之后 同一按键的重复字符间隔不超过此值 秒 即视为仍然按住
+REPEAT_RELEASE = 0.1
+# 按下之后系统第一次重复之前 视为按住的时间 秒 应不小于系统按键重复的初始延迟 常见为0.25到0.6
+REPEAT_DELAY = 0.6
+# 一次最多补发的自动重复次数 卡顿之后不一下子补发太多
+REPEAT_BURST = 10
+_ESCAPE = re.compile(r'\x1b(?:\[[0-9;?$]*[@-~]|O[@-~])')
+_ESCAPE_PREFIX = re.compile(r'\x1b(?:\[[0-9;?$]*|O)?\Z')
+
+
+def decode_keys(text):
+    """
+    解码一次读到的输入 方向键转为对应的按键 其他转义序列丢弃
+    :param text: 输入文本
+    :return: (按键列表, 末尾不完整的转义序列 留到下次读取时拼接)
+    """
+    keys, i, n = [], 0, len(text)
+    while i < n:
+        j = text.find('\x1b', i)
+        if j < 0:
+            j = n
+        keys.extend(text[i:j])
+        if j == n:
+            break
+        m = _ESCAPE.match(text, j)
+        if m is None:
+            if _ESCAPE_PREFIX.match(text, j):
+                return keys, text[j:]
+            # 单独的ESC
+            i = j + 1
+            continue
+        key = ARROW_KEYS.get(m.group()[-1]) if len(m.group()) == 3 else None
+        if key is not None:
+            keys.append(key)
+        i = m.end()
+    return keys, ''
+
+
+class Scheduler(object):
+    """
+    按键与重力下落调度器 进入时终端设置一次cbreak模式 退出时恢复
+    wait在select中阻塞 直到有按键或到了下一次下落的截止时间 截止时间使用time.monotonic
+    空闲与暂停时进程不会被周期性唤醒
+    有按键时一次读完全部积压的输入 一起交给调用者在同一帧内执行
+    设置das与arr时左右移动与软降自动重复 由本调度器按单调时钟计时 不依赖系统的按键重复速率
+    终端没有松开按键事件 同一按键的系统重复字符持续到来即视为按住 这些字符本身被吸收
+    按下之后delay秒内等待系统的第一次重复 期间视为按住 自动重复照常从das开始 之后超过REPEAT_RELEASE没有重复即为松开
+    因此点按在delay之内也会自动重复 delay应设为略大于系统的按键重复延迟
+    """
+
+    def __init__(self, interval, fd=None, das=None, arr=None, delay=REPEAT_DELAY):
+        """
+        :param interval: 重力下落间隔 秒
+        :param fd: 输入文件描述符 默认为标准输入
+        :param das: 按下到开始自动重复的延迟 秒 None为不自动重复 系统重复的字符照常作为按键
+        :param arr: 自动重复的间隔 秒 大于0
+        :param delay: 系统按键重复的初始延迟 秒 按下之后这么久没有收到重复才视为松开
+        """
+        self.interval = interval
+        self.fd = fd
+        self.das, self.arr, self.delay = das, arr, delay
+        self.deadline = 0.0
+        self._old = None
+        self._pending = ''
+        # 按住的按键 最后一次收到它的时间 下次自动重复的时间 系统是否已开始重复
+        self._held, self._seen, self._repeat, self._repeating = None, 0.0, 0.0, False
+
+    def __enter__(self):
+        if self.fd is None:
+            self.fd = sys.stdin.fileno()
+        self._old = termios.tcgetattr(self.fd)
+        new = termios.tcgetattr(self.fd)
+        # 关闭回显和回车
+        new[3] = new[3] & ~termios.ECHO & ~termios.ICANON
+        new[6][termios.VMIN], new[6][termios.VTIME] = 1, 0
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, new)
+        self.resume()
+        return self
+
+    def __exit__(self, *exc):
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self._old)
+
+    def resume(self):
+        """从现在起重新计算下落截止时间 用于暂停结束后 暂停前按住的按键视为已松开"""
+        self.deadline = time.monotonic() + self.interval
+        self._held = None
+
+    def _read(self, now):
+        """
+        读完已到达的输入 输入已关闭时抛出EOFError
+        :param now: 读取时间
+        :return: 按键列表 可能为空 即都被吸收或转义序列不完整
+        """
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        if not data:
+            raise EOFError('stdin closed')
+        keys, self._pending = decode_keys(self._pending + data.decode('latin-1'))
+        if self.das is None:
+            return keys
+        out = []
+        for key in keys:
+            if key == self._held and not self._released(now):
+                # 系统的按键重复 只说明仍然按住 自动重复由本调度器计时
+                self._seen, self._repeating = now, True
+                continue
+            out.append(key)
+            if key in REPEAT_KEYS:
+                self._held, self._seen, self._repeat, self._repeating = key, now, now + self.das, False
+            else:
+                self._held = None
+        return out
+
+    def _released(self, now):
+        """按住的按键是否已松开 系统开始重复之前等delay 之后等REPEAT_RELEASE"""
+        return now - self._seen > (REPEAT_RELEASE if self._repeating else self.delay)
+
+    def _auto_repeat(self, now):
+        """
+        到时间的自动重复 按住的按键已松开时不重复
+        :param now: 当前时间
+        :return: 按键列表
+        """
+        if self._released(now):
+            self._held = None
+            return []
+        n = int((now - self._repeat) / self.arr) + 1
+        self._repeat += n * self.arr
+        return [self._held] * min(n, REPEAT_BURST)
+
+    def wait(self):
+        """
+        阻塞到有按键或下落时间到
+        :return: 按键列表 按到达顺序 下落时间到时为[None]
+        """
+        while True:
+            now = time.monotonic()
+            timeout = self.deadline - now
+            if timeout <= 0:
+                self.deadline += self.interval
+                # 系统卡顿落后太多时不补发下落 从现在起重新计时
+                if self.deadline <= now:
+                    self.deadline = now + self.interval
+                return [None]
+            if self._held is not None:
+                if self._repeat <= now:
+                    keys = self._auto_repeat(now)
+                    if keys:
+                        return keys
+                    continue
+                timeout = min(timeout, self._repeat - now)
+            if select.select([self.fd], [], [], timeout)[0]:
+                keys = self._read(time.monotonic())
+                if keys:
+                    return keys
+
+    def wait_key(self):
+        """
+        不计下落时间 一直阻塞到有按键 用于暂停 不自动重复
+        :return: 按键列表
+        """
+        while True:
+            select.select([self.fd], [], [])
+            keys = self._read(time.monotonic())
+            if keys:
+                return keys
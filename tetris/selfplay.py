@@ -0,0 +1,192 @@
+# encoding:utf-8
+# file: selfplay.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 多进程批量自对弈 python -m tetris.selfplay
+# ##########################
+
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .ai import Planner
+from .dataset import SHARD_SUFFIX, Exporter
+from .engine import TetrisEngine
+
+
+def game_seed(master, index):
+    """
+    由主种子与对局序号派生出独立的对局种子 同一主种子下任一局都可单独复现
+    :param master: 主种子
+    :param index: 对局序号
+    :return: 64位整数种子
+    """
+    digest = hashlib.blake2b('{}:{}'.format(master, index).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def random_policy(engine, rng):
+    """
+    随机落点策略 随机选旋转状态与列
+    :param engine: 游戏引擎
+    :param rng: 策略自己的随机数生成器
+    :return: (旋转状态, 列索引)
+    """
+    rot = rng.randrange(4)
+    shape = engine.shapes[engine.piece.type][rot]
+    return rot, rng.randrange(engine.width - shape.width + 1)
+
+
+# 地图尺寸 => 落点搜索器 每个工作进程各自创建
+_PLANNERS = {}
+
+
+def ai_policy(engine, rng):
+    """
+    穷举落点搜索策略 同时考虑下个方块 不使用随机数
+    :param engine: 游戏引擎
+    :param rng: 不使用
+    :return: (旋转状态, 列索引) 没有可到达的落点时原地落下 即游戏结束
+    """
+    planner = _PLANNERS.get((engine.width, engine.height))
+    if planner is None:
+        planner = _PLANNERS[engine.width, engine.height] = Planner(engine.width, engine.height)
+    return planner.best(engine) or (engine.piece.rot, engine.piece.x)
+
+
+# 策略名 => 策略函数 策略函数返回当前方块的落点(旋转状态, 列索引)
+POLICIES = {
+    'random': random_policy,
+    'ai': ai_policy,
+}
+
+# 训练数据导出器 每个工作进程一个 写自己的分片 分片以进程号命名
+_EXPORTER = None
+
+
+def _exporter(directory, engine):
+    """本进程的导出器 第一次调用时创建 进程号重复时接着追加"""
+    global _EXPORTER
+    if _EXPORTER is None:
+        path = os.path.join(directory, 'shard-{}{}'.format(os.getpid(), SHARD_SUFFIX))
+        _EXPORTER = Exporter(path, engine.width, engine.height)
+    return _EXPORTER
+
+
+def play_game(index, seed, policy='random', max_pieces=1000, export=None):
+    """
+    完整地玩一局 在工作进程中执行
+    :param index: 对局序号
+    :param seed: 对局种子 方块序列与策略的随机数都由它决定
+    :param policy: 策略名
+    :param max_pieces: 方块数上限
+    :param export: 训练数据分片目录 None为不导出
+    :return: 对局结果字典
+    """
+    engine = TetrisEngine(seed)
+    if export is not None:
+        _exporter(export, engine).attach(engine)
+    # 策略的随机数与方块序列使用不同的流 但同样由对局种子决定
+    rng = random.Random(seed ^ 0x5DEECE66D)
+    choose = POLICIES[policy]
+    pieces = 0
+    t = time.perf_counter()
+    while not engine.game_over and pieces < max_pieces:
+        engine.place(*choose(engine, rng))
+        pieces += 1
+    return {
+        'index': index,
+        'seed': seed,
+        'pieces': pieces,
+        'lines': engine.score,
+        'score': engine.score,
+        'game_over': engine.game_over,
+        'duration': time.perf_counter() - t,
+    }
+
+
+def _play_chunk(jobs, policy, max_pieces, export=None):
+    """工作进程入口 连续玩一组对局 导出时每组结束写完缓冲区 工作进程被杀也只丢当前这组"""
+    results = [play_game(index, seed, policy, max_pieces, export) for index, seed in jobs]
+    if _EXPORTER is not None:
+        _EXPORTER.flush()
+    return results
+
+
+def run(games, master=0, policy='random', max_pieces=1000, workers=None, chunksize=1,
+        first=0, out=sys.stdout, export=None):
+    """
+    把对局分发到进程池 每完成一组就输出其结果 不等全部结束
+    :param games: 对局数
+    :param master: 主种子
+    :param policy: 策略名
+    :param max_pieces: 每局方块数上限
+    :param workers: 进程数 默认为CPU核数
+    :param chunksize: 每个任务包含的对局数
+    :param first: 第一局的序号 配合games=1复现单独一局
+    :param out: 结果输出流 每行一个JSON
+    :param export: 训练数据分片目录 None为不导出 每个工作进程写一个分片
+    :return: 汇总字典
+    """
+    workers = workers or os.cpu_count() or 1
+    if export is not None:
+        os.makedirs(export, exist_ok=True)
+    jobs = [(i, game_seed(master, i)) for i in range(first, first + games)]
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    total = {'games': 0, 'pieces': 0, 'lines': 0, 'cpu_time': 0.0}
+    t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        chunks.reverse()
+        while chunks or pending:
+            # 限制在途任务数 避免一次提交全部任务占用内存
+            while chunks and len(pending) < workers * 2:
+                pending.add(pool.submit(_play_chunk, chunks.pop(), policy, max_pieces, export))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    total['games'] += 1
+                    total['pieces'] += result['pieces']
+                    total['lines'] += result['lines']
+                    total['cpu_time'] += result['duration']
+                    out.write(json.dumps(result) + '\n')
+                out.flush()
+    wall = time.perf_counter() - t
+    total.update({
+        'workers': workers,
+        'wall_time': wall,
+        'games_per_sec': total['games'] / wall if wall else 0.0,
+        'pieces_per_sec': total['pieces'] / wall if wall else 0.0,
+    })
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.selfplay',
+                                     description='多进程批量自对弈 每行输出一局结果')
+    parser.add_argument('-n', '--games', type=int, default=100, help='对局数')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='主种子')
+    parser.add_argument('-p', '--policy', choices=sorted(POLICIES), default='random', help='落点策略')
+    parser.add_argument('-m', '--max-pieces', type=int, default=1000, help='每局方块数上限')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='进程数 默认为CPU核数')
+    parser.add_argument('-c', '--chunksize', type=int, default=1, help='每个任务包含的对局数')
+    parser.add_argument('--first', type=int, default=0, help='第一局的序号 配合-n 1复现单独一局')
+    parser.add_argument('--export', metavar='DIR', help='导出训练数据分片到此目录 用python -m tetris.dataset查看')
+    args = parser.parse_args(argv)
+    total = run(args.games, args.seed, args.policy, args.max_pieces, args.workers,
+                args.chunksize, args.first, export=args.export)
+    sys.stderr.write('{games} games {pieces} pieces in {wall_time:.2f}s with {workers} workers: '
+                     '{games_per_sec:.1f} games/s {pieces_per_sec:.0f} pieces/s\n'.format(**total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+# encoding:utf-8
+# file: server.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 多会话游戏服务器 一个进程托管成千上万局游戏
+# python -m tetris.server serve|bench
+# ##########################
+
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import time
+
+from .engine import KEY_ACTIONS, TetrisEngine
+from .memory import rss_bytes
+from .render import SGR_RESET, goto_seq
+from .shapes import BLOCK_DICT, BLOCK_TYPES
+
+
+# 调色板 与终端版相同 索引0为背景色 最后一个为落点预览
+PALETTE = [('\033[40;30m', '  ')] + [(BLOCK_DICT[t][-1][-1], '  ') for t in BLOCK_TYPES] + [('\033[40;37m', '[]')]
+GHOST = len(PALETTE) - 1
+# 前台缓冲区中表示终端上内容未知的颜色 下一帧一定重绘
+UNKNOWN = 0xff
+# 一行输入的最大长度 超过则断开
+MAX_LINE = 256
+HELP = ('tetris server: "new [SEED]" starts a game, then send lines of keys '
+        '(a/d left/right, s down, w rotate, x drop), "stats" for server stats, "quit" to leave\r\n')
+
+
+class TimerWheel(object):
+    """
+    时间轮 slots个槽 每槽resolution秒 到期时间按槽取整
+    加入 删除与推进一个槽都与会话总数无关 推进时只处理到期的那一槽
+    """
+
+    __slots__ = ('slots', 'resolution', 'cursor')
+
+    def __init__(self, slots=256, resolution=0.01):
+        """
+        :param slots: 槽数 最长延时为slots * resolution
+        :param resolution: 每槽时长 秒
+        """
+        self.slots = [set() for _ in range(slots)]
+        self.resolution = resolution
+        self.cursor = 0
+
+    def add(self, item, delay):
+        """
+        :param item: 到期时返回的对象
+        :param delay: 延时 秒 至少一个槽
+        :return: 槽索引 用于discard
+        """
+        n = max(1, int(round(delay / self.resolution)))
+        if n >= len(self.slots):
+            raise ValueError('delay {}s exceeds the wheel span'.format(delay))
+        slot = (self.cursor + n) % len(self.slots)
+        self.slots[slot].add(item)
+        return slot
+
+    def discard(self, item, slot):
+        """取消一个定时"""
+        self.slots[slot].discard(item)
+
+    def advance(self):
+        """
+        推进一个槽
+        :return: 到期的对象集合
+        """
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        if due:
+            self.slots[self.cursor] = set()
+        return due
+
+
+class Session(asyncio.Protocol):
+    """
+    一个客户端连接即一个会话 空闲时只有连接本身 开局后才创建引擎与前台缓冲区
+    前台缓冲区每点一字节 记录终端上已显示的颜色 每次只比较当前方块 落点预览与消行移动过的行
+    """
+
+    __slots__ = ('server', 'transport', 'engine', 'front', 'overlay', 'info', 'buf', 'slot', 'paused')
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.engine, self.front, self.overlay, self.info = None, None, (), None
+        self.buf = b''
+        self.slot, self.paused = None, False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+        transport.write(HELP.encode())
+
+    def connection_lost(self, exc):
+        self.server.sessions.discard(self)
+        self._stop()
+
+    def pause_writing(self):
+        # 客户端跟不上 之后的帧不写 恢复时整屏重绘
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self.engine is not None:
+            self.front[:] = bytes([UNKNOWN]) * len(self.front)
+            self.info = None
+            self.render(range(self.engine.height))
+
+    def data_received(self, data):
+        buf = self.buf + data
+        *lines, self.buf = buf.split(b'\n')
+        if len(self.buf) > MAX_LINE:
+            self.transport.close()
+            return
+        for line in lines:
+            self.command(line.strip().decode('latin-1'))
+
+    def command(self, line):
+        """
+        执行一行命令 不是命令的行当作按键序列
+        :param line: 去掉换行的一行
+        :return: None
+        """
+        word, _, arg = line.partition(' ')
+        if word == 'new':
+            self.start(int(arg) if arg.isdigit() else None)
+        elif word == 'quit':
+            self.transport.close()
+        elif word == 'stats':
+            where = goto_seq(1, self.engine.height + 3) if self.engine is not None else ''
+            self.transport.write((where + self.server.format_report(False) + '\033[K\r\n').encode())
+        elif self.engine is not None and not self.engine.game_over:
+            self.advance(KEY_ACTIONS.get(key) for key in line)
+
+    def start(self, seed=None):
+        """开一局 清屏并画边框 然后整屏输出"""
+        if self.engine is None:
+            self.engine = TetrisEngine(seed)
+        else:
+            self.engine.reset(seed)
+        e = self.engine
+        self.front = bytearray([UNKNOWN]) * (e.width * e.height)
+        self.overlay, self.info = (), None
+        out = ['\033[2J', SGR_RESET]
+        for y in range(1, e.height + 1):
+            out.append(goto_seq(1, y) + '##' + goto_seq(e.width + 2, y) + '##')
+        out.append(goto_seq(1, e.height + 1) + '##' * (e.width + 2))
+        self.write(''.join(out))
+        self.render(range(e.height))
+        self.server.schedule(self)
+
+    def _stop(self):
+        """取消重力定时"""
+        if self.slot is not None:
+            self.server.wheel.discard(self, self.slot)
+            self.slot = None
+
+    def gravity(self):
+        """时间轮到期 下落一格 游戏结束前重新定时"""
+        self.slot = None
+        self.advance(('to_d',))
+        if not self.engine.game_over:
+            self.server.schedule(self)
+
+    def advance(self, actions):
+        """
+        依次执行动作 然后输出一帧
+        :param actions: 动作序列 None为不动
+        :return: None
+        """
+        e = self.engine
+        lo = hi = None
+        for action in actions:
+            if e.game_over:
+                break
+            count, top = e.count, min(e.board.top, e.piece.y)
+            # 只有下落与直接落下会固定方块 固定的位置就是落点预览的位置
+            land = e.piece.y + e.drop_distance() if action in ('to_d', 'to_b') else None
+            h = e.shape.height
+            lines = e.step(action)[2]
+            self.server.ticks += 1
+            if e.count != count or e.game_over:
+                # 一次输出多个方块固定时 之前的方块没有画过 固定的行都要比较
+                # 消行时原先最高小方块到最低消除行之间的行都移动了
+                start, end = top if lines else land, land + h - 1
+                lo = start if lo is None else min(lo, start)
+                hi = end if hi is None else max(hi, end)
+        self.render(range(lo, hi + 1) if lo is not None else ())
+        if e.game_over:
+            self._stop()
+
+    def render(self, rows):
+        """
+        差分输出一帧 只比较上一帧与本帧的当前方块与落点预览所在的点 以及rows中的行
+        :param rows: 要整行比较的行索引
+        :return: None
+        """
+        e, front = self.engine, self.front
+        w, colors = e.width, e.board.colors
+        dirty = set(self.overlay)
+        for y in rows:
+            dirty.update(range(y * w, y * w + w))
+        overlay = {}
+        if not e.game_over:
+            piece, shape = e.piece, e.shape
+            ghost_y = piece.y + e.drop_distance()
+            for dx, dy in shape.cells:
+                overlay[(ghost_y + dy) * w + piece.x + dx] = GHOST
+            for dx, dy in shape.cells:
+                overlay[(piece.y + dy) * w + piece.x + dx] = shape.color
+        dirty.update(overlay)
+        self.overlay = tuple(overlay)
+        out, cur, last = [], None, -2
+        for i in sorted(dirty):
+            c = overlay.get(i, colors[i])
+            if front[i] == c:
+                continue
+            front[i] = c
+            # 同一行紧挨着上一个输出的点时不需要定位
+            if i != last + 1 or i % w == 0:
+                out.append(goto_seq(i % w + 2, i // w + 1))
+            sgr, text = PALETTE[c]
+            if sgr != cur:
+                out.append(sgr)
+                cur = sgr
+            out.append(text)
+            last = i
+        info = (e.count, e.score, e.next_type, e.game_over)
+        if info != self.info:
+            self.info = info
+            out.append('{}{}score {} pieces {} next {}{}\033[K'.format(
+                goto_seq(1, e.height + 2), SGR_RESET, e.score, e.count, e.next_type,
+                '  GAME OVER, "new" to play again' if e.game_over else ''))
+        if out:
+            out.append(SGR_RESET)
+            self.write(''.join(out))
+
+    def write(self, text):
+        """写给客户端 客户端跟不上时丢弃 恢复后整屏重绘"""
+        if not self.paused and not self.transport.is_closing():
+            self.transport.write(text.encode('utf-8'))
+
+
+class GameServer(object):
+    """
+    多会话服务器 全部会话在一个事件循环中 重力下落由一个时间轮驱动
+    事件循环每resolution秒唤醒一次 只处理到期的槽 与会话总数无关
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, interval=0.2, resolution=0.01, path=None):
+        """
+        :param host: 监听地址 默认只监听本机
+        :param port: 监听端口 0为自动分配
+        :param interval: 重力下落间隔 秒
+        :param resolution: 时间轮每槽时长 秒
+        :param path: 给出时监听此Unix域套接字 不监听TCP端口
+        """
+        self.host, self.port, self.path = host, port, path
+        self.interval = interval
+        self.wheel = TimerWheel(max(2, int(interval / resolution) * 2), resolution)
+        self.sessions = set()
+        # 引擎推进的总步数 用于统计每秒步数
+        self.ticks = 0
+        self.loop, self.server = None, None
+        self._t0, self._turns = 0.0, 0
+        self._last_report = (time.monotonic(), 0)
+
+    async def start(self):
+        """开始监听并启动时间轮 在事件循环中调用"""
+        self.loop = loop = asyncio.get_running_loop()
+        if self.path is not None:
+            self.server = await loop.create_unix_server(lambda: Session(self), self.path, backlog=4096)
+        else:
+            self.server = await loop.create_server(lambda: Session(self), self.host, self.port, backlog=4096)
+            self.port = self.server.sockets[0].getsockname()[1]
+        self._t0, self._turns = loop.time(), 0
+        loop.call_at(self._t0 + self.wheel.resolution, self._turn)
+        return self
+
+    def close(self):
+        """停止监听 断开全部会话"""
+        self.server.close()
+        for session in list(self.sessions):
+            session.transport.abort()
+
+    def schedule(self, session):
+        """会话的下一次重力下落"""
+        session._stop()
+        session.slot = self.wheel.add(session, self.interval)
+
+    def _turn(self):
+        """按时间推进时间轮 事件循环卡顿时补齐落下的槽"""
+        res = self.wheel.resolution
+        due = int((self.loop.time() - self._t0) / res)
+        while self._turns < due:
+            self._turns += 1
+            for session in self.wheel.advance():
+                session.gravity()
+        self.loop.call_at(self._t0 + (self._turns + 1) * res, self._turn)
+
+    def report(self, mark=True):
+        """
+        :param mark: 是否从此刻开始下一个每秒步数的统计区间
+        :return: 统计字典 会话数 对局中的会话数 上次统计以来每秒步数 常驻内存
+        """
+        now = time.monotonic()
+        t, ticks = self._last_report
+        if mark:
+            self._last_report = (now, self.ticks)
+        return {
+            'sessions': len(self.sessions),
+            'playing': sum(1 for s in self.sessions if s.slot is not None),
+            'ticks_per_sec': (self.ticks - ticks) / (now - t) if now > t else 0.0,
+            'rss': rss_bytes(),
+        }
+
+    def format_report(self, mark=True):
+        """统计的一行文字 参数同report"""
+        r = self.report(mark)
+        return 'sessions {} playing {} ticks/s {:.0f} rss {:.1f}MB'.format(
+            r['sessions'], r['playing'], r['ticks_per_sec'], r['rss'] / 2 ** 20)
+
+
+async def _serve(args):
+    server = await GameServer(args.host, args.port, args.interval, path=args.unix).start()
+    sys.stderr.write('serving on {}\n'.format(args.unix or '{}:{}'.format(args.host, server.port)))
+    try:
+        while True:
+            await asyncio.sleep(args.report)
+            sys.stderr.write(server.format_report() + '\n')
+    finally:
+        server.close()
+
+
+def _clients(host, port, n, playing, seconds, keys_per_sec, result):
+    """压力测试的客户端进程 打开n个连接 其中playing个开局并随机按键 其余空闲"""
+    async def one(i, ready, go):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            ready.append(False)
+            return 0
+        ready.append(True)
+        await go.wait()
+        received = 0
+        end = time.monotonic() + seconds
+        rng = random.Random(i)
+        if i < playing:
+            writer.write(b'new %d\n' % i)
+        next_key = time.monotonic()
+        while time.monotonic() < end:
+            if i < playing and time.monotonic() >= next_key:
+                writer.write(rng.choice((b'a\n', b'd\n', b'w\n', b's\n', b'x\n', b'new\n')))
+                next_key += rng.expovariate(keys_per_sec)
+            try:
+                data = await asyncio.wait_for(reader.read(65536), 0.2)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                break
+            received += len(data)
+        writer.close()
+        return received
+
+    async def run():
+        ready, go = [], asyncio.Event()
+        tasks = [asyncio.ensure_future(one(i, ready, go)) for i in range(n)]
+        while len(ready) < n:
+            await asyncio.sleep(0.05)
+        result.put(sum(ready))
+        await asyncio.sleep(1.0)
+        go.set()
+        return sum(await asyncio.gather(*tasks))
+
+    result.put(asyncio.run(run()))
+
+
+def bench(n=10000, playing=100, seconds=5.0, keys_per_sec=5.0, interval=0.2):
+    """
+    压力测试 另一个进程打开n个连接 其中playing个对局 统计每会话内存与每秒步数
+    :param n: 连接数
+    :param playing: 对局的连接数
+    :param seconds: 对局时长 秒
+    :param keys_per_sec: 每个对局每秒按键数
+    :param interval: 重力下落间隔 秒
+    :return: 结果字典
+    """
+    async def run():
+        server = await GameServer(interval=interval).start()
+        result = multiprocessing.Queue()
+        base = rss_bytes()
+        proc = multiprocessing.Process(target=_clients, args=(
+            '127.0.0.1', server.port, n, playing, seconds, keys_per_sec, result))
+        proc.start()
+        loop = asyncio.get_running_loop()
+        connected = await loop.run_in_executor(None, result.get)
+        while len(server.sessions) < connected:
+            await asyncio.sleep(0.05)
+        idle_rss = rss_bytes()
+        server.report()
+        await asyncio.sleep(1.0 + seconds)
+        r = server.report()
+        received = await loop.run_in_executor(None, result.get)
+        proc.join()
+        server.close()
+        r.update({
+            'connected': connected,
+            'idle_bytes_per_session': (idle_rss - base) / connected if connected else 0.0,
+            'playing_bytes_per_session': (r['rss'] - idle_rss) / playing if playing else 0.0,
+            'received': received,
+        })
+        return r
+
+    return asyncio.run(run())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.server', description='多会话游戏服务器 每个连接一局')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_serve = sub.add_parser('serve', help='启动服务器 用nc HOST PORT连接 按行发送命令与按键')
+    p_serve.add_argument('--host', default='127.0.0.1', help='监听地址')
+    p_serve.add_argument('-p', '--port', type=int, default=7000, help='监听端口')
+    p_serve.add_argument('--unix', metavar='PATH', help='改为监听Unix域套接字')
+    p_serve.add_argument('--interval', type=float, default=0.2, help='重力下落间隔 秒')
+    p_serve.add_argument('--report', type=float, default=5.0, help='统计输出间隔 秒')
+    p_bench = sub.add_parser('bench', help='本机压力测试')
+    p_bench.add_argument('-n', '--sessions', type=int, default=10000, help='连接数')
+    p_bench.add_argument('--playing', type=int, default=100, help='其中对局的连接数')
+    p_bench.add_argument('-t', '--seconds', type=float, default=5.0, help='对局时长 秒')
+    p_bench.add_argument('--keys', type=float, default=5.0, help='每个对局每秒按键数')
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    r = bench(args.sessions, args.playing, args.seconds, args.keys)
+    sys.stderr.write('{connected}/{requested} sessions, {playing} playing: {ticks_per_sec:.0f} ticks/s, '
+                     'rss {rss_mb:.1f}MB, {idle_bytes_per_session:.0f} B/idle session, '
+                     '{playing_bytes_per_session:.0f} B/playing session, {received} bytes streamed\n'.format(
+                         requested=args.sessions, rss_mb=r['rss'] / 2 ** 20, **r))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# encoding:utf-8
+# file: shapes.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 7种基本方块 预编译的旋转与形状表
+# ##########################
+
+
+from collections import namedtuple
+from functools import lru_cache
+
+
+# 7种方块类型 顺序即调色板索引顺序 索引0留给背景色
+BLOCK_TYPES = 'IJLOSTZ'
+
+# 7方块初始状态位图 2,2位置为方块实际长与高 3,3位置为此方块颜色
+BLOCK_DICT = {
+    # 天蓝色
+    'I': [[1, 1, 1, 1],
+          [0, 0, 0, 0],
+          [0, 0, [4, 1], 0],
+          [0, 0, 0, '\033[46;36m']],
+    # 蓝色
+    'J': [[1, 0, 0, 0],
+          [1, 1, 1, 0],
+          # [3,2]表示此方块长3高2 索引正好相反 x=2为两行y=3为三列
+          # 3,2为游戏区域的坐标表示法的长与度 2,3为对应的二维列表索引表示法
+          [0, 0, [3, 2], 0],
+          [0, 0, 0, '\033[44;34m']],
+    # 白色
+    'L': [[0, 0, 1, 0],
+          [1, 1, 1, 0],
+          [0, 0, [3, 2], 0],
+          [0, 0, 0, '\033[47;37m']],
+    # 黄色
+    'O': [[1, 1, 0, 0],
+          [1, 1, 0, 0],
+          [0, 0, [2, 2], 0],
+          [0, 0, 0, '\033[43;33m']],
+    # 绿色
+    'S': [[0, 1, 1, 0],
+          [1, 1, 0, 0],
+          [0, 0, [3, 2], 0],
+          [0, 0, 0, '\033[42;32m']],
+    # 紫色
+    'T': [[0, 1, 0, 0],
+          [1, 1, 1, 0],
+          [0, 0, [3, 2], 0],
+          [0, 0, 0, '\033[45;35m']],
+    # 红色
+    'Z': [[1, 1, 0, 0],
+          [0, 1, 1, 0],
+          [0, 0, [3, 2], 0],
+          [0, 0, 0, '\033[41;31m']]
+}
+
+# 形状表项 cells为小方块相对左上角的偏移(dx, dy) width与height为方块长与高
+# color为调色板索引 masks[x]为方块左上角在第x列时每行的地图掩码
+# bottom为每列最低的小方块(dx, dy) 用于按列高度求下落距离
+Shape = namedtuple('Shape', ['cells', 'width', 'height', 'color', 'masks', 'bottom'])
+
+
+def _rotate_cells(cells, width):
+    """
+    逆时针旋转90度 旋转后左上角不变 长与高互换
+    原位图第r行第c列 对应旋转后位图第width-1-c行第r列
+    :param cells: 小方块偏移
+    :param width: 旋转前方块长
+    :return: 旋转后的小方块偏移 按行排序
+    """
+    return tuple(sorted(((dy, width - 1 - dx) for dx, dy in cells), key=lambda c: (c[1], c[0])))
+
+
+@lru_cache(maxsize=None)
+def compile_shapes(board_width):
+    """
+    编译7种方块的4个旋转状态 同一地图宽度只编译一次
+    :param board_width: 地图长 决定掩码的列偏移范围
+    :return: 字典 方块类型 => 4个旋转状态的Shape元组
+    """
+    table = {}
+    for color, b_type in enumerate(BLOCK_TYPES, 1):
+        b_bitmap = BLOCK_DICT[b_type]
+        w, h = b_bitmap[2][2]
+        cells = tuple((dx, dy) for dy in range(h) for dx in range(w) if b_bitmap[dy][dx] == 1)
+        rotations = []
+        for _ in range(4):
+            rows = tuple(sum(1 << dx for dx, dy in cells if dy == r) for r in range(h))
+            masks = tuple(tuple(m << x for m in rows) for x in range(board_width - w + 1))
+            bottom = tuple((dx, max(dy for _dx, dy in cells if _dx == dx)) for dx in range(w))
+            rotations.append(Shape(cells, w, h, color, masks, bottom))
+            cells, w, h = _rotate_cells(cells, w), h, w
+        table[b_type] = tuple(rotations)
+    return table
+
+
+class Piece(object):
+    """
+    活动方块 只记录类型 旋转状态与左上角的地图索引 形状从预编译表中查找
+    """
+
+    __slots__ = ('type', 'rot', 'x', 'y')
+
+    def __init__(self, b_type='_', rot=0, x=0, y=0):
+        self.type, self.rot, self.x, self.y = b_type, rot, x, y
+
+    def reset(self, b_type, x, y):
+        """
+        复用同一对象生成新方块
+        :param b_type: 方块类型
+        :param x: 左上角列索引
+        :param y: 左上角行索引
+        :return: None
+        """
+        self.type, self.rot, self.x, self.y = b_type, 0, x, y
+
+    def __repr__(self):
+        return 'Piece({!r}, {}, {}, {})'.format(self.type, self.rot, self.x, self.y)
@@ -0,0 +1,225 @@
+# encoding:utf-8
+# file: soak.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 长时间稳定性测试 定期采样内存 分配 GC与tick耗时 判断是否有上升趋势
+# python tetris/tetris.py --soak PIECES
+# ##########################
+
+
+import gc
+import json
+import time
+import tracemalloc
+
+from .memory import rss_bytes
+from .stats import Histogram, format_ns
+
+
+# 开头这么多比例的采样点用于预热 缓存与各种池子填满之前的增长不算趋势
+WARMUP = 0.2
+# 判断趋势至少需要的采样点数 预热之后
+MIN_SAMPLES = 6
+# 内存增长的绝对容差 字节 小于此值的增长当作噪声
+MEM_SLACK = 1 << 20
+
+
+def _median(values):
+    """中位数"""
+    values = sorted(values)
+    n = len(values)
+    return (values[n // 2] + values[(n - 1) // 2]) / 2
+
+
+def _slope(xs, ys):
+    """最小二乘斜率 每单位x的y增量"""
+    n = len(xs)
+    mx, my = sum(xs) / n, sum(ys) / n
+    var = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var if var else 0.0
+
+
+def _where(stat):
+    """tracemalloc统计项的分配位置 文件名:行号"""
+    frame = stat.traceback[0]
+    return '{}:{}'.format(frame.filename, frame.lineno)
+
+
+class SoakMonitor(object):
+    """
+    稳定性测试采样器 每个tick记录一次耗时 每every个方块采样一次
+    采样内容 常驻内存 tracemalloc跟踪到的分配总量与峰值 GC各代计数与回收次数 存活的GC对象数
+    本段tick耗时的均值与分位数 以及与第一次采样相比增长最多的分配位置
+    结束时比较预热之后前三分之一与后三分之一采样的中位数 内存或tick耗时超出容差即判定为上升趋势
+    """
+
+    def __init__(self, every=10000, frames=1, top=5, mem_tolerance=0.05, tick_tolerance=0.25):
+        """
+        :param every: 采样间隔 方块数
+        :param frames: tracemalloc每次分配保存的调用栈深度 越深越慢
+        :param top: 每次采样记录增长最多的分配位置数
+        :param mem_tolerance: 内存允许增长的比例 另有MEM_SLACK的绝对容差
+        :param tick_tolerance: tick平均耗时允许增长的比例
+        """
+        self.every, self.frames, self.top = every, frames, top
+        self.mem_tolerance, self.tick_tolerance = mem_tolerance, tick_tolerance
+        self.samples = []
+        self.ticks, self.next = 0, every
+        self.window = Histogram()
+        self._base = None
+        self._start = None
+
+    def start(self):
+        """开始跟踪分配 之后的分配才被统计"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._start = time.perf_counter()
+        return self
+
+    def stop(self):
+        """停止跟踪分配 释放跟踪数据"""
+        self._base = None
+        tracemalloc.stop()
+
+    def tick(self, ns):
+        """
+        记录一个tick的耗时
+        :param ns: 纳秒数
+        :return: None
+        """
+        self.window.add(ns)
+        self.ticks += 1
+
+    def due(self, pieces):
+        """已生成pieces个方块时是否该采样"""
+        return pieces >= self.next
+
+    def _snapshot(self):
+        """分配快照 去掉tracemalloc自身的分配"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def sample(self, pieces):
+        """
+        采样一次 本段tick耗时从零重新统计
+        :param pieces: 已生成的方块数
+        :return: 采样字典
+        """
+        traced, peak = tracemalloc.get_traced_memory()
+        snap = self._snapshot()
+        if self._base is None:
+            self._base, growth = snap, []
+        else:
+            growth = [{'where': _where(s), 'size_diff': s.size_diff, 'count_diff': s.count_diff}
+                      for s in snap.compare_to(self._base, 'lineno')[:self.top] if s.size_diff > 0]
+        window = self.window
+        s = {
+            'pieces': pieces,
+            'ticks': self.ticks,
+            'elapsed_s': time.perf_counter() - self._start,
+            'rss_bytes': rss_bytes(),
+            'traced_bytes': traced,
+            'traced_peak_bytes': peak,
+            'gc_counts': list(gc.get_count()),
+            'gc_collections': [g['collections'] for g in gc.get_stats()],
+            'gc_objects': len(gc.get_objects()),
+            'tick': {k: v for k, v in window.to_dict().items() if k != 'buckets'},
+            'top_growth': growth,
+        }
+        self.samples.append(s)
+        self.window = Histogram()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        while self.next <= pieces:
+            self.next += self.every
+        return s
+
+    def _series(self):
+        """预热之后的采样点 不足MIN_SAMPLES个时为空"""
+        samples = [s for s in self.samples if s['tick']['count']]
+        samples = samples[int(len(samples) * WARMUP):]
+        return samples if len(samples) >= MIN_SAMPLES else []
+
+    def trends(self):
+        """
+        各指标的趋势
+        :return: {指标: {'first': 前三分之一中位数, 'last': 后三分之一中位数, 'per_million': 每百万方块的增量}}
+        """
+        samples = self._series()
+        if not samples:
+            return {}
+        third = len(samples) // 3
+        xs = [s['pieces'] for s in samples]
+        metrics = {
+            'rss_bytes': [s['rss_bytes'] for s in samples],
+            'traced_bytes': [s['traced_bytes'] for s in samples],
+            'gc_objects': [s['gc_objects'] for s in samples],
+            'tick_mean_ns': [s['tick']['mean_ns'] for s in samples],
+        }
+        return {name: {
+            'first': _median(ys[:third]),
+            'last': _median(ys[-third:]),
+            'per_million': _slope(xs, ys) * 10 ** 6,
+        } for name, ys in metrics.items()}
+
+    def check(self):
+        """
+        判断内存与tick耗时是否有上升趋势
+        :return: 失败原因列表 空列表为通过
+        """
+        trends = self.trends()
+        if not trends:
+            return ['too few samples to judge a trend: {} after warmup, need {}; lower --soak-every'.format(
+                len(self.samples) - int(len(self.samples) * WARMUP), MIN_SAMPLES)]
+        failures = []
+        for name in ('rss_bytes', 'traced_bytes'):
+            t = trends[name]
+            limit = t['first'] * (1 + self.mem_tolerance) + MEM_SLACK
+            if t['last'] > limit:
+                failures.append('{} grew from {:,.0f} to {:,.0f} ({:+,.0f} per million pieces)'.format(
+                    name, t['first'], t['last'], t['per_million']))
+        t = trends['tick_mean_ns']
+        if t['last'] > t['first'] * (1 + self.tick_tolerance):
+            failures.append('mean tick time grew from {} to {} ({:+.0f}%)'.format(
+                format_ns(int(t['first'])), format_ns(int(t['last'])), (t['last'] / t['first'] - 1) * 100))
+        return failures
+
+    def to_dict(self):
+        """全部采样与判定结果 转为可JSON序列化的字典"""
+        return {
+            'every': self.every,
+            'tolerance': {'memory': self.mem_tolerance, 'memory_slack_bytes': MEM_SLACK,
+                          'tick': self.tick_tolerance},
+            'trends': self.trends(),
+            'failures': self.check(),
+            'samples': self.samples,
+        }
+
+    def dump(self, path):
+        """
+        写入JSON文件
+        :param path: 文件路径
+        :return: None
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def format_sample(s):
+    """
+    一次采样的单行摘要
+    :param s: SoakMonitor.sample的返回值
+    :return: 字符串
+    """
+    tick = s['tick']
+    return '{:>10,} pieces {:8.0f}s  rss {:6.1f}MB  traced {:6.1f}MB  objects {:>9,}  gc {}  tick {} p99 {}'.format(
+        s['pieces'], s['elapsed_s'], s['rss_bytes'] / 2 ** 20, s['traced_bytes'] / 2 ** 20, s['gc_objects'],
+        '/'.join(str(n) for n in s['gc_collections']),
+        format_ns(int(tick['mean_ns'])), format_ns(tick['p99_ns']))
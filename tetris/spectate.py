@@ -0,0 +1,454 @@
+# encoding:utf-8
+# file: spectate.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 观战广播 每帧只编码一次 同一份字节发给全部观众
+# python -m tetris.spectate watch|bench
+# ##########################
+
+
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+
+from .engine import TetrisEngine
+from .replay import read_varint, write_varint
+from .shapes import BLOCK_TYPES
+
+
+# 消息类型 关键帧为完整地图 差分帧只有变化的点
+MSG_KEYFRAME, MSG_DELTA = ord('K'), ord('D')
+
+
+def frame_colors(engine):
+    """
+    地图颜色平面叠加当前方块 即观众看到的画面
+    :param engine: 游戏引擎
+    :return: bytearray 索引为 y * width + x
+    """
+    colors = bytearray(engine.board.colors)
+    if not engine.game_over:
+        piece, shape, w = engine.piece, engine.shape, engine.width
+        for dx, dy in shape.cells:
+            colors[(piece.y + dy) * w + piece.x + dx] = shape.color
+    return colors
+
+
+def _encode_info(buf, seq, info):
+    count, score, next_type, key = info
+    write_varint(buf, seq)
+    write_varint(buf, count)
+    write_varint(buf, score)
+    buf.append(BLOCK_TYPES.index(next_type) if next_type in BLOCK_TYPES else 0xff)
+    buf.append(ord(key) & 0xff)
+
+
+def _frame(payload):
+    """消息前加varint长度"""
+    buf = bytearray()
+    write_varint(buf, len(payload))
+    return bytes(buf + payload)
+
+
+def encode_keyframe(seq, width, height, colors, info):
+    """
+    关键帧 类型 序号 计分信息 地图长高 全部颜色
+    :return: 带长度前缀的消息
+    """
+    buf = bytearray([MSG_KEYFRAME])
+    _encode_info(buf, seq, info)
+    write_varint(buf, width)
+    write_varint(buf, height)
+    buf += colors
+    return _frame(buf)
+
+
+def encode_delta(seq, last, colors, width, info):
+    """
+    差分帧 类型 序号 计分信息 变化点数 每个点的(索引, 颜色)
+    整行相同时跳过 只逐点比较有变化的行
+    :return: 带长度前缀的消息
+    """
+    buf = bytearray([MSG_DELTA])
+    _encode_info(buf, seq, info)
+    changed = bytearray()
+    n = 0
+    for base in range(0, len(colors), width):
+        end = base + width
+        if colors[base:end] == last[base:end]:
+            continue
+        for i in range(base, end):
+            if colors[i] != last[i]:
+                write_varint(changed, i)
+                changed.append(colors[i])
+                n += 1
+    write_varint(buf, n)
+    return _frame(buf + changed)
+
+
+def decode(payload):
+    """
+    解析一条消息
+    :param payload: 去掉长度前缀的消息
+    :return: (类型, 序号, (方块数, 得分, 下个方块, 按键), 数据)
+             关键帧的数据为(长, 高, 颜色) 差分帧的数据为[(索引, 颜色)]
+    """
+    kind = payload[0]
+    seq, pos = read_varint(payload, 1)
+    count, pos = read_varint(payload, pos)
+    score, pos = read_varint(payload, pos)
+    t, key = payload[pos], chr(payload[pos + 1])
+    info = (count, score, BLOCK_TYPES[t] if t < len(BLOCK_TYPES) else '_', key)
+    pos += 2
+    if kind == MSG_KEYFRAME:
+        width, pos = read_varint(payload, pos)
+        height, pos = read_varint(payload, pos)
+        return kind, seq, info, (width, height, bytes(payload[pos:pos + width * height]))
+    n, pos = read_varint(payload, pos)
+    cells = []
+    for _ in range(n):
+        i, pos = read_varint(payload, pos)
+        cells.append((i, payload[pos]))
+        pos += 1
+    return kind, seq, info, cells
+
+
+class _Spectator(asyncio.Protocol):
+    """
+    一个观众连接 数据直接写入传输层 传输层缓冲区超过高水位时暂停 期间的帧放入有界队列
+    队列满时清空并改为放入最新关键帧 已经合并过又再次溢出的观众被断开
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.paused = False
+        self.queue = deque()
+        self.coalesced = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.server.buffer_size)
+        keyframe = self.server.current_keyframe()
+        if keyframe is not None:
+            transport.write(keyframe)
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        queue, transport = self.queue, self.transport
+        while queue and not self.paused:
+            transport.write(queue.popleft())
+        if not queue:
+            self.coalesced = False
+
+    def send(self, data):
+        """
+        发送一帧 不阻塞
+        :return: 'sent' 'coalesced' 或 'dropped'
+        """
+        if self.transport.is_closing():
+            return 'sent'
+        if not self.paused:
+            self.transport.write(data)
+            return 'sent'
+        if len(self.queue) < self.server.queue_size:
+            self.queue.append(data)
+            return 'sent'
+        if self.coalesced:
+            self.transport.abort()
+            return 'dropped'
+        # 跟不上的观众 丢掉积压的帧 从最新关键帧重新开始
+        self.queue.clear()
+        self.queue.append(self.server.current_keyframe())
+        self.coalesced = True
+        return 'coalesced'
+
+
+class Broadcaster(object):
+    """
+    观战服务器 asyncio事件循环在后台线程中运行 游戏主循环只调用publish
+    publish在游戏线程中计算差分并编码一次 然后把同一份字节交给事件循环 不等待任何观众
+    事件循环把这份字节依次写给每个观众 观众跟不上时见_Spectator
+    """
+
+    def __init__(self, port=0, host='', queue_size=64, buffer_size=1 << 16):
+        """
+        :param port: 监听端口 0为自动分配
+        :param host: 监听地址 默认为全部地址
+        :param queue_size: 传输层暂停时每个观众最多缓存的帧数
+        :param buffer_size: 每个观众传输层缓冲区的高水位 字节
+        """
+        self.host, self.port = host, port
+        self.queue_size, self.buffer_size = queue_size, buffer_size
+        self.clients = set()
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        # 游戏线程中的上一帧
+        self._seq, self._last = 0, None
+        # 事件循环线程中的最新状态与其关键帧缓存
+        self._state, self._keyframe = None, None
+        # 统计 帧数 编码字节数 编码耗时 合并为关键帧次数 断开的观众数
+        self.frames, self.encoded_bytes, self.encode_time = 0, 0, 0.0
+        self.coalesced, self.dropped = 0, 0
+
+    def start(self):
+        """启动后台线程 返回时已开始监听 self.port为实际端口"""
+        self._thread = threading.Thread(target=self._run, name='spectate', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        self.loop = loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(
+            loop.create_server(lambda: _Spectator(self), self.host, self.port, backlog=4096))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        loop.run_forever()
+        server.close()
+        for client in list(self.clients):
+            client.transport.abort()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+    def stop(self):
+        """停止事件循环 断开全部观众"""
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+
+    def publish(self, engine, key='_'):
+        """
+        发布一帧 在游戏线程中调用 只做差分与编码 不阻塞
+        :param engine: 游戏引擎
+        :param key: 本帧按键
+        :return: 本帧消息字节数
+        """
+        t = time.perf_counter()
+        colors = bytes(frame_colors(engine))
+        info = (engine.count, engine.score, engine.next_type, key)
+        self._seq += 1
+        if self._last is None or len(self._last) != len(colors):
+            data = encode_keyframe(self._seq, engine.width, engine.height, colors, info)
+        else:
+            data = encode_delta(self._seq, self._last, colors, engine.width, info)
+        self._last = colors
+        self.frames += 1
+        self.encoded_bytes += len(data)
+        self.encode_time += time.perf_counter() - t
+        state = (self._seq, engine.width, engine.height, colors, info)
+        self.loop.call_soon_threadsafe(self._fanout, data, state)
+        return len(data)
+
+    def current_keyframe(self):
+        """最新状态的关键帧 同一帧只编码一次 在事件循环线程中调用"""
+        if self._state is None:
+            return None
+        if self._keyframe is None or self._keyframe[0] != self._state[0]:
+            self._keyframe = (self._state[0], encode_keyframe(*self._state))
+        return self._keyframe[1]
+
+    def _fanout(self, data, state):
+        """事件循环线程 同一份字节发给每个观众"""
+        self._state = state
+        for client in list(self.clients):
+            r = client.send(data)
+            if r == 'coalesced':
+                self.coalesced += 1
+            elif r == 'dropped':
+                self.dropped += 1
+
+
+async def _read_message(reader):
+    """读一条带长度前缀的消息 连接关闭时返回None"""
+    n = shift = 0
+    while True:
+        b = await reader.read(1)
+        if not b:
+            return None
+        n |= (b[0] & 0x7f) << shift
+        if b[0] < 0x80:
+            break
+        shift += 7
+    try:
+        return await reader.readexactly(n)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def watch(host, port):
+    """
+    终端观战 画面与终端版相同
+    :param host: 服务器地址
+    :param port: 服务器端口
+    :return: None
+    """
+    from . import tetris as frontend
+
+    async def run():
+        reader, _ = await asyncio.open_connection(host, port)
+        colors, width = None, 0
+        frontend.tetris_init()
+        while True:
+            payload = await _read_message(reader)
+            if payload is None:
+                break
+            kind, seq, info, data = decode(payload)
+            if kind == MSG_KEYFRAME:
+                width, height, colors = data
+                cells = enumerate(colors)
+            elif colors is None:
+                continue
+            else:
+                cells = data
+            for i, c in cells:
+                y, x = divmod(i, width)
+                frontend.SCREEN.put(x + frontend.GAME_AREA_X, y + frontend.GAME_AREA_Y,
+                                    frontend.GAME_PALETTE[c], frontend.GAME_SQUARE)
+            count, score, next_type, key = info
+            x, y = frontend.INFO_AREA_X, frontend.INFO_AREA_Y
+            # 与终端版计分板相同的布局
+            str_len = frontend.INFO_AREA_L - frontend.GAME_AREA_X + 1
+            frontend.SCREEN.text(x, y, '按键：{:<{}}'.format(key, (str_len - 3) * 2))
+            frontend.SCREEN.text(x, y + 2, '方块数：{:<{}}'.format(count, (str_len - 4) * 2))
+            frontend.SCREEN.text(x, y + 4, '方块：{:<{}}'.format(next_type, (str_len - 3) * 2))
+            frontend.SCREEN.text(x, y + 6, '得分：{:<{}}'.format(score, (str_len - 3) * 2))
+            frontend.SCREEN.text(x, y + 9, '观战中')
+            frontend.SCREEN.flush()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    frontend.restore_cursor()
+
+
+def _spectators(host, port, n, seconds, result):
+    """压力测试的观众进程 打开n个连接 统计每个连接收到的完整帧数"""
+    async def one(frames, i):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            return
+        end = time.monotonic() + seconds
+        buf = bytearray()
+        try:
+            while time.monotonic() < end:
+                data = await asyncio.wait_for(reader.read(65536), max(end - time.monotonic(), 0.01))
+                if not data:
+                    break
+                buf += data
+                pos = 0
+                while pos < len(buf):
+                    try:
+                        size, p = read_varint(buf, pos)
+                    except IndexError:
+                        break
+                    if p + size > len(buf):
+                        break
+                    pos = p + size
+                    frames[i] += 1
+                del buf[:pos]
+        except asyncio.TimeoutError:
+            pass
+        writer.close()
+
+    async def run():
+        frames = [0] * n
+        await asyncio.gather(*(one(frames, i) for i in range(n)))
+        return frames
+
+    result.put(asyncio.run(run()))
+
+
+def bench(n=1000, seconds=5.0, fps=50, seed=0):
+    """
+    压力测试 另一个进程打开n个观众连接 本进程用随机按键推进游戏并广播
+    :param n: 观众数
+    :param seconds: 广播时长
+    :param fps: 每秒帧数
+    :param seed: 种子
+    :return: 结果字典
+    """
+    import random
+    from .engine import ACTIONS
+
+    server = Broadcaster(0, '127.0.0.1').start()
+    result = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_spectators, args=('127.0.0.1', server.port, n, seconds + 2, result))
+    proc.start()
+    deadline = time.monotonic() + 2
+    while len(server.clients) < n and time.monotonic() < deadline:
+        time.sleep(0.05)
+    engine, rng = TetrisEngine(seed), random.Random(seed)
+    worst, samples = 0.0, deque(maxlen=100000)
+    frame = 1 / fps
+    t0 = next_t = time.monotonic()
+    while time.monotonic() - t0 < seconds:
+        delay = next_t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_t += frame
+        if engine.game_over:
+            engine.reset(rng.getrandbits(64))
+        action = rng.choice(ACTIONS[:4] + ('to_d',) * 4)
+        engine.step(action)
+        t = time.perf_counter()
+        server.publish(engine)
+        samples.append(time.perf_counter() - t)
+    frames = result.get()
+    proc.join()
+    server.stop()
+    samples = sorted(samples)
+    return {
+        'spectators': n,
+        'connected': sum(1 for f in frames if f),
+        'frames': server.frames,
+        'min_received': min(frames) if frames else 0,
+        'mean_received': sum(frames) / len(frames) if frames else 0.0,
+        'bytes_per_frame': server.encoded_bytes / server.frames if server.frames else 0.0,
+        'publish_p50_us': samples[len(samples) // 2] * 1e6,
+        'publish_max_us': samples[-1] * 1e6,
+        'coalesced': server.coalesced,
+        'dropped': server.dropped,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tetris.spectate', description='观战客户端与广播压力测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_watch = sub.add_parser('watch', help='连接观战服务器 在终端中观看')
+    p_watch.add_argument('address', help='HOST:PORT')
+    p_bench = sub.add_parser('bench', help='本机压力测试')
+    p_bench.add_argument('-n', '--spectators', type=int, default=1000, help='观众连接数')
+    p_bench.add_argument('-t', '--seconds', type=float, default=5.0, help='广播时长 秒')
+    p_bench.add_argument('--fps', type=int, default=50, help='每秒帧数')
+    args = parser.parse_args(argv)
+    if args.command == 'watch':
+        host, _, port = args.address.rpartition(':')
+        watch(host or 'localhost', int(port))
+        return 0
+    r = bench(args.spectators, args.seconds, args.fps)
+    sys.stderr.write('{connected}/{spectators} spectators {frames} frames {bytes_per_frame:.0f} B/frame, '
+                     'received min {min_received} mean {mean_received:.0f}, publish p50 {publish_p50_us:.0f}us '
+                     'max {publish_max_us:.0f}us, coalesced {coalesced} dropped {dropped}\n'.format(**r))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
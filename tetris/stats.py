@@ -0,0 +1,189 @@
+# encoding:utf-8
+# file: stats.py
+# date: 2020-03-08
+# author: Jason
+
+
+# ##########################
+# 性能统计 各阶段每tick耗时直方图
+# ##########################
+
+
+import json
+import time
+
+
+# 阶段 等待按键 引擎推进 消行 绘制到帧缓冲 输出到终端
+PHASES = ('input', 'logic', 'eliminate', 'render', 'output')
+# 直方图桶数 第i个桶为[2^(i-1), 2^i)纳秒 最后一个桶收下所有更大的值
+BUCKETS = 40
+
+
+def format_ns(ns):
+    """
+    纳秒数格式化为带单位的短字符串 最多5个字符
+    :param ns: 纳秒数
+    :return: 字符串
+    """
+    for unit, scale in (('s', 10 ** 9), ('ms', 10 ** 6), ('us', 10 ** 3)):
+        if ns >= scale:
+            v = ns / scale
+            return '{:.1f}{}'.format(v, unit) if v < 10 else '{:.0f}{}'.format(v, unit)
+    return '{}ns'.format(ns)
+
+
+class Histogram(object):
+    """
+    固定桶的耗时直方图 按2的幂分桶 记录一次是一次bit_length与一次列表自增
+    分位数返回所在桶的上界 精度为2倍以内 足以看出卡顿
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count, self.total, self.max = 0, 0, 0
+
+    def add(self, ns):
+        """
+        记录一个耗时
+        :param ns: 纳秒数
+        :return: None
+        """
+        b = ns.bit_length()
+        self.counts[b if b < BUCKETS else BUCKETS - 1] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q):
+        """
+        :param q: 0到1之间
+        :return: 分位数所在桶的上界 纳秒 没有记录时为0
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(1 << i, self.max)
+        return self.max
+
+    def to_dict(self):
+        """转为可JSON序列化的字典"""
+        return {
+            'count': self.count,
+            'mean_ns': self.total / self.count if self.count else 0.0,
+            'p50_ns': self.percentile(0.50),
+            'p90_ns': self.percentile(0.90),
+            'p99_ns': self.percentile(0.99),
+            'max_ns': self.max,
+            'buckets': self.counts[:],
+        }
+
+
+class Profiler(object):
+    """
+    按阶段统计每tick耗时 被测函数在启用时才被替换为计时包装 不启用时没有任何开销
+    嵌套调用只计自身耗时 例如move_block中的绘制计入render 不计入logic
+    每个阶段在一个tick内的耗时先累加 end_tick时各记录一次
+    """
+
+    def __init__(self):
+        self.hists = {phase: Histogram() for phase in PHASES}
+        # 整个tick的耗时 不含等待按键
+        self.tick_hist = Histogram()
+        self.ticks = 0
+        self._acc = dict.fromkeys(PHASES, 0)
+        # 调用栈上每层已被子调用占用的耗时
+        self._stack = []
+        self._tick_start = None
+
+    def wrap(self, func, phase):
+        """
+        生成计时包装函数
+        :param func: 被测函数
+        :param phase: 阶段名 见PHASES
+        :return: 包装函数
+        """
+        acc, stack, clock = self._acc, self._stack, time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            stack.append(0)
+            t = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                dt = clock() - t
+                acc[phase] += dt - stack.pop()
+                if stack:
+                    stack[-1] += dt
+        return timed
+
+    def instrument(self, namespace, phases):
+        """
+        替换命名空间中的函数为计时包装 模块内部按全局名调用的函数都会被计时
+        :param namespace: 模块的globals()或对象
+        :param phases: {函数名: 阶段名}
+        :return: None
+        """
+        for name, phase in phases.items():
+            if isinstance(namespace, dict):
+                namespace[name] = self.wrap(namespace[name], phase)
+            else:
+                setattr(namespace, name, self.wrap(getattr(namespace, name), phase))
+
+    def record(self, phase, ns):
+        """
+        直接记录一次耗时 不经过tick累加 供输出线程每帧调用
+        直方图只在本线程自增 游戏线程读到的统计最多差一帧
+        :param phase: 阶段名 见PHASES
+        :param ns: 纳秒数
+        :return: None
+        """
+        self.hists[phase].add(ns)
+
+    def begin_tick(self):
+        """等待按键之后调用 开始计tick耗时"""
+        self._tick_start = time.perf_counter_ns()
+
+    def end_tick(self):
+        """一个tick结束 本tick各阶段的耗时记入直方图"""
+        if self._tick_start is not None:
+            self.tick_hist.add(time.perf_counter_ns() - self._tick_start)
+            self._tick_start = None
+        acc, hists = self._acc, self.hists
+        for phase, ns in acc.items():
+            if ns:
+                hists[phase].add(ns)
+                acc[phase] = 0
+        self.ticks += 1
+
+    def to_dict(self, screen=None):
+        """
+        全部统计 转为可JSON序列化的字典
+        :param screen: 帧缓冲 给出时附带写标准输出的次数与字节数
+        :return: 字典
+        """
+        data = {
+            'ticks': self.ticks,
+            'tick': self.tick_hist.to_dict(),
+            'phases': {phase: h.to_dict() for phase, h in self.hists.items()},
+        }
+        if screen is not None:
+            data['writes'], data['bytes'] = screen.frames, screen.total_bytes
+        return data
+
+    def dump(self, path, screen=None):
+        """
+        写入JSON文件
+        :param path: 文件路径
+        :param screen: 同to_dict
+        :return: None
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(screen), f, indent=2, sort_keys=True)
+            f.write('\n')
@@ -10,12 +10,31 @@
 # ##########################
 
 
-import time
+import argparse
+import os
 import random
+import shutil
 import sys
-import select
-import copy
-import termios
+import time
+from collections import deque
+
+if __name__ == '__main__' and not __package__:
+    # 以脚本方式直接运行时 用上级目录替换脚本目录 以tetris包的身份导入同包模块
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = 'tetris'
+
+from .ai import Planner
+from .dataset import Exporter
+from .engine import BOARD_WIDTH, BOARD_HEIGHT, KEY_ACTIONS, TetrisEngine
+from .netplay import NetSession
+from .render import RenderThread, Screen, SGR_RESET, probe_scroll
+from .replay import Recorder
+from .scheduler import REPEAT_DELAY, Scheduler
+from .selfplay import POLICIES
+from .soak import SoakMonitor, format_sample
+from .spectate import Broadcaster
+from .stats import Profiler, format_ns
+from .shapes import BLOCK_DICT, BLOCK_TYPES
 
 
 # #################
@@ -27,77 +46,76 @@ import termios
 
 # 下面的方块指7种基本方块 小方块指构成基本方块的最小单位
 # 终端使用等宽字体时 小方块正好是个小正方形 1个小方块由2个英文字符组成
-# 游戏区域即游戏地图的长与高
-GAME_AREA_L, GAME_AREA_H = 16, 26
+# 游戏区域的长与高 默认与引擎默认地图尺寸一致 地图更大时由configure按终端尺寸设置
+GAME_AREA_L, GAME_AREA_H = BOARD_WIDTH, BOARD_HEIGHT
+# 视口左上角的地图索引 地图比游戏区域大时游戏区域只显示视口内的地图 视口跟随当前方块
+VIEW_X, VIEW_Y = 0, 0
+# 当前方块离视口边缘不足此距离时 视口移动到以方块为中心
+VIEW_MARGIN = 3
 # 游戏区域内左上角坐标为坐标原点 X为横坐标 Y为纵坐标
 GAME_AREA_X, GAME_AREA_Y = 2, 2
 # 游戏边框图形 基本方块的小方块渲染图形
 GAME_EDGE, GAME_SQUARE = '##', '  '
 # 游戏区域背景色
 GAME_BKGCOLOR = '\033[40;30m'
-# 游戏区域位图 即游戏地图
-GAME_BITMAP = [[[0, GAME_BKGCOLOR] for y in range(GAME_AREA_L)] for x in range(GAME_AREA_H)]
+# 落点预览的小方块图形与颜色
+GAME_GHOST, GAME_GHOSTCOLOR = '[]', '\033[40;37m'
+# 游戏引擎 地图 方块与计分等游戏状态都在引擎中 本文件只负责终端输入输出
+ENGINE = TetrisEngine(width=GAME_AREA_L, height=GAME_AREA_H)
 
 # 方块相关变量
 
-# 7方块初始状态位图 2,2位置为方块实际长与高 3,3位置为此方块颜色
-BLOCK_DICT = {
-    # 天蓝色
-    'I': [[1, 1, 1, 1],
-          [0, 0, 0, 0],
-          [0, 0, [4, 1], 0],
-          [0, 0, 0, '\033[46;36m']],
-    # 蓝色
-    'J': [[1, 0, 0, 0],
-          [1, 1, 1, 0],
-          # [3,2]表示此方块长3高2 索引正好相反 x=2为两行y=3为三列
-          # 3,2为游戏区域的坐标表示法的长与度 2,3为对应的二维列表索引表示法
-          [0, 0, [3, 2], 0],
-          [0, 0, 0, '\033[44;34m']],
-    # 白色
-    'L': [[0, 0, 1, 0],
-          [1, 1, 1, 0],
-          [0, 0, [3, 2], 0],
-          [0, 0, 0, '\033[47;37m']],
-    # 黄色
-    'O': [[1, 1, 0, 0],
-          [1, 1, 0, 0],
-          [0, 0, [2, 2], 0],
-          [0, 0, 0, '\033[43;33m']],
-    # 绿色
-    'S': [[0, 1, 1, 0],
-          [1, 1, 0, 0],
-          [0, 0, [3, 2], 0],
-          [0, 0, 0, '\033[42;32m']],
-    # 紫色
-    'T': [[0, 1, 0, 0],
-          [1, 1, 1, 0],
-          [0, 0, [3, 2], 0],
-          [0, 0, 0, '\033[45;35m']],
-    # 红色
-    'Z': [[1, 1, 0, 0],
-          [0, 1, 1, 0],
-          [0, 0, [3, 2], 0],
-          [0, 0, 0, '\033[41;31m']]
-}
-# 方块存储位图
-BLOCK_BITMAP = [[0, 0, [0, 0], 0] if i == 2 else [0, 0, 0, 0] for i in range(4)]
-# 定义方块出生点的方块左上角的地图坐标
-BLOCK_SX, BLOCK_SY = GAME_AREA_X + GAME_AREA_L // 2 - 2, GAME_AREA_Y
-# 方块左上角地图坐标
-BLOCK_COORD = {'x': BLOCK_SX, 'y': BLOCK_SY}
-# 生成方块计数 得分 方块类型
-BLOCK_COUNT, GAME_SCORE, BLOCK_TYPE = 0, 0, '_'
+# 7种方块位图定义见shapes.BLOCK_DICT
+# 调色板 索引0为背景色 其余依次为7种方块的颜色
+GAME_PALETTE = [GAME_BKGCOLOR] + [BLOCK_DICT[t][-1][-1] for t in BLOCK_TYPES]
+# 7种方块4个旋转状态的预编译形状表
+BLOCK_SHAPES = ENGINE.shapes
 
 # 按键和信息相关变量
 
-# 按键变量 按键检测间隔 方块打印间隔
-KEY_DEFAULT, KEY_PAUSE = '_', ' '
-KEY, KEY_INTERVAL, PNT_INTERVAL = KEY_DEFAULT, 0.01, 0.2
+# 按键变量 方块下落间隔
+KEY_DEFAULT, KEY_PAUSE, KEY_STATS, KEY_REWIND = '_', ' ', 'i', 'z'
+KEY, PNT_INTERVAL = KEY_DEFAULT, 0.2
+# 按键与下落调度 阻塞到下一个按键或下一次下落 不再轮询
+SCHEDULER = Scheduler(PNT_INTERVAL)
+# 已读到还没执行的按键 一次读到的按键在同一帧内依次执行
+KEYS = deque()
+# 自动模式的落点搜索器 --ai时创建 待执行的按键 已规划的方块计数 自动模式下每步的间隔
+AI, AI_KEYS, AI_COUNT, AI_INTERVAL = None, deque(), 0, 0.02
+# 悔棋历史 每个方块出现时保存一次引擎快照 快照之间共用没有修改的地图块 最多保存这么多个方块
+REWIND_DEPTH = 1000
+HISTORY = deque(maxlen=REWIND_DEPTH)
 # 计分板左上角坐标
 INFO_AREA_X, INFO_AREA_Y = GAME_AREA_X + GAME_AREA_L + 2, GAME_AREA_Y + 1
 # 计分板区域长与高
 INFO_AREA_L, INFO_AREA_H = 8, GAME_AREA_H
+# 上次打印的计分板信息 没有变化时不重新格式化
+INFO_LAST = None
+
+# 对局录制器 --record时创建 每个tick记录一次按键
+RECORDER = None
+
+# 训练数据导出器 --export时创建 每次固定方块记录一条
+EXPORTER = None
+
+# 观战广播服务器 --spectate时创建 每个tick发布一帧
+SPECTATORS = None
+
+# 性能统计 --stats时创建 统计叠加层是否显示 显示时每多少个tick刷新一次
+PROFILER, STATS_SHOWN, STATS_EVERY = None, False, 10
+
+# 网络对战相关变量
+
+# 网络对战连接 --host/--join时创建 对方的游戏由对方的按键在本地模拟
+VERSUS = None
+# 对方地图在计分板中的位置 1个字符显示1列2行 半块字符依次为 都空 上有 下有 都有
+P2_AREA_X, P2_AREA_Y = INFO_AREA_X - 1, INFO_AREA_Y + 12
+P2_HALF_BLOCKS = ' ▀▄█'
+
+# 终端帧缓冲 覆盖边框 游戏区域与计分板 每个tick差分后一次性输出
+SCREEN = Screen(GAME_AREA_L + INFO_AREA_L + 3, GAME_AREA_H + 2)
+# 输出线程 --fps不为0时创建 差分与写终端不在游戏线程中 默认最高帧率
+RENDERER, RENDER_FPS = None, 60
 
 
 # #################
@@ -152,8 +170,8 @@ def _edge_block(x=1, y=1, ln=1, h=1, b=GAME_EDGE):
     :return: None
     """
     for _y in range(y, y + h):
-        goto_blockxy(x, _y)
-        print('{}'.format(b * ln))
+        for _x in range(x, x + ln):
+            SCREEN.put(_x, _y, SGR_RESET, b)
 
 
 def draw_edge(x=1, y=1):
@@ -175,74 +193,66 @@ def draw_edge(x=1, y=1):
 # 包括地图中方块清除 地图中方块显示等
 
 
-def _clear_map_area(x, y, ln, h):
-    """
-    清除地图位图
-    :param x: 坐标表示法的x
-    :param y: 坐标表示法的y
-    :param ln: 清除区域长度
-    :param h: 清除区域高度
-    :return: None
-    """
-    map_x, map_y = x - GAME_AREA_X, y - GAME_AREA_Y
-    for _x in range(map_x, map_x + ln):
-        for _y in range(map_y, map_y + h):
-            # 坐标表示法与索引表示法互换
-            GAME_BITMAP[_y][_x] = [0, GAME_BKGCOLOR]
-
-
-def _fill_map_point(x, y, color):
-    """
-    填充地图位图点
-    :param x: 坐标x
-    :param y: 坐标y
-    :param color: 颜色字符串转义序列
-    """
-    map_x, map_y = x - GAME_AREA_X, y - GAME_AREA_Y
-    GAME_BITMAP[map_y][map_x] = [1, color]
-
-
-def _clear_blockline(lenght=1, block=GAME_SQUARE, bkg=GAME_BKGCOLOR):
+def _clear_blockline(x, y, lenght=1, block=GAME_SQUARE, bkg=GAME_BKGCOLOR):
     """
     填充指定长度方块为背景色 即清除方块
+    :param x: 起始x坐标
+    :param y: 起始y坐标
     :param lenght: 方块长度 每个小方块占2英文字符宽度
     :param block: 填充的小方块
     :param bkg: 填充的背景色
     :return: None
     """
-    # 因为标准输出缓冲区的原因 不要传参end='' 否则打印内容可能不会立刻显示
-    print('{}{}\033[0m'.format(bkg, block * lenght))
+    for _x in range(x, x + lenght):
+        SCREEN.put(_x, y, bkg, block)
 
 
-def clear_area(x=GAME_AREA_X, y=GAME_AREA_Y, ln=GAME_AREA_L, h=GAME_AREA_H):
+def clear_area(x=GAME_AREA_X, y=GAME_AREA_Y, ln=None, h=None):
     """
     清除指定矩形区域 清除的最小单位是小方块 即2个英文字符 游戏区域为黑色背景
     :param x: 起始x坐标
     :param y: 起始y坐标
-    :param ln: 区域长度
-    :param h: 区域高度
+    :param ln: 区域长度 None为游戏区域长
+    :param h: 区域高度 None为游戏区域高
     :return: None
     """
+    ln = GAME_AREA_L if ln is None else ln
+    h = GAME_AREA_H if h is None else h
     for _y in range(y, y + h):
-        goto_blockxy(x, _y)
-        _clear_blockline(ln)
-    _clear_map_area(x, y, ln, h)
+        _clear_blockline(x, _y, ln)
 
 
-def print_map_area(x, y, ln=GAME_AREA_L, h=GAME_AREA_H):
+def print_map_area(x, y, ln=None, h=None):
     """
-    根据地图位图刷新游戏区域
+    根据地图位图刷新游戏区域 游戏区域显示视口内的地图
     :param x: 地图起点坐标x
     :param y: 地图起点坐标y
-    :param ln: 区域长
-    :param h: 区域高
+    :param ln: 区域长 None为游戏区域长
+    :param h: 区域高 None为游戏区域高
+    :return: None
+    """
+    ln = GAME_AREA_L if ln is None else ln
+    h = GAME_AREA_H if h is None else h
+    board = ENGINE.board
+    map_x, map_y = x - GAME_AREA_X + VIEW_X, y - GAME_AREA_Y + VIEW_Y
+    for _y in range(h):
+        for _x in range(ln):
+            color = GAME_PALETTE[board.color(map_x + _x, map_y + _y)]
+            SCREEN.put(x + _x, y + _y, color, GAME_SQUARE)
+
+
+def _view_put(x, y, sgr, text=GAME_SQUARE):
+    """
+    把地图索引x,y处的小方块画到游戏区域 在视口之外时不画
+    :param x: 列索引
+    :param y: 行索引
+    :param sgr: 颜色转义序列
+    :param text: 小方块图形
     :return: None
     """
-    map_x, map_y = x - GAME_AREA_X, y - GAME_AREA_Y
-    for _x in range(map_y, map_y + h):
-        for _y in range(map_x, map_x + ln):
-            goto_blockxy(_y + GAME_AREA_Y, _x + GAME_AREA_X)
-            print('{}{}\033[0m'.format(GAME_BITMAP[_x][_y][1], GAME_SQUARE))
+    x, y = x - VIEW_X, y - VIEW_Y
+    if 0 <= x < GAME_AREA_L and 0 <= y < GAME_AREA_H:
+        SCREEN.put(x + GAME_AREA_X, y + GAME_AREA_Y, sgr, text)
 
 
 def _print_map_bits():
@@ -251,13 +261,13 @@ def _print_map_bits():
     :return: None
     """
     a, b = GAME_AREA_X + GAME_AREA_L + INFO_AREA_L + 3, GAME_AREA_Y
-    for x in range(len(GAME_BITMAP)):
+    for x in range(ENGINE.height):
         goto_blockxy(a, b)
-        for y in range(len(GAME_BITMAP[0])):
-            if GAME_BITMAP[x][y][0] == 1:
-                print('\033[31m{}\033[0m,'.format(GAME_BITMAP[x][y][0]), end='')
+        for y in range(ENGINE.width):
+            if ENGINE.board.get(y, x):
+                print('\033[31m1\033[0m,', end='')
             else:
-                print('{},'.format(GAME_BITMAP[x][y][0]), end='')
+                print('0,', end='')
         b += 1
 
 
@@ -273,6 +283,30 @@ def restore_cursor():
     print('\033[?25h')
 
 
+def present():
+    """
+    一个tick画完 有输出线程时交给它 否则直接输出一帧
+    :return: None
+    """
+    if RENDERER is None:
+        SCREEN.flush()
+    else:
+        RENDERER.notify()
+
+
+def finish_output():
+    """
+    输出最后一帧 有输出线程时停止它 之后可以直接打印文本
+    :return: None
+    """
+    global RENDERER
+    if RENDERER is None:
+        SCREEN.flush()
+    else:
+        RENDERER.stop()
+        RENDERER = None
+
+
 def tetris_init():
     """初始化工作
     """
@@ -285,485 +319,609 @@ def tetris_init():
 
 
 # 方块处理函数
-# 包括选取方块 打印方块 方块旋转 方块平移等函数
-
-
-def _pick_block(b_bitmap, b_type):
-    """
-    选取特定类型的方块
-    :param b_bitmap: 方块位图
-    :param b_type: 方块类型
-    :return: None
-    """
-    for x in range(4):
-        for y in range(4):
-            b_bitmap[x][y] = BLOCK_DICT[b_type][x][y]
+# 包括打印方块 清除方块 按方向推进游戏引擎等函数
 
 
-def print_block(x, y, b_bitmap, fill_flag=True):
+def print_block(x, y, shape, clear_flag=False):
     """
     打印一种方块
     :param x: 起始点x
     :param y: 起始点y
-    :param b_bitmap: 方块位图
-    :param fill_flag: 填充地图位图标记 False为单纯打印方块不填充
+    :param shape: 方块形状表项
+    :param clear_flag: 先清除4x4区域 用于下个方块预览
     :return: None
     """
-    if not fill_flag:
-        # 清除上个方块
-        for _x in range(len(b_bitmap)):
-            for _y in range(len(b_bitmap[0])):
-                goto_blockxy(_y + x, _x + y)
-                print('{}'.format(GAME_SQUARE))
-    b_l, b_h = b_bitmap[-2][-2][0], b_bitmap[-2][-2][1]
-    b_color = b_bitmap[-1][-1]
-    # 这里的_x,_y为索引表示法 参数x,y为坐标表示法
-    for _y in range(b_l):
-        for _x in range(b_h):
-            # 必须判断是否等于1 不要用True/False判断
-            # b_bitmap坐标互换 让位图中所有1呈现的图像与实际打印的图像一致
-            # 即b_bitmap中纵向扫描 print也纵向打印
-            if b_bitmap[_x][_y] == 1:
-                # 方块位图坐标转换游戏区域坐标 索引到坐标表示法需互换坐标
-                goto_blockxy(_y + x, _x + y)
-                if fill_flag:
-                    _fill_map_point(_y + x, _x + y, b_color)
-                # 打印行数超过终端窗口高度 可能会提前折行导致方块错乱
-                print('{}{}\033[0m'.format(b_color, GAME_SQUARE))
-
-
-def _copy_rotatedblock(rotated_block, origin_block):
-    """
-    方块拷贝函数
-    :param rotated_block: 旋转后的方块位图
-    :param origin_block: 原始方块位图 必须是4x4方块
+    if clear_flag:
+        # 清除上个方块 预览区为4x4
+        for _x in range(4):
+            for _y in range(4):
+                SCREEN.put(_x + x, _y + y, SGR_RESET, GAME_SQUARE)
+    b_color = GAME_PALETTE[shape.color]
+    # 这里的dx,dy为小方块相对方块左上角的偏移 参数x,y为坐标表示法
+    for dx, dy in shape.cells:
+        SCREEN.put(dx + x, dy + y, b_color, GAME_SQUARE)
+
+
+def print_preview():
+    """
+    打印下个方块预览 网络对战时预览区显示对方地图 不打印
     :return: None
     """
-    b_length, b_height = origin_block[-2][-2][0], origin_block[-2][-2][1]
-    for _x in range(4):
-        for _y in range(4):
-            if _x < b_length and _y < b_height:
-                # 原始方块长x高 => 位图[高][长] => 旋转后方块的 位图[长][高]
-                # 所以这里_x是b_length _y是b_height
-                origin_block[_x][_y] = rotated_block[_x][_y]
-            elif _x == _y and _x == 2:
-                # 长x高变换
-                origin_block[_x][_y] = origin_block[_x][_y][::-1]
-            elif _x == _y and _x == 3:
-                # 颜色值不改变
-                continue
-            else:
-                origin_block[_x][_y] = 0
+    if VERSUS is not None:
+        return
+    print_block(INFO_AREA_X, INFO_AREA_Y + 14, BLOCK_SHAPES[ENGINE.next_type][0], clear_flag=True)
 
 
-def copy_block(fr_bitmap: list, to_bitmap: list):
+def print_piece():
     """
-    拷贝方块存储位图
-    :param fr_bitmap: 原始方块
-    :param to_bitmap: 目的方块
-    :return:
+    打印当前方块与其落点预览 落点由地图轮廓直接算出 预览先打印 与方块重叠处被方块覆盖
+    :return: None
     """
-    for i in range(4):
-        for j in range(4):
-            to_bitmap[i][j] = fr_bitmap[i][j]
+    piece, shape = ENGINE.piece, ENGINE.shape
+    x, y = piece.x, piece.y
+    ghost_y = y + ENGINE.drop_distance()
+    for dx, dy in shape.cells:
+        _view_put(x + dx, ghost_y + dy, GAME_GHOSTCOLOR, GAME_GHOST)
+    b_color = GAME_PALETTE[shape.color]
+    for dx, dy in shape.cells:
+        _view_put(x + dx, y + dy, b_color)
 
 
-def _rotate_block(flag=True):
+def _clear_block(x, y, shape):
     """
-    逆时针旋转方块 即求NxM到MxN的转置矩阵
-    :param flag: True生成旋转后的方块 False只旋转不生成旋转后方块
+    清除指定方块 按地图重绘方块所在的点 已固定的点显示其颜色
+    :param x: 方块左上角列索引
+    :param y: 方块左上角行索引
+    :param shape: 方块形状表项
     :return: None
     """
-    b_length, b_height = BLOCK_BITMAP[-2][-2][0], BLOCK_BITMAP[-2][-2][1]
-    # b_lengthXb_height 方块索引表示法即 b_heightXb_length
-    b_target = [[0 for _y in range(b_height)] for _x in range(b_length)]
-    for _y in range(b_length):
-        for _x in range(b_height):
-            # 逆时针旋转90度
-            offset = len(BLOCK_BITMAP[_x]) - b_length
-            b_target[_y][_x] = BLOCK_BITMAP[_x][-_y - 1 - offset]
-    # flag为真 生成旋转后方块
-    if flag:
-        _copy_rotatedblock(b_target, BLOCK_BITMAP)
-    # 生成临时旋转后方块用于检测
-    else:
-        # 拷贝未旋转的方块为模板
-        tmp_bitmap = copy.deepcopy(BLOCK_BITMAP)
-        # 生成为临时方块
-        _copy_rotatedblock(b_target, tmp_bitmap)
-        return tmp_bitmap
+    board = ENGINE.board
+    for dx, dy in shape.cells:
+        _view_put(x + dx, y + dy, GAME_PALETTE[board.color(x + dx, y + dy)])
 
 
-def _edge_detect(x, y, b_bitmap):
+def move_block(direction):
     """
-    方块是否超出游戏地图检测
-    :param x: 方块左上角坐标x
-    :param y: 方块左上角坐标y
-    :param b_bitmap: 方块位图
-    :return: 布尔型
+    移动方块或旋转方块 并刷新画面
+    :param direction: 移动方向 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转 'to_b'落到底
+    :return: 布尔型 游戏是否结束
     """
-    b_l, b_h = b_bitmap[-2][-2][0], b_bitmap[-2][-2][1]
-    if x < GAME_AREA_X or y < GAME_AREA_Y or \
-            x + b_l - 1 >= GAME_AREA_X + GAME_AREA_L or \
-            y + b_h - 1 >= GAME_AREA_Y + GAME_AREA_H:
-        return False
+    global KEY
+    piece = ENGINE.piece
+    x, y, shape = piece.x, piece.y, ENGINE.shape
+    ghost_y = y + ENGINE.drop_distance()
+    top = min(ENGINE.board.top, y)
+    _, _, lines, game_over = ENGINE.step(direction)
+    if follow_view():
+        # 视口移动时重绘整个游戏区域 差分只输出真正变化的单元
+        print_map_area(GAME_AREA_X, GAME_AREA_Y)
+    elif lines:
+        # 有方块消除时 只刷新原先最高小方块到最低消除行之间 下面的行没有移动
+        # 固定的方块即落点预览处 它在最低消除行之下的部分也要重绘 都只取视口内的行
+        bottom = max(ENGINE.cleared[-1], ghost_y + shape.height - 1)
+        scroll_cleared(top)
+        top, bottom = max(top, VIEW_Y), min(bottom, VIEW_Y + GAME_AREA_H - 1)
+        if top <= bottom:
+            print_map_area(GAME_AREA_X, GAME_AREA_Y + top - VIEW_Y, h=bottom - top + 1)
     else:
-        return True
+        _clear_block(x, ghost_y, shape)
+        _clear_block(x, y, shape)
+    if not game_over:
+        print_piece()
+    # 恢复向下移动 区别于get_keys获取的's'
+    KEY = KEY_DEFAULT
+    return game_over
 
 
-def _clear_block(x, y, ln, h):
+def scroll_cleared(top):
     """
-    清除指定方块
-    :param x: 起始x坐标
-    :param y: 起始y坐标
-    :param ln: 区域长度
-    :param h: 区域高度
+    终端支持滚动区域时 让终端把消除行以上的部分直接下移 差分时只需重绘顶部空出的行
+    连续的消除行一次移动 从上到下依次处理 下面的消除行在上面的移动之后位置不变
+    移动的部分超出视口时不滚动 由差分重绘
+    :param top: 消行前最高小方块的行索引
     :return: None
     """
-    for _x in range(x, x + ln):
-        for _y in range(y, y + h):
-            if BLOCK_BITMAP[_y - y][_x - x] == 1:
-                goto_blockxy(_x, _y)
-                # 因为标准输出缓冲区的原因 不要传参end='' 否则打印内容可能不会立刻显示
-                print('{}{}\033[0m'.format(GAME_BKGCOLOR, GAME_SQUARE))
-                # 清除地图点
-                _clear_map_area(_x, _y, 1, 1)
+    cleared = ENGINE.cleared
+    i = 0
+    while i < len(cleared):
+        j = i
+        while j + 1 < len(cleared) and cleared[j + 1] == cleared[j] + 1:
+            j += 1
+        if top < VIEW_Y or cleared[j] >= VIEW_Y + GAME_AREA_H:
+            return
+        SCREEN.scroll_down(GAME_AREA_X, GAME_AREA_Y + top - VIEW_Y, GAME_AREA_L, cleared[j] - top + 1, j - i + 1)
+        i = j + 1
 
 
-def move_block(x, y, direction, distance=1):
+def _follow(start, pos, size, view, total):
     """
-    移动方块或旋转方块
-    :param x: 当前位置x
-    :param y: 当前位置y
-    :param direction: 移动方向 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转
-    :param distance: 移动距离
-    :return: 布尔型
+    视口在一个方向上的起点 方块离视口边缘太近时移动到以方块为中心
+    :param start: 视口当前起点
+    :param pos: 方块起点
+    :param size: 方块长度
+    :param view: 视口长度
+    :param total: 地图长度
+    :return: 视口起点
     """
-    global KEY
-    respawn_flag = False
-    b_l, b_h = BLOCK_BITMAP[-2][-2][0], BLOCK_BITMAP[-2][-2][1]
-    if direction == 'to_l' and _edge_detect(x - distance, y, BLOCK_BITMAP) and \
-            _collision_detect(x - distance, y, 'to_l'):
-        _clear_block(x, y, b_l, b_h)
-        print_block(x - distance, y, BLOCK_BITMAP)
-        BLOCK_COORD['x'], BLOCK_COORD['y'] = x - distance, y
-    elif direction == 'to_r' and _edge_detect(x + distance, y, BLOCK_BITMAP) and \
-            _collision_detect(x + distance, y, 'to_r'):
-        _clear_block(x, y, b_l, b_h)
-        print_block(x + distance, y, BLOCK_BITMAP)
-        BLOCK_COORD['x'], BLOCK_COORD['y'] = x + distance, y
-    elif direction == 'to_d' and _edge_detect(x, y + distance, BLOCK_BITMAP) and \
-            _collision_detect(x, y + distance, 'to_d'):
-        _clear_block(x, y, b_l, b_h)
-        print_block(x, y + distance, BLOCK_BITMAP)
-        BLOCK_COORD['x'], BLOCK_COORD['y'] = x, y + distance
-    elif direction == 'to_d' and (not _edge_detect(x, y + distance, BLOCK_BITMAP)
-                                  or not _collision_detect(x, y + distance, 'to_d')):
-        respawn_flag = True
-    elif direction == 'to_u' and _edge_detect(x, y, _rotate_block(False)) and \
-            _collision_detect_r(x, y, _rotate_block(False)):
-        _clear_block(x, y, b_l, b_h)
-        _rotate_block()
-        print_block(x, y, BLOCK_BITMAP)
-    # 恢复向下移动 区别于get_keys获取的's'
-    KEY = KEY_DEFAULT
-    return respawn_flag
+    margin = min(VIEW_MARGIN, (view - size) // 2)
+    if pos - margin < start or pos + size + margin > start + view:
+        start = pos + size // 2 - view // 2
+    return max(0, min(start, total - view))
 
 
-def spawn_newblock(b_bitmap, t=None):
-    """新方块生成
+def follow_view():
     """
-    global BLOCK_COUNT, BLOCK_TYPE
-    # 方块挑选
-    b_type = 'IJLOSTZ'
-    if t is None:
-        BLOCK_TYPE = random.choice(b_type)
-    else:
-        BLOCK_TYPE = t
-    _pick_block(b_bitmap, BLOCK_TYPE)
-    # 新方块出生点初始化
-    BLOCK_COORD['x'], BLOCK_COORD['y'] = BLOCK_SX, BLOCK_SY
-    BLOCK_COUNT += 1
+    视口跟随当前方块 地图不比游戏区域大时视口不动
+    :return: 布尔型 视口是否移动
+    """
+    global VIEW_X, VIEW_Y
+    piece, shape = ENGINE.piece, ENGINE.shape
+    view = (_follow(VIEW_X, piece.x, shape.width, GAME_AREA_L, ENGINE.width),
+            _follow(VIEW_Y, piece.y, shape.height, GAME_AREA_H, ENGINE.height))
+    if view == (VIEW_X, VIEW_Y):
+        return False
+    VIEW_X, VIEW_Y = view
+    return True
 
 
-# 按键处理函数
-# 包括获取按键 按键转换方向等
+def configure(width=BOARD_WIDTH, height=BOARD_HEIGHT):
+    """
+    设置地图尺寸 重新生成引擎 帧缓冲与布局 在绘制任何内容之前调用
+    游戏区域不超过终端能显示的大小 但不小于默认尺寸 地图更大时只显示跟随当前方块的视口
+    :param width: 地图长 不小于4
+    :param height: 地图高 不小于默认高度 计分板需要这么多行
+    :return: None
+    """
+    global ENGINE, BLOCK_SHAPES, GAME_AREA_L, GAME_AREA_H, VIEW_X, VIEW_Y
+    global INFO_AREA_X, INFO_AREA_H, P2_AREA_X, SCREEN
+    cols, lines = shutil.get_terminal_size()
+    GAME_AREA_L = min(width, max(BOARD_WIDTH, cols // 2 - INFO_AREA_L - 3))
+    GAME_AREA_H = min(height, max(BOARD_HEIGHT, lines - 2))
+    ENGINE = TetrisEngine(width=width, height=height)
+    BLOCK_SHAPES = ENGINE.shapes
+    VIEW_X, VIEW_Y = 0, 0
+    INFO_AREA_X, INFO_AREA_H = GAME_AREA_X + GAME_AREA_L + 2, GAME_AREA_H
+    P2_AREA_X = INFO_AREA_X - 1
+    SCREEN = Screen(GAME_AREA_L + INFO_AREA_L + 3, GAME_AREA_H + 2)
+
+
+def game_tick():
+    """
+    按KEY推进一个tick 打印信息 移动方块 生成新方块时打印预览 回放也使用此函数
+    :return: 布尔型 游戏是否结束
+    """
+    print_info()
+    block_count = ENGINE.count
+    if move_block(get_direction()):
+        return True
+    if ENGINE.count != block_count:
+        print_preview()
+        HISTORY.append(ENGINE.snapshot())
+    return False
 
 
-def get_keys(delay=None):
+def rewind():
     """
-    按键获取函数 p键退出 不支持方向键
-    :param delay: 传递额外延迟
+    悔棋 回到上一个方块出现时的状态 即撤销最近固定的方块 连按继续后退
     :return: None
     """
+    if len(HISTORY) > 1:
+        HISTORY.pop()
+    if HISTORY:
+        ENGINE.restore(HISTORY[-1])
+    follow_view()
+    # 差分只输出真正变化的单元
+    print_map_area(GAME_AREA_X, GAME_AREA_Y)
+    print_piece()
+    print_preview()
+    print_info()
+
+
+def soak(pieces, every, path, policy='random', seed=None):
+    """
+    长时间稳定性测试 无终端自动运行 画面照常绘制与差分 输出写到空设备
+    落点由策略给出 按键序列逐tick执行 之后随重力下落 与自动模式的tick流程相同
+    游戏结束时换下一个种子重新开始 每every个方块采样一次并打印摘要 结束时写时间序列报告
+    :param pieces: 总方块数
+    :param every: 采样间隔 方块数
+    :param path: 报告JSON路径
+    :param policy: 落点策略名 见selfplay.POLICIES
+    :param seed: 第一局的种子 之后每局加1 同时作为策略的随机数种子 None为随机种子
+    :return: 退出码 内存或tick耗时有上升趋势时为1
+    """
     global KEY
-    fd = sys.stdin.fileno()
-    old = termios.tcgetattr(fd)
-    new = termios.tcgetattr(fd)
-    # 关闭回显和回车
-    new[3] = new[3] & ~termios.ECHO & ~termios.ICANON
-    # 在一个方块打印间隔时间内检测times次按键输入
-    # get_keys函数充当sleep函数等待PNT_INTERVAL秒的过程中获取按键
-    count, times = 0, PNT_INTERVAL // KEY_INTERVAL
+    place, rng = POLICIES[policy], random.Random(seed)
+    out, sink = sys.stdout, open(os.devnull, 'w')
+    SCREEN.out = sink.buffer
+    monitor = SoakMonitor(every)
+    clock = time.perf_counter_ns
+    keys, count, done, games = deque(), -1, 0, 0
+    sys.stdout = sink
     try:
-        termios.tcsetattr(fd, termios.TCSADRAIN, new)
-        while count < times:
-            if delay is not None:
-                time.sleep(delay)
-            time.sleep(KEY_INTERVAL)
-            # support non-blocking input
-            if select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], []):
-                KEY = sys.stdin.read(1)
-                if KEY in 'wad':  # 2倍加速移动或旋转
-                    times //= 2
-                if KEY == 's':  # 4倍加速下降
-                    times //= 4
-                # 暂停
-                if KEY == KEY_PAUSE:
-                    break
-            count += 1
-    except KeyboardInterrupt:
-        exit_clear('Get: Ctrl-C to EXIT', 1)
+        monitor.start()
+        tetris_init()
+        print_preview()
+        print_piece()
+        SCREEN.flush()
+        while done + ENGINE.count < pieces:
+            t = clock()
+            if count != ENGINE.count:
+                count = ENGINE.count
+                keys.clear()
+                keys.extend(Planner.keys(ENGINE, *place(ENGINE, rng)))
+            KEY = keys.popleft() if keys else KEY_DEFAULT
+            game_over = game_tick()
+            SCREEN.flush()
+            monitor.tick(clock() - t)
+            if game_over:
+                done += ENGINE.count
+                games += 1
+                ENGINE.reset(None if seed is None else seed + games)
+                count = -1
+                HISTORY.clear()
+                HISTORY.append(ENGINE.snapshot())
+                follow_view()
+                print_map_area(GAME_AREA_X, GAME_AREA_Y)
+                print_preview()
+                print_piece()
+            if monitor.due(done + ENGINE.count):
+                print(format_sample(monitor.sample(done + ENGINE.count)), file=out, flush=True)
+        if monitor.window.count:
+            print(format_sample(monitor.sample(done + ENGINE.count)), file=out)
     finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+        sys.stdout = out
+        monitor.stop()
+        sink.close()
+    monitor.dump(path)
+    failures = monitor.check()
+    print('{:,} pieces in {:,} games, report written to {}'.format(done + ENGINE.count, games + 1, path))
+    for failure in failures:
+        print('FAIL: ' + failure)
+    return 1 if failures else 0
 
 
-def get_direction():
+# 按键处理函数
+# 包括获取按键 按键转换方向等
+
+
+def _wait_keys(wait):
+    """阻塞等待按键 有输出线程时等待期间释放帧缓冲的锁"""
+    keys = wait() if RENDERER is None else RENDERER.unlocked(wait)
+    KEYS.extend(KEY_DEFAULT if key is None else key for key in keys)
+
+
+def get_keys():
     """
-    按键转换为方向 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转
-    :return: 方向
+    按键获取函数 阻塞到有按键或下落时间到 方向键已转为对应按键
+    一次读到的全部按键进入队列 队列中还有按键时不等待 下落时间到时KEY为KEY_DEFAULT
+    :return: None
     """
-    if KEY == 'a':
-        return 'to_l'
-    elif KEY == 'd':
-        return 'to_r'
-    elif KEY == 's':
-        return 'to_d'
-    elif KEY == 'w':
-        return 'to_u'
-    elif KEY == KEY_DEFAULT:
-        return 'to_d'
-
-
-# 碰撞检测与计分函数
-# 包括方块向下运动碰撞检测 地图中方块的消除 消除后计分等
-
-
-def _collision_detect(x, y, direction):
-    """
-    方块与方块之间碰撞检测
-    :param x: 方块左上角坐标x
-    :param y: 方块左上角坐标y
-    :param direction: 移动方向 'to_l'向左 'to_r'向右 'to_d'向下
-    :return: 布尔型
-    """
-    b_l, b_h = BLOCK_BITMAP[-2][-2][0], BLOCK_BITMAP[-2][-2][1]
-    distance = 1000000
-    if direction == 'to_l':
-        for _y in range(y, y + b_h):
-            block_y = _y - y
-            map_y = _y - GAME_AREA_Y
-            for block_x in range(b_l):  # 0->b_l-1
-                if BLOCK_BITMAP[block_y][block_x] == 1:
-                    sx = x - GAME_AREA_X + block_x
-                    for map_x in range(sx, -1, -1):
-                        if GAME_BITMAP[map_y][map_x][0] == 1:
-                            if abs(sx - map_x) < distance:
-                                distance = abs(sx - map_x)
-                                break
-                    break
-    elif direction == 'to_r':
-        for _y in range(y, y + b_h):
-            block_y = _y - y
-            map_y = _y - GAME_AREA_Y
-            for block_x in range(b_l - 1, -1, -1):
-                if BLOCK_BITMAP[block_y][block_x] == 1:
-                    sx = x - GAME_AREA_X + block_x
-                    for map_x in range(sx, len(GAME_BITMAP[0])):
-                        if GAME_BITMAP[map_y][map_x][0] == 1:
-                            if abs(map_x - sx) < distance:
-                                distance = abs(map_x - sx)
-                                break
-                    break
-    elif direction == 'to_d':
-        for _x in range(x, x + b_l):
-            block_x = _x - x
-            map_x = _x - GAME_AREA_X
-            for block_y in range(b_h - 1, -1, -1):
-                # 从左往右从下往上 寻找方块上第一个值为1的点 纵坐标为block_y
-                if BLOCK_BITMAP[block_y][block_x] == 1:
-                    # 从block_y映射到地图对应的点的下一个点 此点为方块下次将到达的点 纵坐标起点为sy
-                    # 传递y的实参为y + distance 已包含移动方向distance
-                    sy = y - GAME_AREA_Y + block_y
-                    # 从sy开始竖直向下到地图纵坐标最大值len(GAME_BITMAP) 查找值为1的地图点
-                    for map_y in range(sy, len(GAME_BITMAP)):
-                        if GAME_BITMAP[map_y][map_x][0] == 1:
-                            # 计算地图点map_y到方块下次将到达的点sy之间距离
-                            if abs(map_y - sy) < distance:
-                                distance = abs(map_y - sy)
-                                break
-                    # 只需要查找一次地图上的点
-                    break
-    # 距离为0 则为假 表示点有重叠 不能移动
-    return distance
-
-
-def _collision_detect_r(x, y, b_bitmap):
-    """
-    旋转后碰撞检测
-    :param x: 方块左上角坐标x
-    :param y: 方块左上角坐标y
-    :param b_bitmap: 临时方块位图
-    :return: 布尔型
-    """
-    # 迭代临时方块与对应地图上的点
-    for _x in range(4):
-        for _y in range(4):
-            # 原始方块和旋转后方块有重叠
-            if b_bitmap[_x][_y] == 1 and BLOCK_BITMAP[_x][_y] == 1:
-                # 排除重叠的点
-                b_bitmap[_x][_y] = 0
-            # 旋转后方块与地图是否有重叠点
-            map_x, map_y = y - GAME_AREA_Y + _x, x - GAME_AREA_X + _y
-            if b_bitmap[_x][_y] == 1 and GAME_BITMAP[map_x][map_y][0] == 1:
-                return False
-    return True
+    global KEY
+    if not KEYS:
+        _wait_keys(SCHEDULER.wait)
+    KEY = KEYS.popleft()
 
 
-def print_info():
-    x, y = INFO_AREA_X, INFO_AREA_Y
-    str_len = INFO_AREA_L - GAME_AREA_X + 1
-    goto_blockxy(x, y)
-    # '按键：'占3个小方块宽度 2个英文字符占一个小方块宽度
-    print('按键：{:<{}}'.format(str(KEY), (str_len - 3) * 2))
-    goto_blockxy(x, y + 2)
-    print('方块数：{:<{}}'.format(str(BLOCK_COUNT), (str_len - 4) * 2))
-    goto_blockxy(x, y + 4)
-    print('方块：{:<{}}'.format(str(BLOCK_TYPE), (str_len - 3) * 2))
-    goto_blockxy(x, y + 6)
-    print('得分：{:<{}}'.format(str(GAME_SCORE), (str_len - 3) * 2))
-    goto_blockxy(x, y + 9)
-    print('按 {}'.format('空格' if KEY_PAUSE == ' ' else KEY_PAUSE))
-    goto_blockxy(x, y + 10)
-    print('暂停/开始')
-    goto_blockxy(x, y + 12)
-    print('下个方块：')
+def wait_resume():
+    """
+    暂停 阻塞到再次按下暂停键 之后重新计算下落时间
+    :return: None
+    """
+    global KEY
+    KEY = KEY_DEFAULT
+    while KEY != KEY_PAUSE:
+        if not KEYS:
+            _wait_keys(SCHEDULER.wait_key)
+        KEY = KEYS.popleft()
+    SCHEDULER.resume()
 
 
-def _is_eliminable(x):
+def ai_key():
     """
-    判断地图位图的某行能否消除
-    :param x: 地图位图索引x
-    :return: 布尔型
+    自动模式的按键 新方块出现时搜索落点 之后每个tick执行一步 做完后随重力下落
+    :return: 按键字符
     """
-    v_count = 0
-    for v in GAME_BITMAP[x]:
-        if v[0] == 1:
-            v_count += 1
-    return v_count == len(GAME_BITMAP[x])
+    global AI_COUNT
+    if AI_COUNT != ENGINE.count:
+        AI_COUNT = ENGINE.count
+        AI_KEYS.clear()
+        move = AI.best(ENGINE)
+        if move is not None:
+            AI_KEYS.extend(AI.keys(ENGINE, *move))
+    return AI_KEYS.popleft() if AI_KEYS else KEY_DEFAULT
 
 
-def _is_emptyline(x):
+def get_direction():
     """
-    判断地图中某行是不是空行
-    :param x: 地图位图索引x
-    :return: 布尔型
+    按键转换为方向 'to_l'向左 'to_r'向右 'to_d'向下 'to_u'原地旋转 映射见engine.KEY_ACTIONS
+    :return: 方向
     """
-    v_count = 0
-    for v in GAME_BITMAP[x]:
-        if v[0] == 0:
-            v_count += 1
-    return v_count == len(GAME_BITMAP[x])
+    return KEY_ACTIONS.get(KEY)
+
 
+# 信息显示函数
+# 碰撞检测 消除与计分都在游戏引擎中 这里只显示计分板
 
-def _do_eliminate(x):
+
+def print_info():
     """
-    消除地图中的某行
-    :param x: 能消除行的索引x
+    打印计分板 信息没有变化时直接返回
     :return: None
     """
-    global GAME_SCORE
-    GAME_SCORE += 1
-    # 向下逐行覆盖消除的行
-    for _x in range(x - 1, -1, -1):
-        GAME_BITMAP[_x + 1] = copy.deepcopy(GAME_BITMAP[_x])
-        if _is_emptyline(_x):
-            break
+    global INFO_LAST
+    info = (KEY, ENGINE.count, ENGINE.next_type, ENGINE.score, AI_COUNT)
+    if info == INFO_LAST:
+        return
+    INFO_LAST = info
+    x, y = INFO_AREA_X, INFO_AREA_Y
+    str_len = INFO_AREA_L - GAME_AREA_X + 1
+    # '按键：'占3个小方块宽度 2个英文字符占一个小方块宽度
+    SCREEN.text(x, y, '按键：{:<{}}'.format(str(KEY), (str_len - 3) * 2))
+    SCREEN.text(x, y + 2, '方块数：{:<{}}'.format(str(ENGINE.count), (str_len - 4) * 2))
+    SCREEN.text(x, y + 4, '方块：{:<{}}'.format(str(ENGINE.next_type), (str_len - 3) * 2))
+    SCREEN.text(x, y + 6, '得分：{:<{}}'.format(str(ENGINE.score), (str_len - 3) * 2))
+    if VERSUS is not None:
+        # 网络对战不能暂停 下半部分为对方信息与地图
+        return
+    SCREEN.text(x, y + 9, '按 {}'.format('空格' if KEY_PAUSE == ' ' else KEY_PAUSE))
+    SCREEN.text(x, y + 10, '暂停/开始')
+    SCREEN.text(x, y + 12, '下个方块：')
+    if AI is not None and not STATS_SHOWN:
+        SCREEN.text(x, y + 19, '搜索：{:<{}}'.format('{:.0f}/s'.format(AI.rate), (str_len - 3) * 2))
 
 
-def eliminate_blocks(x=len(GAME_BITMAP) - 1):
+def print_stats():
     """
-    消除方块函数
-    :param x: 地图位图的某一行 即索引x
+    在计分板下部显示统计叠加层 各阶段每tick耗时的p99与每帧平均字节数 关闭时清除
     :return: None
     """
-    # 从下到上扫描能消除的行 逐行消除 使用递归
-    if x < 0 or _is_emptyline(x):
+    global INFO_LAST
+    x, y = INFO_AREA_X, INFO_AREA_Y + 19
+    str_len = INFO_AREA_L - GAME_AREA_X + 1
+    if not STATS_SHOWN:
+        for i in range(6):
+            SCREEN.text(x, y + i, ' ' * str_len * 2)
+        # 自动模式的搜索速度也在这里 下个tick重新打印
+        INFO_LAST = None
         return
-    if _is_eliminable(x):
-        _do_eliminate(x)
-        eliminate_blocks(x)
-    else:
-        eliminate_blocks(x - 1)
+    hists = PROFILER.hists
+    for i, (phase, label) in enumerate((('input', '输入'), ('logic', '逻辑'), ('eliminate', '消行'),
+                                        ('render', '渲染'), ('output', '输出'))):
+        SCREEN.text(x, y + i, '{}{:>{}}'.format(label, format_ns(hists[phase].percentile(0.99)), (str_len - 2) * 2))
+    SCREEN.text(x, y + 5, '字节{:>{}}'.format('{:.0f}B'.format(SCREEN.bytes_per_frame), (str_len - 2) * 2))
 
 
 # 网络对战功能
 # 包括网络数据传输 输赢判断等
 
 
-def data_transmit():
-    pass
+def data_transmit(key=None):
+    """
+    网络数据传输 只交换按键 不传地图
+    发送本方这个tick的按键 接收对方的按键 对方的游戏确认或回滚后预测到现在 不等待网络
+    :param key: 本方按键 None为只接收
+    :return: None
+    """
+    if key is not None:
+        VERSUS.send(key)
+    VERSUS.poll()
 
 
 def winner_judge():
-    pass
+    """
+    输赢判断 后结束的一方赢
+    :return: 1本方赢 -1对方赢 0平局 None还没有结果
+    """
+    return VERSUS.result()
 
 
 def player2_print_block():
-    pass
+    """
+    在计分板中打印对方的地图与当前方块 1个字符显示1列2行 单色
+    :return: None
+    """
+    engine = VERSUS.remote.engine
+    rows = engine.board.rows[:]
+    if not engine.game_over:
+        piece = engine.piece
+        for i, m in enumerate(engine.shape.masks[piece.x]):
+            rows[piece.y + i] |= m
+    if len(rows) & 1:
+        rows.append(0)
+    half = P2_HALF_BLOCKS
+    for i in range(len(rows) // 2):
+        top, bottom = rows[2 * i], rows[2 * i + 1]
+        line = ''.join(half[(top >> c & 1) | (bottom >> c & 1) << 1] for c in range(engine.width))
+        SCREEN.text(P2_AREA_X, P2_AREA_Y + i, line)
 
 
 def player2_print_info():
-    pass
+    """
+    打印对方的得分与本方的回滚次数
+    :return: None
+    """
+    remote = VERSUS.remote
+    x, y = INFO_AREA_X, INFO_AREA_Y
+    str_len = INFO_AREA_L - GAME_AREA_X + 1
+    SCREEN.text(x, y + 8, '对手得分：{:<{}}'.format(str(remote.engine.score), (str_len - 5) * 2))
+    SCREEN.text(x, y + 10, '回滚：{:<{}}'.format(str(remote.rollbacks), (str_len - 3) * 2))
+
+
+def versus_end(result):
+    """
+    网络对战结束 打印结果并退出
+    :param result: winner_judge的返回值
+    :return: None
+    """
+    VERSUS.finish()
+    finish_output()
+    restore_cursor()
+    exit_clear({1: 'You Win!!!', 0: 'Draw!!!', -1: 'You Lose!!!'}[result], 0)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='终端俄罗斯方块 a/d或方向键左右 s或下键 w或上键旋转 x落到底 z悔棋 空格暂停')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子 相同种子生成相同的方块序列')
+    parser.add_argument('--width', type=int, default=BOARD_WIDTH, help='地图长 最大1000 超出终端时显示跟随方块的视口')
+    parser.add_argument('--height', type=int, default=BOARD_HEIGHT, help='地图高 最大100000')
+    parser.add_argument('--interval', type=float, default=PNT_INTERVAL, help='下落间隔 秒 网络对战时双方应相同')
+    parser.add_argument('--das', type=float, metavar='SECONDS',
+                        help='按住左右或下键多久后开始自动重复 不设置时使用系统的按键重复')
+    parser.add_argument('--arr', type=float, default=0.05, metavar='SECONDS', help='自动重复的间隔')
+    parser.add_argument('--repeat-delay', type=float, default=REPEAT_DELAY, metavar='SECONDS',
+                        help='系统按键重复的初始延迟 按下后这么久内视为按住 应略大于系统设置 点按在此之前也会自动重复')
+    parser.add_argument('--ai', action='store_true', help='自动模式 由落点搜索代替按键 空格仍可暂停')
+    parser.add_argument('--record', metavar='PATH', help='录制对局 用python -m tetris.replay回放')
+    parser.add_argument('--export', metavar='PATH', help='每次固定方块追加一条训练数据 用python -m tetris.dataset查看')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--host', type=int, metavar='PORT', help='网络对战 在PORT端口等待对方连接')
+    group.add_argument('--join', metavar='HOST:PORT', help='网络对战 连接对方')
+    parser.add_argument('--rtt', type=int, default=0, metavar='MS', help='网络对战时注入的往返延迟 毫秒 双方都应设置')
+    parser.add_argument('--spectate', type=int, metavar='PORT',
+                        help='在PORT端口开放观战 用python -m tetris.spectate watch HOST:PORT观看')
+    parser.add_argument('--stats', nargs='?', const='', metavar='PATH',
+                        help='性能统计 按{}键显示各阶段每tick耗时 给出PATH时退出时写入JSON'.format(KEY_STATS))
+    parser.add_argument('--fps', type=int, default=RENDER_FPS,
+                        help='输出线程的最高帧率 终端跟不上时跳过中间帧 0为在游戏线程中同步输出')
+    parser.add_argument('--scroll', choices=('auto', 'lr', 'off'), default='auto',
+                        help='消行时用终端滚动区域移动画面 auto为探测终端能力 off为差分重绘 字节数对比见benchmarks.bench repaint')
+    parser.add_argument('--soak', type=int, metavar='PIECES',
+                        help='稳定性测试 自动模式无终端运行PIECES个方块 内存或tick耗时有上升趋势时退出码为1')
+    parser.add_argument('--soak-policy', choices=sorted(POLICIES), default='random',
+                        help='稳定性测试的落点策略 ai在tracemalloc下很慢')
+    parser.add_argument('--soak-every', type=int, default=10000, metavar='PIECES', help='稳定性测试的采样间隔')
+    parser.add_argument('--soak-report', default='soak.json', metavar='PATH', help='稳定性测试的时间序列报告')
+    args = parser.parse_args()
+    if not 4 <= args.width <= 1000 or not BOARD_HEIGHT <= args.height <= 100000:
+        parser.error('board must be 4..1000 wide and {}..100000 tall'.format(BOARD_HEIGHT))
+    if args.interval <= 0:
+        parser.error('interval must be positive')
+    if args.fps < 0:
+        parser.error('fps must not be negative')
+    if args.das is not None and (args.das < 0 or args.arr <= 0 or args.repeat_delay < 0):
+        parser.error('das and repeat delay must not be negative and arr must be positive')
+    if args.soak is not None:
+        if args.soak <= 0 or args.soak_every <= 0:
+            parser.error('soak pieces and sample interval must be positive')
+        if args.host is not None or args.join or args.spectate is not None or args.record:
+            parser.error('soak runs alone, without network play, spectating or recording')
+    SCHEDULER.das, SCHEDULER.arr, SCHEDULER.delay = args.das, args.arr, args.repeat_delay
+    PNT_INTERVAL = SCHEDULER.interval = args.interval
+    if (args.width, args.height) != (BOARD_WIDTH, BOARD_HEIGHT):
+        # 对方地图与观战画面按默认尺寸布局
+        if args.host is not None or args.join or args.spectate is not None:
+            parser.error('network play and spectating need the default board size')
+        configure(args.width, args.height)
+    ENGINE.reset(args.seed)
+    follow_view()
+    if args.ai:
+        AI = Planner(ENGINE.width, ENGINE.height)
+        SCHEDULER.interval = AI_INTERVAL
+    if args.host is not None:
+        print('waiting for player 2 on port {} ...'.format(args.host))
+        VERSUS = NetSession.host(args.host, ENGINE, SCHEDULER.interval, args.rtt)
+    elif args.join:
+        host, _, port = args.join.rpartition(':')
+        VERSUS = NetSession.join((host or 'localhost', int(port)), ENGINE, SCHEDULER.interval, args.rtt)
+    if args.record:
+        # 在对战握手之后创建 种子以主机为准
+        RECORDER = Recorder(args.record, ENGINE, PNT_INTERVAL)
+    if args.export:
+        EXPORTER = Exporter(args.export, ENGINE.width, ENGINE.height).attach(ENGINE)
+    if args.soak is not None:
+        try:
+            code = soak(args.soak, args.soak_every, args.soak_report, args.soak_policy, args.seed)
+        finally:
+            if EXPORTER is not None:
+                EXPORTER.close()
+        sys.exit(code)
+    if args.spectate is not None:
+        SPECTATORS = Broadcaster(args.spectate).start()
+    if args.stats is not None:
+        # 只在启用时替换为计时包装 不启用时没有开销
+        PROFILER = Profiler()
+        PROFILER.instrument(globals(), {
+            'get_keys': 'input', 'print_info': 'render', 'print_preview': 'render', 'print_piece': 'render',
+            'print_block': 'render', '_clear_block': 'render', 'print_map_area': 'render'})
+        PROFILER.instrument(ENGINE, {'step': 'logic', '_eliminate': 'eliminate'})
+        PROFILER.instrument(SCREEN, {'flush': 'output'})
+    HISTORY.append(ENGINE.snapshot())
     tetris_init()
-    tmp_score = GAME_SCORE
-    block_nextbm = copy.deepcopy(BLOCK_BITMAP)
-    spawn_newblock(block_nextbm)
-    while True:
-        # 生成新方块
-        copy_block(block_nextbm, BLOCK_BITMAP)
-        spawn_newblock(block_nextbm)
-        print_block(INFO_AREA_X, INFO_AREA_Y + 14, block_nextbm, fill_flag=False)
-        print_block(BLOCK_COORD['x'], BLOCK_COORD['y'], BLOCK_BITMAP)
-        down_move_count = 0
-        while True:
-            get_keys()
-            # 暂停
-            if KEY == KEY_PAUSE:
-                KEY = KEY_DEFAULT
-                while KEY != ' ':
-                    try:
-                        get_keys(0.2)
-                    except KeyboardInterrupt:
-                        exit_clear('Get: Ctrl-C to EXIT', 1)
-            # 打印信息
-            print_info()
-            reborn_flag = move_block(BLOCK_COORD['x'], BLOCK_COORD['y'], get_direction())
-            if down_move_count == 0 and reborn_flag:
-                restore_cursor()
-                exit_clear('Gam Over!!!', 0)
-            # 退出循环 生成新方块
-            if reborn_flag:
-                # 消除
-                eliminate_blocks()
-                # 有方块消除时 才全地图刷新
-                if GAME_SCORE > tmp_score:
-                    # _gotoxy_print(28,29, 'in printmaparea')
-                    print_map_area(GAME_AREA_X, GAME_AREA_Y)
-                    tmp_score = GAME_SCORE
-                break
-            # _print_map_bits()
-            down_move_count += 1
+    print_preview()
+    print_piece()
+    try:
+        with SCHEDULER:
+            SCREEN.scroll = probe_scroll(SCHEDULER.fd) if args.scroll == 'auto' else \
+                'lr' if args.scroll == 'lr' else None
+            if args.fps:
+                RENDERER = RenderThread(SCREEN, args.fps, profiler=PROFILER).start()
+            while True:
+                # 输出上个tick的画面变化 一帧一次写入 同一次读到的按键都执行完才输出
+                if not KEYS:
+                    present()
+                get_keys()
+                if PROFILER is not None:
+                    PROFILER.begin_tick()
+                    # 统计叠加层占用对战时对方地图的位置
+                    if KEY == KEY_STATS and VERSUS is None:
+                        STATS_SHOWN = not STATS_SHOWN
+                        print_stats()
+                # 暂停 网络对战时不能暂停
+                if KEY == KEY_PAUSE and VERSUS is None:
+                    wait_resume()
+                elif KEY == KEY_REWIND and VERSUS is None and RECORDER is None:
+                    # 对战时双方状态必须一致 录像按按键重放 都不能悔棋
+                    rewind()
+                elif AI is not None:
+                    KEY = ai_key()
+                if RECORDER is not None:
+                    RECORDER.record(KEY)
+                if VERSUS is not None:
+                    data_transmit(KEY)
+                tick_key = KEY
+                game_over = game_tick()
+                if SPECTATORS is not None:
+                    SPECTATORS.publish(ENGINE, tick_key)
+                if PROFILER is not None:
+                    PROFILER.end_tick()
+                    if STATS_SHOWN and PROFILER.ticks % STATS_EVERY == 0:
+                        print_stats()
+                if VERSUS is not None:
+                    player2_print_block()
+                    player2_print_info()
+                    if game_over:
+                        # 本方已结束 等到能判断输赢为止 期间继续显示对方的游戏
+                        VERSUS.finish()
+                        while winner_judge() is None:
+                            present()
+                            if RENDERER is None:
+                                time.sleep(0.02)
+                            else:
+                                RENDERER.unlocked(time.sleep, 0.02)
+                            data_transmit()
+                            player2_print_block()
+                            player2_print_info()
+                    if winner_judge() is not None:
+                        versus_end(winner_judge())
+                elif game_over:
+                    finish_output()
+                    restore_cursor()
+                    exit_clear('Gam Over!!!' if AI is None else
+                               'Gam Over!!! AI searched {:.0f} placements/s'.format(AI.rate), 0)
+                # _print_map_bits()
+    except (KeyboardInterrupt, EOFError):
+        finish_output()
+        exit_clear('Get: Ctrl-C to EXIT', 1)
+    finally:
+        if RENDERER is not None:
+            RENDERER.stop()
+        if RECORDER is not None:
+            RECORDER.close()
+        if EXPORTER is not None:
+            EXPORTER.close()
+        if VERSUS is not None:
+            VERSUS.close()
+        if SPECTATORS is not None:
+            SPECTATORS.stop()
+        if PROFILER is not None and args.stats:
+            PROFILER.dump(args.stats, SCREEN)